@@ -1,66 +1,168 @@
-from flask import Flask, send_from_directory, render_template, request, jsonify, redirect, url_for, session, send_file
+from flask import Flask, send_from_directory, render_template, request, jsonify, redirect, url_for, session, send_file, Response, g
 from flask_cors import CORS
 import requests
 import json
 import os
-import secrets
 import time
-import traceback
 import base64
 import io
-import asyncio
+import itertools
+import threading
+import hmac
 
-# Try to import Firebase with error handling
+_app_import_started = time.perf_counter()
+
+# Local service modules: imported relatively on Vercel (api package) and directly when run from api/
 try:
+    from .services.streaming import wants_stream, iter_openai_stream, iter_cohere_stream, relay_chat_stream
+    from .services.http_pool import get_session, start_background_warmup
+    from .services.hedging import run_hedged, hedging_enabled, get_hedge_delay, get_hedge_fanout
+    from .services.circuit_breaker import get_breaker, classify_error, breaker_snapshot, CircuitOpenError, SUCCESS
+    from .services.response_cache import get_response_cache, cache_enabled, semantic_cache_enabled, make_cache_key
+    from .services.conversation_store import get_conversation_store, normalize_history, new_conversation_id
+    from .services.context_budget import estimate_tokens
+    from .services.chat_messages import ChatMessages
+    from .services.app_log import get_logger, log_payload, logging_stats
+    from .services import metrics
+    from .services.tracing import start_trace, end_trace, current_trace, bind as bind_trace, log_if_slow
+    from .services.request_profiler import profiling_configured, should_profile, RequestProfile, token_matches, list_profiles, profile_path
+    from .services.voice_catalog import get_voice_catalog
+    from .services.audio_cache import get_audio_cache, audio_cache_key, prosody_options
+    from .services.speech_stream import wants_audio_stream, speech_chunks, open_speech_stream, iter_cached_audio
+    from .services.background_loop import get_background_loop, background_loop_stats
+    from .routes.tts import tts_bp
+    from .services.retry_policy import get_retry_policy, DeadlineExceeded, RETRYABLE_STATUS_CODES
+    from .services.token_cache import get_token_cache, get_cert_prefetcher, token_cache_enabled
+    from .services.session_store import init_sessions
+    from .services.env import env_flag
+    from .services.lazy_init import LazySubsystem, record_startup_phase, startup_report
+    from .services.json_codec import FastJSONProvider, RawJSONString, dumps_bytes, loads, extract_completion_content, splice_json, passthrough_enabled
+except ImportError:
+    from services.streaming import wants_stream, iter_openai_stream, iter_cohere_stream, relay_chat_stream
+    from services.http_pool import get_session, start_background_warmup
+    from services.hedging import run_hedged, hedging_enabled, get_hedge_delay, get_hedge_fanout
+    from services.circuit_breaker import get_breaker, classify_error, breaker_snapshot, CircuitOpenError, SUCCESS
+    from services.response_cache import get_response_cache, cache_enabled, semantic_cache_enabled, make_cache_key
+    from services.conversation_store import get_conversation_store, normalize_history, new_conversation_id
+    from services.context_budget import estimate_tokens
+    from services.chat_messages import ChatMessages
+    from services.app_log import get_logger, log_payload, logging_stats
+    from services import metrics
+    from services.tracing import start_trace, end_trace, current_trace, bind as bind_trace, log_if_slow
+    from services.request_profiler import profiling_configured, should_profile, RequestProfile, token_matches, list_profiles, profile_path
+    from services.voice_catalog import get_voice_catalog
+    from services.audio_cache import get_audio_cache, audio_cache_key, prosody_options
+    from services.speech_stream import wants_audio_stream, speech_chunks, open_speech_stream, iter_cached_audio
+    from services.background_loop import get_background_loop, background_loop_stats
+    from routes.tts import tts_bp
+    from services.retry_policy import get_retry_policy, DeadlineExceeded, RETRYABLE_STATUS_CODES
+    from services.token_cache import get_token_cache, get_cert_prefetcher, token_cache_enabled
+    from services.session_store import init_sessions
+    from services.env import env_flag
+    from services.lazy_init import LazySubsystem, record_startup_phase, startup_report
+    from services.json_codec import FastJSONProvider, RawJSONString, dumps_bytes, loads, extract_completion_content, splice_json, passthrough_enabled
+
+# Diagnostics by category; levels, sampling and redaction are configured in services/app_log.py
+log = get_logger('app')
+auth_log = get_logger('auth')
+firebase_log = get_logger('firebase')
+chat_log = get_logger('chat')
+cache_log = get_logger('cache')
+groq_log = get_logger('groq')
+together_log = get_logger('together')
+cohere_log = get_logger('cohere')
+openrouter_log = get_logger('openrouter')
+status_log = get_logger('status')
+tts_log = get_logger('tts')
+
+# Metrics exposed at /metrics (see services/metrics.py)
+UPSTREAM_SECONDS = metrics.histogram('milkyai_upstream_request_seconds', 'Time to response headers of one upstream HTTP attempt', ['provider'])
+UPSTREAM_RESPONSES = metrics.counter('milkyai_upstream_responses_total', 'Upstream HTTP attempts by status code, or timeout/error', ['provider', 'status'])
+UPSTREAM_RETRIES = metrics.counter('milkyai_upstream_retries_total', 'Upstream attempts that were retried', ['provider', 'reason'])
+MODEL_ATTEMPTS = metrics.counter('milkyai_model_attempts_total', 'OpenRouter model attempts by outcome', ['model', 'outcome'])
+CHAT_FALLBACKS = metrics.counter('milkyai_chat_fallbacks_total', 'Chat requests answered by a model other than the selected one', ['selected_model'])
+REQUEST_SECONDS = metrics.histogram('milkyai_request_seconds', 'Time to response of chat, image and TTS requests', ['endpoint', 'provider'])
+REQUESTS = metrics.counter('milkyai_requests_total', 'Chat, image and TTS requests by response status', ['endpoint', 'provider', 'status'])
+IMAGE_POLL_SECONDS = metrics.histogram('milkyai_image_poll_seconds', 'Time spent polling for an image prediction', ['provider'])
+TTS_SYNTHESIS_SECONDS = metrics.histogram('milkyai_tts_synthesis_seconds', 'Time to synthesize speech with edge-tts', ['outcome'])
+AUTH_VERIFICATIONS = metrics.counter('milkyai_auth_verifications_total', 'Firebase token verifications by result', ['result'])
+AUTH_VERIFICATION_SECONDS = metrics.histogram('milkyai_auth_verification_seconds', 'Time to verify a Firebase token', ['source'])
+
+# Heavy optional SDKs are imported by the first request that needs them, so a cold start
+# that only serves pages or /api/health does not pay for them
+firebase_admin = credentials = auth = None
+edge_tts = None
+
+def _import_firebase():
+    global firebase_admin, credentials, auth
     import firebase_admin
     from firebase_admin import credentials, auth
-    FIREBASE_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: Firebase not available: {e}")
-    FIREBASE_AVAILABLE = False
+    return True
 
-# Try to import edge-tts with error handling
-try:
+def _import_edge_tts():
+    global edge_tts
     import edge_tts
-    EDGE_TTS_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: edge-tts not available: {e}")
-    EDGE_TTS_AVAILABLE = False
+    return True
+
+def _import_semantic_cache():
+    # Pulls in numpy, so it is only loaded once the semantic tier is enabled
+    try:
+        from .services import semantic_cache
+    except ImportError:
+        from services import semantic_cache
+    return semantic_cache
+
+firebase_sdk = LazySubsystem('firebase_admin', _import_firebase)
+edge_tts_sdk = LazySubsystem('edge_tts', _import_edge_tts)
+semantic_cache_module = LazySubsystem('semantic_cache', _import_semantic_cache)
 
-# Initialize Firebase Admin SDK before creating the Flask app
-# This ensures Firebase is initialized exactly once and before any routes are defined
+# Helper function to check whether the Firebase Admin SDK can be used (imports it on first call)
+def firebase_available():
+    return bool(firebase_sdk.get())
+
+# Helper function to check whether edge-tts can be used (imports it on first call)
+def edge_tts_available():
+    return bool(edge_tts_sdk.get())
+
+# Firebase is initialized once, by the first request that verifies a token
 firebase_initialized = False
+_firebase_init_lock = threading.Lock()
 
 def initialize_firebase():
+    """Initialize Firebase Admin SDK once; safe to call from several threads"""
+    with _firebase_init_lock:
+        return _initialize_firebase()
+
+def _initialize_firebase():
     """Initialize Firebase Admin SDK with proper error handling"""
     global firebase_initialized
     
     if firebase_initialized:
-        print("Firebase already initialized, skipping initialization")
+        firebase_log.debug("Firebase already initialized, skipping initialization")
         return True
         
     # Check if Firebase is available
-    if not FIREBASE_AVAILABLE:
-        print("Firebase not available, skipping initialization")
+    if not firebase_available():
+        firebase_log.warning("Firebase not available, skipping initialization")
         return False
     
     try:
         # Check if FIREBASE_SERVICE_ACCOUNT is set as an environment variable
         if os.environ.get('FIREBASE_SERVICE_ACCOUNT'):
             # Use the service account info from environment variable
-            print("Initializing Firebase with service account from environment variable")
+            firebase_log.info("Initializing Firebase with service account from environment variable")
             try:
                 service_account_info = json.loads(os.environ.get('FIREBASE_SERVICE_ACCOUNT'))
                 cred = credentials.Certificate(service_account_info)
                 firebase_admin.initialize_app(cred)
                 firebase_initialized = True
-                print("Successfully initialized Firebase with service account from environment variable")
+                firebase_log.info("Successfully initialized Firebase with service account from environment variable")
                 return True
             except json.JSONDecodeError as je:
-                print(f"Error parsing FIREBASE_SERVICE_ACCOUNT environment variable: {str(je)}")
-                print("The environment variable must contain valid JSON")
+                firebase_log.error(f"Error parsing FIREBASE_SERVICE_ACCOUNT environment variable: {str(je)}")
+                firebase_log.error("The environment variable must contain valid JSON")
             except Exception as env_error:
-                print(f"Error initializing Firebase with environment variable: {str(env_error)}")
+                firebase_log.error(f"Error initializing Firebase with environment variable: {str(env_error)}")
         
         # Try service account files in order of preference
         service_account_paths = [
@@ -69,42 +171,42 @@ def initialize_firebase():
         
         for path in service_account_paths:
             try:
-                print(f"Attempting to initialize Firebase with service account from: {path}")
+                firebase_log.debug(f"Attempting to initialize Firebase with service account from: {path}")
                 cred = credentials.Certificate(path)
                 firebase_admin.initialize_app(cred)
                 firebase_initialized = True
-                print(f"Successfully initialized Firebase with service account from: {path}")
+                firebase_log.info(f"Successfully initialized Firebase with service account from: {path}")
                 return True
             except FileNotFoundError:
-                print(f"Service account file not found at: {path}")
+                firebase_log.warning(f"Service account file not found at: {path}")
                 continue
             except ValueError as ve:
                 if "already exists" in str(ve):
-                    print("Firebase app already initialized")
+                    firebase_log.debug("Firebase app already initialized")
                     firebase_initialized = True
                     return True
                 else:
-                    print(f"ValueError initializing Firebase with {path}: {str(ve)}")
+                    firebase_log.error(f"ValueError initializing Firebase with {path}: {str(ve)}")
                     continue
             except Exception as e:
-                print(f"Error initializing Firebase with {path}: {str(e)}")
+                firebase_log.error(f"Error initializing Firebase with {path}: {str(e)}")
                 continue
         
         # If we get here, try application default credentials
-        print("Attempting to initialize Firebase with application default credentials")
+        firebase_log.debug("Attempting to initialize Firebase with application default credentials")
         firebase_admin.initialize_app()
         firebase_initialized = True
-        print("Successfully initialized Firebase with application default credentials")
+        firebase_log.info("Successfully initialized Firebase with application default credentials")
         return True
     except ValueError as ve:
         if "already exists" in str(ve):
-            print("Firebase app already initialized")
+            firebase_log.debug("Firebase app already initialized")
             firebase_initialized = True
             return True
         else:
-            print(f"ValueError initializing Firebase: {str(ve)}")
+            firebase_log.error(f"ValueError initializing Firebase: {str(ve)}")
     except Exception as e:
-        print(f"Error initializing Firebase: {str(e)}")
+        firebase_log.error(f"Error initializing Firebase: {str(e)}")
     
     return False
         
@@ -172,29 +274,38 @@ def initialize_firebase():
     # 
     # return firebase_initialized
 
-# Initialize Firebase before creating the Flask app
-try:
-    firebase_init_success = initialize_firebase()
-    print(f"Firebase initialization {'successful' if firebase_init_success else 'FAILED'}")
-except Exception as e:
-    print(f"Firebase initialization failed with exception: {e}")
-    firebase_init_success = False
-    # Don't let Firebase initialization failure crash the app
-
-# Create Flask app after Firebase initialization
+# Helper function to initialize Firebase on first use, together with the certificate prefetch
+def _start_firebase():
+    initialized = initialize_firebase()
+    # Keep Google's token signing certificates fresh in the background (FIREBASE_CERT_PREFETCH=0 disables)
+    get_cert_prefetcher().start()
+    return initialized
+
+firebase_startup = LazySubsystem('firebase_init', _start_firebase)
+
+# Create Flask app
 app = Flask(__name__, static_folder='./static', template_folder='./templates')  # Updated paths for Vercel with symbolic links
-app.secret_key = secrets.token_hex(16)  # Generate a secure secret key for sessions
+# Stable secret key shared by every worker, plus the configured session backend (SESSION_BACKEND)
+init_sessions(app)
+# jsonify and request.json go through the fast JSON codec (JSON_CODEC)
+app.json = FastJSONProvider(app)
 
 # Enable CORS for all routes
 CORS(app, origins=['*'], supports_credentials=True)
 
+# /api/tts and /api/tts/voices (edge-tts is only imported by the first synthesis)
+app.register_blueprint(tts_bp)
+
+# Optionally pre-open pooled connections to the chat providers (HTTP_POOL_WARMUP=1)
+start_background_warmup()
+
 # OpenRouter API key - read from environment variable
 API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
 
 # Check if API key is not set in environment
 if not API_KEY and app.debug:
     # Only use this fallback in development mode
-    print("WARNING: OpenRouter API key not set. Please set OPENROUTER_API_KEY environment variable.")
+    openrouter_log.warning("OpenRouter API key not set. Please set OPENROUTER_API_KEY environment variable.")
 
 # Add Groq API key
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY', '')
@@ -205,59 +316,77 @@ TOGETHER_API_KEY = os.environ.get('TOGETHER_API_KEY', '')
 # Add Cohere API key
 COHERE_API_KEY = os.environ.get('COHERE_API_KEY', '')
 
+# Provider API base URLs; overridden to point the app at a local stand-in (see benchmarks/chat_load_bench.py)
+OPENROUTER_API_BASE = os.environ.get('OPENROUTER_API_BASE', 'https://openrouter.ai/api/v1').rstrip('/')
+GROQ_API_BASE = os.environ.get('GROQ_API_BASE', 'https://api.groq.com/openai/v1').rstrip('/')
+TOGETHER_API_BASE = os.environ.get('TOGETHER_API_BASE', 'https://api.together.xyz/v1').rstrip('/')
+COHERE_API_BASE = os.environ.get('COHERE_API_BASE', 'https://api.cohere.ai/v1').rstrip('/')
+OPENROUTER_CHAT_URL = f"{OPENROUTER_API_BASE}/chat/completions"
+GROQ_CHAT_URL = f"{GROQ_API_BASE}/chat/completions"
+TOGETHER_CHAT_URL = f"{TOGETHER_API_BASE}/chat/completions"
+COHERE_CHAT_URL = f"{COHERE_API_BASE}/chat"
+
 # Model options with model IDs as keys
 MODEL_OPTIONS = {
     'deepseek/deepseek-chat-v3-0324:free': {
         'id': 'deepseek/deepseek-chat-v3-0324:free',
         'display_name': 'QuantumText Maestro',
         'description': 'Advanced reasoning and coding capabilities',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 163840
     },
     'agentica-org/deepcoder-14b-preview:free': {
         'id': 'agentica-org/deepcoder-14b-preview:free',
         'display_name': 'CodeCascade Titan',
         'description': 'Specialized for complex programming tasks',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 96000
     },
     'deepseek/deepseek-r1-0528:free': {
         'id': 'deepseek/deepseek-r1-0528:free',
         'display_name': 'SynthMind Zephyr',
         'description': 'NumAI Best Advanced Model',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 163840
     },
     'deepseek/deepseek-r1:free': {
         'id': 'deepseek/deepseek-r1:free',
         'display_name': 'Mind Zephyr',
         'description': 'NumAI Best Advanced Model',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 163840
     },
     'groq/llama3-8b': {
         'id': 'llama3-8b-8192',
         'display_name': 'NeuraNova-X',
         'description': 'Best for Daily Task',
         'provider': 'groq',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 8192
     },
     'groq/llama3-70b': {
         'id': 'llama3-70b-8192',
         'display_name': 'SimulMind Vortex',
         'description': 'Best for Daily Task',
         'provider': 'groq',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 8192
     },
     'cohere/command-r-plus': {
         'id': 'command-r-plus',
         'display_name': 'Visionary Omega-9',
         'description': 'Fast Responses',
         'provider': 'cohere',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 128000
     },
     'cohere/command-r': {
         'id': 'command-r',
         'display_name': 'CogniSphere Atlas',
         'description': 'Latest Small context Model',
         'provider': 'cohere',
-        'supports_deep_thinking': True
+        'supports_deep_thinking': True,
+        'context_length': 128000
     }
 }
 
@@ -267,6 +396,10 @@ DEFAULT_MODEL = 'llama3-70b-8192'
 # List of model IDs for fallback
 AVAILABLE_MODELS = [model_info["id"] for model_info in MODEL_OPTIONS.values()]
 
+# Lookups from model ID back to its MODEL_OPTIONS entry and key
+MODEL_INFO_BY_ID = {model_info["id"]: model_info for model_info in MODEL_OPTIONS.values()}
+MODEL_KEY_BY_ID = {model_info["id"]: key for key, model_info in MODEL_OPTIONS.items()}
+
 # Deep thinking system prompt for Milky 8B model
 DEEP_THINKING_PROMPT = """You are NumAI. When deep thinking mode is enabled, you MUST ALWAYS follow this exact format:
 
@@ -335,13 +468,16 @@ Follow these rules:
 - **General Errors**: If an input causes issues (e.g., malformed queries), respond helpfully without frustration, focusing on resolution.
 """
 
+# Prepended to the last user message in deep thinking mode (Together, Cohere and OpenRouter)
+DEEP_THINKING_INSTRUCTION = "IMPORTANT: You MUST respond with the deep thinking format. User query: "
+
 def get_system_prompt(model_info, deep_thinking_mode=False):
     """Get the appropriate system prompt based on model and deep thinking mode"""
     if deep_thinking_mode and model_info.get('supports_deep_thinking', False):
-        print(f"[DEBUG] Using deep thinking prompt for model: {model_info.get('display_name', 'Unknown')}")
+        chat_log.debug(f"Using deep thinking prompt for model: {model_info.get('display_name', 'Unknown')}")
         return DEEP_THINKING_PROMPT
     else:
-        print(f"[DEBUG] Using default prompt for model: {model_info.get('display_name', 'Unknown')}")
+        chat_log.debug(f"Using default prompt for model: {model_info.get('display_name', 'Unknown')}")
         return DEFAULT_SYSTEM_PROMPT
 
 # Helper function to get OpenRouter headers
@@ -349,7 +485,7 @@ def get_openrouter_headers(request_obj=None, additional_headers=None):
     """Generate consistent headers for OpenRouter API requests"""
     # Ensure API_KEY is not empty
     if not API_KEY:
-        print("ERROR: OpenRouter API key is not set")
+        chat_log.error("OpenRouter API key is not set")
         return {}
         
     headers = {
@@ -371,137 +507,345 @@ def get_openrouter_headers(request_obj=None, additional_headers=None):
     return headers
 
 # Helper function to make API requests with retries
-def make_openrouter_request(url, headers, data=None, method="POST", max_retries=3, base_timeout=60):
-    """Make a request to OpenRouter API with automatic retries"""
-    retry_count = 0
+def make_openrouter_request(url, headers, data=None, method="POST", max_retries=None, base_timeout=None, stream=False, deadline=None, cancel_event=None):
+    """Make a request to OpenRouter API with automatic retries
+
+    With stream=True the response body is left unread so the caller can iterate over it.
+    """
+    return request_with_retries('openrouter', url, headers, data, method, max_retries, base_timeout, stream, deadline, cancel_event)
+
+# Helper function to count one upstream HTTP attempt and add it to the request trace
+def record_upstream_attempt(provider, outcome, started=None):
+    """`outcome` is the status code, 'timeout' or 'error'; without `started` no duration is recorded"""
+    UPSTREAM_RESPONSES.labels(provider, str(outcome)).inc()
+    if started is not None:
+        UPSTREAM_SECONDS.labels(provider).observe(time.perf_counter() - started)
+        current_trace().mark('upstream', started, f"{provider} {outcome}")
+
+# Helper function to call a provider with the deadline-aware retry policy
+def request_with_retries(provider, url, headers, data=None, method="POST", max_retries=None, base_timeout=None, stream=False,
+                         deadline=None, cancel_event=None, raise_for_status=True):
+    """Send a request, retrying timeouts, 429s and 5xx errors within the request deadline
+
+    Waits use jittered exponential backoff and honor Retry-After / X-RateLimit-Reset.
+    With raise_for_status=False the last error response is returned instead of raised,
+    for callers that report provider errors themselves.
+    """
+    policy = get_retry_policy(provider)
+    deadline = deadline or policy.new_deadline()
+    max_attempts = max_retries or policy.max_attempts
     last_error = None
     
-    while retry_count < max_retries:
+    for attempt in range(max_attempts):
+        try:
+            timeout = policy.attempt_timeout_for(deadline, base_timeout)
+        except DeadlineExceeded:
+            if last_error:
+                raise last_error
+            raise
+        
+        attempt_started = time.perf_counter()
         try:
-            # Increase timeout slightly with each retry
-            current_timeout = base_timeout * (1 + (retry_count * 0.5))
-            
             if method.upper() == "POST":
-                response = requests.post(
+                response = get_session(provider).post(
                     url=url,
                     headers=headers,
                     data=data,
-                    timeout=current_timeout
+                    timeout=timeout,
+                    stream=stream
                 )
             else:  # GET
-                response = requests.get(
+                response = get_session(provider).get(
                     url=url,
                     headers=headers,
-                    timeout=current_timeout
+                    timeout=timeout
                 )
-            
-            # Check if the request was successful
-            response.raise_for_status()
-            return response
-            
         except requests.exceptions.Timeout as timeout_error:
-            retry_count += 1
+            record_upstream_attempt(provider, 'timeout', attempt_started)
             last_error = timeout_error
-            wait_time = retry_count * 2  # Progressive backoff
-            
-            print(f"Request timed out (attempt {retry_count}/{max_retries}). Waiting {wait_time}s before retry...")
-            time.sleep(wait_time)
+            delay = policy.retry_delay(attempt)
+            reason = "Request timed out"
+            retry_reason = 'timeout'
+            if not policy.can_retry(attempt, delay, deadline, max_attempts):
+                break
+        except requests.exceptions.RequestException:
+            record_upstream_attempt(provider, 'error')
+            raise
+        else:
+            # Time to the response headers, which for a non-streamed completion includes the generation
+            record_upstream_attempt(provider, response.status_code, attempt_started)
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                if raise_for_status:
+                    response.raise_for_status()
+                return response
             
-        except requests.exceptions.RequestException as req_error:
-            # For 429 (rate limit) errors, wait longer before retrying
-            if hasattr(req_error, 'response') and req_error.response and req_error.response.status_code == 429:
-                retry_count += 1
-                last_error = req_error
-                wait_time = retry_count * 5  # Longer wait for rate limits
-                
-                print(f"Rate limit exceeded (attempt {retry_count}/{max_retries}). Waiting {wait_time}s before retry...")
-                time.sleep(wait_time)
-            else:
-                # For other request errors, only retry server errors (5xx)
-                if hasattr(req_error, 'response') and req_error.response and 500 <= req_error.response.status_code < 600:
-                    retry_count += 1
-                    last_error = req_error
-                    wait_time = retry_count * 2
-                    
-                    print(f"Server error {req_error.response.status_code} (attempt {retry_count}/{max_retries}). Waiting {wait_time}s before retry...")
-                    time.sleep(wait_time)
-                else:
-                    # Don't retry client errors (4xx) except for 429
-                    raise req_error
+            last_error = requests.exceptions.HTTPError(f"{response.status_code} error from {provider}", response=response)
+            delay = policy.retry_delay(attempt, response.headers)
+            reason = "Rate limit exceeded" if response.status_code == 429 else f"Server error {response.status_code}"
+            retry_reason = 'rate_limited' if response.status_code == 429 else 'server_error'
+            if not policy.can_retry(attempt, delay, deadline, max_attempts):
+                if not raise_for_status:
+                    return response
+                break
+            response.close()
+        
+        UPSTREAM_RETRIES.labels(provider, retry_reason).inc()
+        get_logger(provider).warning(f"{reason} (attempt {attempt + 1}/{max_attempts}). Waiting {delay:.1f}s before retry "
+                                     f"({deadline.remaining():.0f}s of the request budget left)...")
+        # A hedged attempt that lost the race stops waiting as soon as it is cancelled
+        if cancel_event is not None:
+            if cancel_event.wait(delay):
+                break
+        else:
+            time.sleep(delay)
     
-    # If we've exhausted all retries, raise the last error
-    if last_error:
-        print(f"All {max_retries} retry attempts failed. Last error: {str(last_error)}")
-        raise last_error
+    get_logger(provider).error(f"Giving up after {attempt + 1} attempt(s). Last error: {str(last_error)}")
+    raise last_error
+
+# Helper function to relay a provider stream to the client as server-sent events
+def chat_stream_response(events, metadata, upstream=None):
+    """Wrap provider stream events in a text/event-stream response"""
+    on_complete = None
+    # The stream is consumed after the request context is gone, so capture the reply hooks now
+    reply_hooks = g.get('chat_reply_hooks')
+    if reply_hooks:
+        def on_complete(text):
+            if text:
+                reply = dict(metadata)
+                reply['response'] = text
+                run_reply_hooks(reply_hooks, reply)
+    response = Response(relay_chat_stream(events, metadata, upstream, on_complete), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    return response
+
+# Helper function to pull the assistant message out of an OpenAI-style completion body
+def completion_message(body):
+    """Return choices[0].message.content ('' if empty, None if there are no choices)
+
+    In passthrough mode the content comes back as a RawJSONString sliced from the body,
+    without parsing the rest of it.
+    """
+    if passthrough_enabled():
+        content = extract_completion_content(body)
+        if content is not None:
+            return content
+    result = loads(body)
+    choices = result.get('choices') if isinstance(result, dict) else None
+    if not choices:
+        return None
+    return (choices[0].get('message') or {}).get('content') or ''
+
+# Helper function to build the JSON reply of a non-streamed chat request
+def chat_json_response(assistant_message, model_used, model_key, model_display_name):
+    """A RawJSONString message is spliced into the body as-is instead of being re-encoded"""
+    metadata = {
+        'model_used': model_used,
+        'model_key': model_key,
+        'model_display_name': model_display_name
+    }
+    g.chat_reply = (assistant_message, metadata)
+    with current_trace().span('serialize'):
+        if isinstance(assistant_message, RawJSONString):
+            return app.response_class(splice_json({'response': assistant_message}, metadata), mimetype='application/json')
+        return jsonify(dict(metadata, response=assistant_message))
+
+# Helper function to look up a chat reply in the response caches
+def lookup_cached_chat_reply(selected_model_key, selected_model_info, deep_thinking_mode, chat_history, user_input):
+    """Check the exact-match cache, then the semantic cache
+
+    Returns (cached_reply or None, cache_keys); pass cache_keys to save_chat_reply once
+    a fresh reply has been generated.
+    """
+    use_exact = cache_enabled(selected_model_info)
+    semantic_cache = semantic_cache_module.get() if semantic_cache_enabled(selected_model_info) else None
+    use_semantic = semantic_cache is not None
+    if not use_exact and not use_semantic:
+        return None, None
+    
+    system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
+    cache_key = None
+    semantic_key = None
+    if use_exact:
+        cache_key = make_cache_key(selected_model_key, deep_thinking_mode, system_prompt, chat_history, user_input)
+        cached_reply = get_response_cache().get(cache_key)
+        if cached_reply:
+            cache_log.info(f"Serving cached response for model: {selected_model_key}")
+            return dict(cached_reply, cached=True), None
+    if use_semantic:
+        context, last_turn = semantic_cache.make_context_key(deep_thinking_mode, system_prompt, chat_history, user_input)
+        semantic_key = (selected_model_key, context, last_turn)
+        match = semantic_cache.get_semantic_cache().lookup(*semantic_key)
+        if match:
+            cached_reply, similarity = match
+            cache_log.info(f"Serving semantically cached response for model: {selected_model_key} (similarity {similarity:.3f})")
+            return dict(cached_reply, cached=True, cache_similarity=round(similarity, 3)), None
+    return None, (cache_key, semantic_key)
+
+# Helper function to store a freshly generated chat reply in the response caches
+def save_chat_reply(reply, cache_keys):
+    if reply.get('cached'):
+        return
+    cache_key, semantic_key = cache_keys
+    if cache_key:
+        get_response_cache().set(cache_key, reply)
+    if semantic_key:
+        semantic_cache_module.get().get_semantic_cache().add(*semantic_key, reply)
+
+# Helper function to work out the history of a chat request from the conversation store
+def resolve_conversation(payload, user_id, user_input):
+    """Return (chat_history, conversation) for a chat request
+
+    Clients that already have a conversation send `conversationId`, `historyLength` and
+    the new message only; the history comes from the store. Requests that carry a full
+    `chatHistory` (first turn, older clients, or a rehydration after a 409) replace the
+    stored conversation. chat_history is None when the stored entry is missing or out
+    of sync and the client has to resend its full history.
+    """
+    store = get_conversation_store()
+    conversation_id = payload.get('conversationId')
     
-    # This should never happen, but just in case
-    raise Exception("Failed to make request after all retries, but no error was recorded")
+    if conversation_id and 'chatHistory' not in payload:
+        stored = store.get(conversation_id, user_id, payload.get('historyLength'))
+        if stored is None:
+            chat_log.warning(f"Conversation {conversation_id} not found or out of sync, asking client to rehydrate")
+            return None, {'id': conversation_id}
+        messages, length = stored
+        messages.append({'role': 'user', 'content': user_input})
+        return messages, {'id': conversation_id, 'messages': messages, 'length': length + 1}
+    
+    messages = normalize_history(payload.get('chatHistory', []))
+    # The frontend pushes the new message onto chatHistory before sending
+    if not messages or messages[-1]['role'] != 'user':
+        messages.append({'role': 'user', 'content': user_input})
+    if conversation_id:
+        chat_log.info(f"Rehydrating conversation {conversation_id} with {len(messages)} messages")
+    return messages, {
+        'id': conversation_id or new_conversation_id(),
+        'messages': messages,
+        'length': len(messages),
+        'rehydrated': bool(conversation_id)
+    }
+
+# Helper function to append a finished assistant turn to the conversation store
+def save_conversation_turn(conversation, user_id, reply):
+    messages = conversation['messages'] + [{'role': 'assistant', 'content': reply['response']}]
+    get_conversation_store().put(conversation['id'], user_id, messages, conversation['length'] + 1,
+                                 rehydrated=conversation.get('rehydrated', False))
+
+# Helper function to run the callbacks registered for a successful chat reply
+def run_reply_hooks(reply_hooks, reply):
+    for hook in reply_hooks:
+        try:
+            hook(reply)
+        except Exception as e:
+            chat_log.error(f"Error in chat reply hook: {str(e)}")
+
+# Helper function to get the Firebase project id that ID tokens must be issued for
+def firebase_project_id():
+    try:
+        return firebase_admin.get_app().project_id
+    except ValueError:
+        return None
+
+# Helper function to verify an ID token, locally against the prefetched certificates when possible
+def verify_id_token(token):
+    decoded_token = get_cert_prefetcher().verify(token, firebase_project_id())
+    if decoded_token is None:
+        decoded_token = auth.verify_id_token(token)
+    if token_cache_enabled():
+        get_token_cache().put(token, decoded_token)
+    return decoded_token
 
 # Helper function to verify Firebase ID token
 def verify_firebase_token(request_obj):
     """Verify Firebase ID token from Authorization header"""
     # Check if Firebase is available
-    if not FIREBASE_AVAILABLE:
-        print("Firebase not available, using test user")
+    if not firebase_available():
+        auth_log.info("Firebase not available, using test user")
+        AUTH_VERIFICATIONS.labels('unavailable').inc()
         return {"uid": "test-user-id"}
     
     # Get the Authorization header
     auth_header = request_obj.headers.get('Authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
-        print("No valid Authorization header found")
+        auth_log.warning("No valid Authorization header found")
+        AUTH_VERIFICATIONS.labels('missing').inc()
         return None
     
     # Extract the token
     token = auth_header.split('Bearer ')[1]
-    print(f"Token received, length: {len(token)}")
+    auth_log.debug(f"Token received, length: {len(token)}")
+    
+    # Tokens verified earlier are served from memory until they expire
+    verify_started = time.perf_counter()
+    if token_cache_enabled():
+        cached_token = get_token_cache().get(token)
+        if cached_token is not None:
+            AUTH_VERIFICATION_SECONDS.labels('cache').observe(time.perf_counter() - verify_started)
+            AUTH_VERIFICATIONS.labels('cached').inc()
+            return cached_token
+    
+    # The first verification initializes Firebase; later calls return immediately
+    firebase_startup.get()
     
     # Check if Firebase is initialized
     if not firebase_initialized:
-        print("ERROR: Firebase Admin SDK is not initialized!")
+        auth_log.error("Firebase Admin SDK is not initialized!")
         # Try to initialize it now as a last resort
         if initialize_firebase():
-            print("Successfully initialized Firebase Admin SDK on-demand")
+            auth_log.info("Successfully initialized Firebase Admin SDK on-demand")
         else:
-            print("Failed to initialize Firebase Admin SDK on-demand")
+            auth_log.error("Failed to initialize Firebase Admin SDK on-demand")
             # For development/testing purposes only
             if app.debug:
-                print("WARNING: Running in debug mode. Bypassing token verification.")
+                auth_log.warning("Running in debug mode. Bypassing token verification.")
+                AUTH_VERIFICATIONS.labels('bypassed').inc()
                 return {"uid": "test-user-id"}
+            AUTH_VERIFICATIONS.labels('unavailable').inc()
             return None
     
     try:
         # Verify the token
-        print("Attempting to verify Firebase token...")
-        decoded_token = auth.verify_id_token(token)
-        print(f"Token verified successfully for user: {decoded_token.get('uid')}")
+        auth_log.debug("Attempting to verify Firebase token...")
+        decoded_token = verify_id_token(token)
+        auth_log.info(f"Token verified successfully for user: {decoded_token.get('uid')}")
+        AUTH_VERIFICATION_SECONDS.labels('firebase').observe(time.perf_counter() - verify_started)
+        AUTH_VERIFICATIONS.labels('verified').inc()
         return decoded_token
     except ValueError as ve:
-        print(f"ValueError verifying token: {str(ve)}")
+        auth_log.warning(f"ValueError verifying token: {str(ve)}")
         if "The default Firebase app does not exist" in str(ve):
-            print("Attempting to re-initialize Firebase...")
+            auth_log.info("Attempting to re-initialize Firebase...")
             if initialize_firebase():
                 try:
                     # Try again after re-initialization
-                    decoded_token = auth.verify_id_token(token)
-                    print(f"Token verified successfully after re-initialization for user: {decoded_token.get('uid')}")
+                    decoded_token = verify_id_token(token)
+                    auth_log.info(f"Token verified successfully after re-initialization for user: {decoded_token.get('uid')}")
+                    AUTH_VERIFICATION_SECONDS.labels('firebase').observe(time.perf_counter() - verify_started)
+                    AUTH_VERIFICATIONS.labels('verified').inc()
                     return decoded_token
                 except Exception as retry_error:
-                    print(f"Failed to verify token after re-initialization: {str(retry_error)}")
+                    auth_log.error(f"Failed to verify token after re-initialization: {str(retry_error)}")
         # For development/testing purposes, you can bypass token verification
         # This should be removed in production
         if app.debug:
-            print("WARNING: Running in debug mode. Bypassing token verification.")
+            auth_log.warning("Running in debug mode. Bypassing token verification.")
             # Create a mock decoded token with a user ID
+            AUTH_VERIFICATIONS.labels('bypassed').inc()
             return {"uid": "test-user-id"}
+        AUTH_VERIFICATIONS.labels('rejected').inc()
         return None
     except Exception as e:
-        print(f"Error verifying token: {str(e)}")
+        auth_log.error(f"Error verifying token: {str(e)}")
         # For development/testing purposes, you can bypass token verification
         # This should be removed in production
         if app.debug:
-            print("WARNING: Running in debug mode. Bypassing token verification.")
+            auth_log.warning("Running in debug mode. Bypassing token verification.")
             # Create a mock decoded token with a user ID
+            AUTH_VERIFICATIONS.labels('bypassed').inc()
             return {"uid": "test-user-id"}
+        AUTH_VERIFICATIONS.labels('rejected').inc()
         return None
     
     # # Get the Authorization header
@@ -594,7 +938,7 @@ def index():
     try:
         return render_template('index.html')
     except Exception as e:
-        print(f"Error rendering index template: {e}")
+        log.error(f"Error rendering index template: {e}")
         return jsonify({
             'error': 'Template rendering failed',
             'message': 'The application is running but template rendering failed',
@@ -605,18 +949,15 @@ def index():
 @app.route('/api/verify-token', methods=['POST'])
 def verify_token():
     try:
-        # Log request headers for debugging (excluding sensitive information)
-        safe_headers = dict(request.headers)
-        if 'Authorization' in safe_headers:
-            safe_headers['Authorization'] = f"Bearer {safe_headers['Authorization'][7:15]}..." # Show only beginning of token
-        print(f"Token verification request headers: {safe_headers}")
+        # Log request headers for debugging (credentials are masked, only at debug level)
+        log_payload(auth_log, "Token verification request headers", request.headers)
         
         # Verify Firebase token
-        print("Attempting to verify and cache Firebase token...")
+        auth_log.info("Attempting to verify and cache Firebase token...")
         decoded_token = verify_firebase_token(request)
         
         if not decoded_token:
-            print("Token verification failed: No valid token provided")
+            auth_log.warning("Token verification failed: No valid token provided")
             return jsonify({'error': 'Unauthorized. Please log in.'}), 401
         
         # Get user ID from token
@@ -624,40 +965,295 @@ def verify_token():
         
         # Store the verified user ID in session
         session['verified_user_id'] = user_id
-        print(f"Token verified and cached for user: {user_id}")
+        auth_log.info(f"Token verified and cached for user: {user_id}")
         
         return jsonify({'success': True, 'message': 'Token verified and cached'})
     except Exception as e:
-        print(f"Error in token verification: {str(e)}")
-        traceback.print_exc()
+        auth_log.error(f"Error in token verification: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
+# Helper function to map the model the frontend selected onto a MODEL_OPTIONS key
+def resolve_model_key(selected_model_key):
+    """Return the MODEL_OPTIONS key for a model key or ID, falling back to the default model"""
+    if selected_model_key in MODEL_OPTIONS:
+        return selected_model_key
+    
+    chat_log.warning(f"Model key '{selected_model_key}' not found in MODEL_OPTIONS, checking if it matches any model ID")
+    # Try to find the model by ID instead of key
+    if selected_model_key in MODEL_KEY_BY_ID:
+        chat_log.debug(f"Found matching model ID, using key: {MODEL_KEY_BY_ID[selected_model_key]}")
+        return MODEL_KEY_BY_ID[selected_model_key]
+    
+    chat_log.warning(f"No matching model found, falling back to default: {DEFAULT_MODEL}")
+    # DEFAULT_MODEL holds a model ID, so map it back to its key
+    return MODEL_KEY_BY_ID.get(DEFAULT_MODEL, DEFAULT_MODEL)
+
+# Helper function to build the Groq request body
+def build_groq_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode=False):
+    """Render the request's ChatMessages as the JSON body for a Groq chat request"""
+    system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
+    groq_params = {
+        "model": selected_model_info['id'],
+        # Drop or compress the oldest turns if the history does not fit the context window
+        "messages": messages.openai_messages(system_prompt, selected_model_info, deep_thinking_mode)
+    }
+    groq_log.debug(f"Rendered {len(groq_params['messages'])} messages")
+    if stream_mode:
+        groq_params["stream"] = True
+    groq_data = dumps_bytes(groq_params)
+    return groq_data
+
+
+# Helper function to build the Together AI request body
+def build_together_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode=False):
+    """Render the request's ChatMessages as the JSON body for a Together AI chat request"""
+    deep_thinking = deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False)
+    system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
+    together_params = {
+        "model": selected_model_info['id'],
+        # Deep thinking also prefixes the last user message with the format instruction
+        "messages": messages.openai_messages(system_prompt, selected_model_info, deep_thinking_mode,
+                                             instruction=DEEP_THINKING_INSTRUCTION if deep_thinking else None)
+    }
+    together_log.debug(f"Rendered {len(together_params['messages'])} messages")
+    
+    # Add temperature for deep thinking mode
+    if deep_thinking:
+        together_params["temperature"] = 0.9
+        together_params["max_tokens"] = 2000  # Allow longer responses for deep thinking
+    
+    if stream_mode:
+        together_params["stream"] = True
+    
+    together_data = dumps_bytes(together_params)
+    return together_data
+
+
+# Helper function to build the Cohere request body
+def build_cohere_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode=False):
+    """Render the request's ChatMessages as the JSON body for a Cohere chat request"""
+    deep_thinking = deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False)
+    
+    # Add specific instructions for deep thinking mode with Cohere
+    preamble = "You are NumAI, a helpful assistant. Use markdown formatting and emoji shortcodes in your responses."
+    if deep_thinking:
+        preamble = """You are NumAI with deep thinking capabilities. You MUST ALWAYS follow this exact format for EVERY SINGLE RESPONSE:
+
+**DEEP THINKING BREAKDOWN**
+
+Hmm, let me understand what the user is asking for... [Analyze their specific request, what they're trying to achieve, what context they might need, and what type of response would be most helpful]
+
+Now, let me think about this carefully... [Go through your reasoning process - consider different approaches, potential challenges, what information is needed, what assumptions to make, and how to structure the response]
+
+What if... [Think about potential issues, edge cases, alternative solutions, or different perspectives on the problem]
+
+For the best answer, I should... [Plan how to organize the response, what examples to include, what format would be most helpful]
+Based on my analysis, the best approach is... [Summarize your thinking and explain why this approach makes sense]
+
+
+**FINAL ANSWER**
+
+[Your comprehensive final answer here, incorporating all the analysis above]
+
+CRITICAL RULES:
+1. You MUST ALWAYS include BOTH the breakdown AND the final answer sections
+2. You MUST ALWAYS use the exact headers: "**DEEP THINKING BREAKDOWN**" and "**FINAL ANSWER**" (NO EMOJIS)
+3. You MUST NEVER skip the final answer section
+4. The response MUST end with the final answer
+5. Write your thought process in a natural, conversational way as if you're thinking out loud
+6. Use phrases like "Hmm, the user wants...", "Let me think about this...", "What if...", "I should consider..."
+7. Make your thinking process detailed and thorough - don't rush through it
+8. If you cannot provide a complete answer, still include both sections with your best attempt
+9. Always analyze the user's request first before diving into the solution
+10. DO NOT use emojis in the headers - use plain text only
+11. FOR EVERY SINGLE USER QUERY, you MUST start with "**DEEP THINKING BREAKDOWN**" and end with "**FINAL ANSWER**"
+12. This is NOT optional - you MUST follow this format for every response
+13. Even for simple greetings like "hello" or "hi", you MUST still provide the full breakdown and final answer
+14. The breakdown should be at least 3-4 sentences long, showing your actual thinking process
+15. Never skip the thinking process - always show your work
+16. IMPORTANT: This format is MANDATORY for every single response, regardless of the query complexity
+17. You are REQUIRED to show your thinking process for every user input
+18. The deep thinking breakdown is NOT optional - it's a requirement for every response
+19. DO NOT include template placeholders like [FIRST:], [SECOND:], etc. - replace them with your actual thinking
+20. Write your thinking process naturally without using numbered steps or template markers"""
+    
+    # Modify user input for deep thinking mode
+    user_input = messages.user_message.content
+    modified_user_input = f"{DEEP_THINKING_INSTRUCTION}{user_input}" if deep_thinking else user_input
+    
+    # Drop or compress the oldest turns if the history does not fit the context window
+    cohere_messages = messages.cohere_history(get_system_prompt(selected_model_info, deep_thinking_mode), selected_model_info, deep_thinking_mode,
+                                              reserved_tokens=estimate_tokens(preamble) + estimate_tokens(modified_user_input))
+    cohere_log.debug(f"Rendered {len(cohere_messages)} messages")
+    
+    cohere_params = {
+        "model": selected_model_info['id'],
+        "message": modified_user_input,
+        "chat_history": cohere_messages,
+        "preamble": preamble,
+        "temperature": 0.9 if deep_thinking else 0.3
+    }
+    if stream_mode:
+        cohere_params["stream"] = True
+    cohere_data = dumps_bytes(cohere_params)
+    return cohere_data
+
+
+# Helper function to build the OpenRouter request body
+def build_openrouter_request_data(model, messages, deep_thinking_mode, selected_model_info, stream_mode=False):
+    """Render the request's ChatMessages as the JSON body for one OpenRouter model
+
+    Only the system prompt and the context window depend on the candidate model, so
+    fallback and hedged attempts re-render the same validated messages without
+    re-validating or modifying them.
+    """
+    current_model_info = MODEL_INFO_BY_ID.get(model)
+    system_prompt = get_system_prompt(current_model_info, deep_thinking_mode) if current_model_info else DEFAULT_SYSTEM_PROMPT
+    deep_thinking = deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False)
+    
+    request_params = {
+        "model": model,
+        # Drop or compress the oldest turns if the history does not fit this model's context window
+        "messages": messages.openai_messages(system_prompt, current_model_info or selected_model_info, deep_thinking_mode,
+                                             instruction=DEEP_THINKING_INSTRUCTION if deep_thinking else None),
+        "response_format": {
+            "type": "text"
+        },
+    }
+    openrouter_log.debug(f"Rendered {len(request_params['messages'])} messages for model {model}")
+    
+    # Add temperature for deep thinking mode
+    if deep_thinking:
+        request_params["temperature"] = 0.9
+        request_params["max_tokens"] = 2000  # Allow longer responses for deep thinking
+    
+    if stream_mode:
+        request_params["stream"] = True
+    
+    request_data = dumps_bytes(request_params)
+    return request_data
+
+class EmptyModelResponse(Exception):
+    """Raised when a model answers without any content, so the next model should be tried"""
+
+
+class AttemptCancelled(EmptyModelResponse):
+    """Raised when a hedged attempt lost the race before its response was used"""
+
+
+# Helper function to count one model attempt and add it to the request trace as a fallback hop
+def record_model_attempt(model, outcome, started):
+    MODEL_ATTEMPTS.labels(model, outcome).inc()
+    current_trace().mark('hop', started, f"{model} {outcome}")
+
+# Helper function to run one OpenRouter model attempt behind its circuit breaker
+def call_openrouter_model(model, *args, ignore_breaker=False, **kwargs):
+    """Run request_openrouter_model unless the model's breaker is open, and record the outcome"""
+    started = time.perf_counter()
+    breaker = get_breaker(model)
+    if not breaker.allow_request() and not ignore_breaker:
+        record_model_attempt(model, 'circuit_open', started)
+        raise CircuitOpenError(f"Circuit breaker open for model {model}")
+    try:
+        result = request_openrouter_model(model, *args, **kwargs)
+    except (AttemptCancelled, DeadlineExceeded) as e:
+        # Neither says anything about the model's health
+        breaker.release()
+        record_model_attempt(model, 'cancelled' if isinstance(e, AttemptCancelled) else 'deadline', started)
+        raise
+    except Exception as e:
+        outcome = classify_error(e)
+        breaker.record(outcome)
+        record_model_attempt(model, 'empty' if isinstance(e, EmptyModelResponse) else outcome, started)
+        raise
+    breaker.record(SUCCESS)
+    record_model_attempt(model, SUCCESS, started)
+    return result
+
+# Helper function to send one OpenRouter model attempt
+def request_openrouter_model(model, messages, deep_thinking_mode, selected_model_info, headers, stream_mode=False, cancel_event=None, deadline=None):
+    """Send the conversation to a single OpenRouter model
+
+    Returns (assistant_message, None, response) for normal requests and
+    (None, events, response) for streamed ones, where events already contains the first token.
+    Raises EmptyModelResponse when the model produced nothing, and request errors as-is.
+    """
+    request_data = build_openrouter_request_data(model, messages, deep_thinking_mode, selected_model_info, stream_mode)
+    
+    openrouter_log.debug(f"Sending request to model {model} with retry mechanism")
+    log_payload(openrouter_log, "Request payload", request_data)
+    try:
+        response = make_openrouter_request(
+            url=OPENROUTER_CHAT_URL,
+            headers=headers,
+            data=request_data,
+            method="POST",
+            stream=stream_mode,
+            deadline=deadline,  # Shared by every retry and fallback model of this chat request
+            cancel_event=cancel_event
+        )
+        openrouter_log.debug(f"Successfully received response from model {model} after using retry mechanism")
+    except Exception as req_error:
+        openrouter_log.error(f"Error with model {model} using retry mechanism: {str(req_error)}")
+        raise req_error
+    
+    if cancel_event is not None and cancel_event.is_set():
+        response.close()
+        raise AttemptCancelled(f"Attempt for model {model} was cancelled")
+    
+    if stream_mode:
+        # Wait for the first token before committing to this model, so an empty
+        # or failing stream still falls through to the next model
+        events = iter_openai_stream(response)
+        first_events = []
+        with current_trace().span('first_token', model):
+            for event in events:
+                first_events.append(event)
+                if event[0] == 'delta':
+                    break
+        if not any(kind == 'delta' for kind, _ in first_events):
+            openrouter_log.warning(f"Empty streamed response from model: {model}")
+            response.close()
+            raise EmptyModelResponse(f"Empty streamed response from model: {model}")
+        
+        openrouter_log.info(f"Streaming response from model: {model}")
+        return None, itertools.chain(first_events, events), response
+    
+    # Extract the assistant's message
+    assistant_message = completion_message(response.content)
+    
+    if not assistant_message:
+        openrouter_log.warning(f"Empty response from model: {model}")
+        raise EmptyModelResponse(f"Empty response from model: {model}")
+    
+    return assistant_message, None, response
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    start_request_metrics('chat', 'none')
+    trace = current_trace()
     try:
-        # Log request headers for debugging (excluding sensitive information)
-        safe_headers = dict(request.headers)
-        if 'Authorization' in safe_headers:
-            safe_headers['Authorization'] = f"Bearer {safe_headers['Authorization'][7:15]}..." # Show only beginning of token
-        print(f"Request headers: {safe_headers}")
+        # Log request headers for debugging (credentials are masked, only at debug level)
+        log_payload(auth_log, "Request headers", request.headers)
         
+        phase_started = time.perf_counter()
         # Check if user is already verified in session
         user_id = session.get('verified_user_id')
         
         # If not in session, verify token (fallback)
         if not user_id:
-            print("User not found in session, verifying token...")
+            auth_log.debug("User not found in session, verifying token...")
             decoded_token = verify_firebase_token(request)
             
             # Bypass authentication in both debug and production mode temporarily
             # This is a temporary fix until the authentication issue is resolved
             if not decoded_token:
-                print("Bypassing authentication for testing.")
+                auth_log.warning("Bypassing authentication for testing.")
                 decoded_token = {"uid": "test-user-id"}
                 # TODO: Remove this bypass in production once authentication is working properly
             
             if not decoded_token:
-                print("Authentication failed: No valid token provided")
+                auth_log.warning("Authentication failed: No valid token provided")
                 return jsonify({'error': 'Unauthorized. Please log in.'}), 401
             
             # Get user ID from token
@@ -665,160 +1261,92 @@ def chat():
             # Store in session for future requests
             session['verified_user_id'] = user_id
         else:
-            print(f"Using cached verification for user: {user_id}")
+            auth_log.debug(f"Using cached verification for user: {user_id}")
         
         # Get user ID from token
         user_id = user_id or "test-user-id"
-        print(f"Authenticated user: {user_id}")
+        auth_log.info(f"Authenticated user: {user_id}")
+        trace.mark('auth', phase_started)
         
+        phase_started = time.perf_counter()
         user_input = request.json.get('message', '')
         selected_model_key = request.json.get('model', DEFAULT_MODEL)
-        chat_history = request.json.get('chatHistory', [])
+        chat_history, conversation = resolve_conversation(request.json, user_id, user_input)
+        if chat_history is None:
+            return jsonify({
+                'error': 'Conversation not found or out of date. Please resend the full chat history.',
+                'rehydrate': True,
+                'conversation_id': conversation['id']
+            }), 409
         deep_thinking_mode = request.json.get('deepThinkingMode', False)
+        stream_mode = wants_stream(request, request.json)
+        # Validated once here and only rendered by each provider and fallback attempt
+        messages = ChatMessages.from_history(chat_history, user_input)
+        trace.mark('history', phase_started, f"{len(messages)} messages")
         
-        print(f"Received model selection from frontend: {selected_model_key}")
-        print(f"Received chat history with {len(chat_history)} messages")
-        print(f"Deep thinking mode: {deep_thinking_mode}")
+        chat_log.debug(f"Received model selection from frontend: {selected_model_key}")
+        chat_log.debug(f"Received chat history with {len(chat_history)} messages")
+        chat_log.debug(f"Deep thinking mode: {deep_thinking_mode}")
+        chat_log.debug(f"Streaming mode: {stream_mode}")
         
         # Validate the model key exists, otherwise use default
-        if selected_model_key not in MODEL_OPTIONS:
-            print(f"Model key '{selected_model_key}' not found in MODEL_OPTIONS, checking if it matches any model ID")
-            # Try to find the model by ID instead of key
-            found = False
-            for key, info in MODEL_OPTIONS.items():
-                if info['id'] == selected_model_key:
-                    selected_model_key = key
-                    found = True
-                    print(f"Found matching model ID, using key: {selected_model_key}")
-                    break
-            
-            if not found:
-                print(f"No matching model found, falling back to default: {DEFAULT_MODEL}")
-                selected_model_key = DEFAULT_MODEL
+        selected_model_key = resolve_model_key(selected_model_key)
             
         # Get the model ID from the selected model key
         selected_model = MODEL_OPTIONS[selected_model_key]["id"]
         selected_model_info = MODEL_OPTIONS[selected_model_key]
         provider = selected_model_info.get('provider', 'openrouter')
+        set_metrics_provider(provider)
+        
+        # Metadata sent with the final event of a streamed response
+        stream_metadata = {
+            'model_used': selected_model_info['id'],
+            'model_key': selected_model_key,
+            'model_display_name': selected_model_info['display_name']
+        }
+
+        # Successful replies are passed to these hooks by run_chat_reply_hooks / chat_stream_response
+        g.chat_conversation = conversation
+        g.chat_reply_hooks = [lambda reply: save_conversation_turn(conversation, user_id, reply)]
+        
+        # Serve repeated prompts from the response caches
+        with trace.span('cache'):
+            cached_reply, cache_keys = lookup_cached_chat_reply(selected_model_key, selected_model_info, deep_thinking_mode, chat_history, user_input)
+        if cached_reply:
+            set_metrics_provider('cache')
+            if stream_mode:
+                metadata = {k: v for k, v in cached_reply.items() if k != 'response'}
+                return chat_stream_response(iter([('delta', cached_reply['response'])]), metadata)
+            return jsonify(cached_reply)
+        if cache_keys:
+            g.chat_reply_hooks.append(lambda reply: save_chat_reply(reply, cache_keys))
 
         # Handle Groq models before fallback loop
         if provider == 'groq':
-            print(f"[Groq] Preparing to send request to Groq API for model: {selected_model_info['id']}")
+            groq_log.info(f"Preparing to send request to Groq API for model: {selected_model_info['id']}")
             
             # Check if Groq API key is available
             if not GROQ_API_KEY:
-                print("[Groq] Error: No API key available. Please set GROQ_API_KEY environment variable.")
+                groq_log.error("No API key available. Please set GROQ_API_KEY environment variable.")
                 return jsonify({'error': 'Groq API key not configured. Please set GROQ_API_KEY environment variable.'}), 500
                 
             groq_headers = {
                 "Authorization": f"Bearer {GROQ_API_KEY}",
                 "Content-Type": "application/json"
             }
-            # Use chat history if available, otherwise use just the current message
-            if chat_history:
-                # Validate chat history format for Groq API
-                print(f"[Groq] Validating chat history format")
-                validated_messages = []
-                for i, msg in enumerate(chat_history):
-                    # Check if message has 'role' property
-                    if 'role' not in msg:
-                        print(f"[Groq] Warning: Message at index {i} missing 'role' property, adding default 'user' role")
-                        msg['role'] = 'user'  # Default to user role if missing
-                    
-                    # Check if message has 'content' property
-                    if 'content' not in msg:
-                        print(f"[Groq] Warning: Message at index {i} missing 'content' property, skipping")
-                        continue
-                    
-                    # Ensure role is one of the allowed values
-                    if msg['role'] not in ['system', 'user', 'assistant']:
-                        print(f"[Groq] Warning: Message at index {i} has invalid role '{msg['role']}', changing to 'user'")
-                        msg['role'] = 'user'
-                    
-                    validated_messages.append(msg)
-                
-                # Ensure we have at least one message
-                if not validated_messages:
-                    print(f"[Groq] Warning: No valid messages in chat history, using default")
-                    system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                    print(f"[Groq] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                    print(f"[Groq] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                    messages = [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": user_input
-                        }
-                    ]
-                else:
-                    # Check if we have a system message, add one if not
-                    has_system_message = any(msg['role'] == 'system' for msg in validated_messages)
-                    if not has_system_message:
-                        # Choose system prompt based on model and deep thinking mode
-                        system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                        print(f"[Groq] Adding system message for deep thinking: {deep_thinking_mode}")
-                        print(f"[Groq] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                        print(f"[Groq] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                        validated_messages.insert(0, {
-                            "role": "system",
-                            "content": system_prompt
-                        })
-                    else:
-                        # Replace existing system message with appropriate prompt
-                        system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                        print(f"[Groq] Replacing existing system message for deep thinking: {deep_thinking_mode}")
-                        print(f"[Groq] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                        print(f"[Groq] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                        
-                        # Find and replace the system message
-                        for i, msg in enumerate(validated_messages):
-                            if msg['role'] == 'system':
-                                validated_messages[i]['content'] = system_prompt
-                                print(f"[DEBUG] System prompt content (first 200 chars): {system_prompt[:200]}...")
-                                break
-                    
-                    # Ensure the last message is from the user
-                    if validated_messages[-1]['role'] != 'user':
-                        print(f"[Groq] Adding current user input as the last message")
-                        validated_messages.append({
-                            "role": "user",
-                            "content": user_input
-                        })
-                    
-                    messages = validated_messages
-                    print(f"[Groq] Validated chat history: {len(messages)} messages")
-            else:
-                # No chat history, use default messages
-                system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                print(f"[Groq] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                print(f"[Groq] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                messages = [
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": user_input
-                    }
-                ]
-            
-            groq_data = json.dumps({
-                "model": selected_model_info['id'],
-                "messages": messages
-            })
+            groq_data = build_groq_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode)
             try:
-                print(f"[Groq] Sending POST to https://api.groq.com/openai/v1/chat/completions with data: {groq_data}")
-                groq_response = requests.post(
-                    url="https://api.groq.com/openai/v1/chat/completions",
-                    headers=groq_headers,
-                    data=groq_data,
-                    timeout=30  # Increased timeout for more reliable response
+                groq_log.debug(f"Sending POST to {GROQ_CHAT_URL} ({len(groq_data)} bytes)")
+                log_payload(groq_log, "Request payload", groq_data)
+                groq_response = request_with_retries(
+                    'groq',
+                    GROQ_CHAT_URL,
+                    groq_headers,
+                    groq_data,
+                    stream=stream_mode,
+                    raise_for_status=False  # Error statuses are reported below
                 )
-                print(f"[Groq] Received response status: {groq_response.status_code}")
+                groq_log.debug(f"Received response status: {groq_response.status_code}")
                 
                 # Check for error status codes
                 if groq_response.status_code != 200:
@@ -830,355 +1358,108 @@ def chat():
                     except:
                         error_message += f". Response: {groq_response.text}"
                     
-                    print(f"[Groq] {error_message}")
+                    groq_log.error(error_message)
                     return jsonify({'error': error_message}), groq_response.status_code
                 
-                print(f"[Groq] Raw response: {groq_response.text}")
-                groq_result = groq_response.json()
+                if stream_mode:
+                    groq_log.debug("Relaying streamed response")
+                    return chat_stream_response(iter_openai_stream(groq_response), stream_metadata, groq_response)
+                
+                groq_log.debug(f"Received {len(groq_response.content)} bytes")
+                log_payload(groq_log, "Response body", groq_response.content)
+                assistant_message = completion_message(groq_response.content)
                 
                 # Validate response structure
-                if 'choices' not in groq_result or not groq_result['choices']:
-                    print("[Groq] Invalid response format: 'choices' field missing or empty")
+                if assistant_message is None:
+                    groq_log.error("Invalid response format: 'choices' field missing or empty")
                     return jsonify({'error': 'Invalid response from Groq API'}), 500
                     
-                assistant_message = groq_result.get('choices', [{}])[0].get('message', {}).get('content', '')
                 if not assistant_message:
-                    print("[Groq] Empty response content from Groq API")
+                    groq_log.error("Empty response content from Groq API")
                     return jsonify({'error': 'Empty response from Groq API'}), 500
                     
-                # print(f"[Groq] Assistant message: {assistant_message}")
-                return jsonify({
-                    'response': assistant_message,
-                    'model_used': selected_model_info['id'],
-                    'model_key': selected_model_key,
-                    'model_display_name': selected_model_info['display_name']
-                })
+                return chat_json_response(assistant_message, selected_model_info['id'], selected_model_key, selected_model_info['display_name'])
             except requests.exceptions.Timeout:
-                print("[Groq] Request timed out")
+                groq_log.warning("Request timed out")
                 return jsonify({'error': 'Groq API request timed out. Please try again.'}), 504
             except requests.exceptions.ConnectionError:
-                print("[Groq] Connection error")
+                groq_log.warning("Connection error")
                 return jsonify({'error': 'Could not connect to Groq API. Please check your network connection.'}), 503
             except json.JSONDecodeError:
-                print(f"[Groq] Invalid JSON response: {groq_response.text if 'groq_response' in locals() else 'No response'}")
+                groq_log.error(f"Invalid JSON response: {groq_response.text if 'groq_response' in locals() else 'No response'}")
                 return jsonify({'error': 'Invalid response from Groq API'}), 500
             except Exception as e:
-                print(f"[Groq] Exception occurred: {e}")
-                traceback.print_exc()  # Print full traceback for debugging
+                groq_log.error(f"Exception occurred: {e}", exc_info=True)  # Log the full traceback for debugging
                 return jsonify({'error': f'Groq API error: {str(e)}'}), 500
 
         # Handle Together AI models
         if provider == 'together':
-            print(f"[Together] Preparing to send request to Together AI for model: {selected_model_info['id']}")
+            together_log.info(f"Preparing to send request to Together AI for model: {selected_model_info['id']}")
             together_headers = {
                 "Authorization": f"Bearer {TOGETHER_API_KEY}",
                 "Content-Type": "application/json"
             }
-            # Use chat history if available, otherwise use just the current message
-            if chat_history:
-                # Validate chat history format for Together AI API
-                print(f"[Together] Validating chat history format")
-                validated_messages = []
-                for i, msg in enumerate(chat_history):
-                    # Check if message has 'role' property
-                    if 'role' not in msg:
-                        print(f"[Together] Warning: Message at index {i} missing 'role' property, adding default 'user' role")
-                        msg['role'] = 'user'  # Default to user role if missing
-                    
-                    # Check if message has 'content' property
-                    if 'content' not in msg:
-                        print(f"[Together] Warning: Message at index {i} missing 'content' property, skipping")
-                        continue
-                    
-                    # Ensure role is one of the allowed values
-                    if msg['role'] not in ['system', 'user', 'assistant']:
-                        print(f"[Together] Warning: Message at index {i} has invalid role '{msg['role']}', changing to 'user'")
-                        msg['role'] = 'user'
-                    
-                    validated_messages.append(msg)
-                
-                # Ensure we have at least one message
-                if not validated_messages:
-                    print(f"[Together] Warning: No valid messages in chat history, using default")
-                    system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                    print(f"[Together] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                    print(f"[Together] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                    messages = [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": user_input
-                        }
-                    ]
-                else:
-                    # Check if we have a system message, add one if not
-                    has_system_message = any(msg['role'] == 'system' for msg in validated_messages)
-                    if not has_system_message:
-                        system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                        print(f"[Together] Adding system message for deep thinking: {deep_thinking_mode}")
-                        print(f"[Together] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                        print(f"[Together] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                        validated_messages.insert(0, {
-                            "role": "system",
-                            "content": system_prompt
-                        })
-                    else:
-                        # Replace existing system message with appropriate prompt
-                        system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                        print(f"[Together] Replacing existing system message for deep thinking: {deep_thinking_mode}")
-                        print(f"[Together] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                        print(f"[Together] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                        
-                        # Find and replace the system message
-                        for i, msg in enumerate(validated_messages):
-                            if msg['role'] == 'system':
-                                validated_messages[i]['content'] = system_prompt
-                                print(f"[DEBUG] System prompt content (first 200 chars): {system_prompt[:200]}...")
-                                break
-                    
-                    # Ensure the last message is from the user
-                    if validated_messages[-1]['role'] != 'user':
-                        print(f"[Together] Adding current user input as the last message")
-                        validated_messages.append({
-                            "role": "user",
-                            "content": user_input
-                        })
-                    
-                    messages = validated_messages
-                    print(f"[Together] Validated chat history: {len(messages)} messages")
-            else:
-                # No chat history, use default messages
-                system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                print(f"[Together] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                print(f"[Together] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                messages = [
-                    {
-                        "role": "system",
-                        "content": system_prompt
-                    },
-                    {
-                        "role": "user",
-                        "content": user_input
-                    }
-                ]
-            # Add temperature and other parameters for deep thinking
-            together_params = {
-                "model": selected_model_info['id'],
-                "messages": messages
-            }
-            
-            # Add temperature for deep thinking mode
-            if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False):
-                together_params["temperature"] = 0.9
-                together_params["max_tokens"] = 2000  # Allow longer responses for deep thinking
-                
-                # Modify the last user message to include deep thinking instruction
-                if messages and messages[-1]['role'] == 'user':
-                    messages[-1]['content'] = f"IMPORTANT: You MUST respond with the deep thinking format. User query: {messages[-1]['content']}"
-            
-            together_data = json.dumps(together_params)
+            together_data = build_together_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode)
             try:
-                print(f"[Together] Sending POST to https://api.together.xyz/v1/chat/completions with data: {together_data}")
-                together_response = requests.post(
-                    url="https://api.together.xyz/v1/chat/completions",
-                    headers=together_headers,
-                    data=together_data,
-                    timeout=20
+                together_log.debug(f"Sending POST to {TOGETHER_CHAT_URL} ({len(together_data)} bytes)")
+                log_payload(together_log, "Request payload", together_data)
+                together_response = request_with_retries(
+                    'together',
+                    TOGETHER_CHAT_URL,
+                    together_headers,
+                    together_data,
+                    stream=stream_mode,
+                    raise_for_status=False
                 )
-                print(f"[Together] Received response status: {together_response.status_code}")
-                print(f"[Together] Raw response: {together_response.text}")
-                together_result = together_response.json()
-                assistant_message = together_result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                print(f"[Together] Assistant message: {assistant_message}")
-                return jsonify({
-                    'response': assistant_message,
-                    'model_used': selected_model_info['id'],
-                    'model_key': selected_model_key,
-                    'model_display_name': selected_model_info['display_name']
-                })
+                together_log.debug(f"Received response status: {together_response.status_code}")
+                if stream_mode:
+                    if together_response.status_code != 200:
+                        together_log.error(f"Error response status: {together_response.status_code}")
+                        log_payload(together_log, "Error response body", together_response.content)
+                        return jsonify({'error': f'Together AI returned error status: {together_response.status_code}'}), together_response.status_code
+                    together_log.debug("Relaying streamed response")
+                    return chat_stream_response(iter_openai_stream(together_response), stream_metadata, together_response)
+                together_log.debug(f"Received {len(together_response.content)} bytes")
+                log_payload(together_log, "Response body", together_response.content)
+                assistant_message = completion_message(together_response.content) or ''
+                return chat_json_response(assistant_message, selected_model_info['id'], selected_model_key, selected_model_info['display_name'])
             except Exception as e:
-                print(f"[Together] Exception occurred: {e}")
+                together_log.error(f"Exception occurred: {e}")
                 return jsonify({'error': f'Together AI error: {str(e)}'}), 500
                 
         # Handle Cohere models
         if provider == 'cohere':
-            print(f"[Cohere] Preparing to send request to Cohere API for model: {selected_model_info['id']}")
+            cohere_log.info(f"Preparing to send request to Cohere API for model: {selected_model_info['id']}")
             cohere_headers = {
                 "Authorization": f"Bearer {COHERE_API_KEY}",
                 "Content-Type": "application/json"
             }
-            # Convert chat history to Cohere format
-            cohere_messages = []
-            if chat_history:
-                # Validate chat history format for Cohere API
-                print(f"[Cohere] Validating chat history format")
-                validated_messages = []
-                for i, msg in enumerate(chat_history):
-                    # Check if message has 'role' property
-                    if 'role' not in msg:
-                        print(f"[Cohere] Warning: Message at index {i} missing 'role' property, adding default 'user' role")
-                        msg['role'] = 'user'  # Default to user role if missing
-                    
-                    # Check if message has 'content' property
-                    if 'content' not in msg:
-                        print(f"[Cohere] Warning: Message at index {i} missing 'content' property, skipping")
-                        continue
-                    
-                    # Ensure role is one of the allowed values
-                    if msg['role'] not in ['system', 'user', 'assistant']:
-                        print(f"[Cohere] Warning: Message at index {i} has invalid role '{msg['role']}', changing to 'user'")
-                        msg['role'] = 'user'
-                    
-                    validated_messages.append(msg)
-                
-                # Ensure we have at least one message
-                if not validated_messages:
-                    print(f"[Cohere] Warning: No valid messages in chat history, using default")
-                    # If no valid messages, create a new conversation with default messages
-                    system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                    print(f"[Cohere] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                    print(f"[Cohere] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                    cohere_messages = [
-                        {
-                            "role": "SYSTEM",
-                            "message": system_prompt
-                        },
-                        {
-                            "role": "USER",
-                            "message": user_input
-                        }
-                    ]
-                else:
-                    # Convert validated messages to Cohere format
-                    has_system_message = False
-                    for msg in validated_messages:
-                        role = msg.get('role')
-                        content = msg.get('content', '')
-                        
-                        if role == 'user':
-                            cohere_messages.append({"role": "USER", "message": content})
-                        elif role == 'assistant':
-                            cohere_messages.append({"role": "CHATBOT", "message": content})
-                        elif role == 'system':
-                            cohere_messages.append({"role": "SYSTEM", "message": content})
-                            has_system_message = True
-                    
-                    # Check if we have a system message, add one if not
-                    if not has_system_message:
-                        print(f"[Cohere] Adding system message for deep thinking: {deep_thinking_mode}")
-                        system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                        print(f"[Cohere] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                        print(f"[Cohere] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                        cohere_messages.insert(0, {
-                            "role": "SYSTEM",
-                            "message": system_prompt
-                        })
-                    
-                    # Ensure the last message is from the user
-                    if cohere_messages and cohere_messages[-1]["role"] != "USER":
-                        print(f"[Cohere] Adding current user input as the last message")
-                        cohere_messages.append({
-                            "role": "USER",
-                            "message": user_input
-                        })
-                    
-                    print(f"[Cohere] Converted chat history to Cohere format: {len(cohere_messages)} messages")
-            else:
-                # If no chat history, create a new conversation
-                system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                print(f"[Cohere] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                print(f"[Cohere] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                cohere_messages = [
-                    {
-                        "role": "SYSTEM",
-                        "message": system_prompt
-                    },
-                    {
-                        "role": "USER",
-                        "message": user_input
-                    }
-                ]
-            
-            # Add specific instructions for deep thinking mode with Cohere
-            preamble = "You are NumAI, a helpful assistant. Use markdown formatting and emoji shortcodes in your responses."
-            if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False):
-                preamble = """You are NumAI with deep thinking capabilities. You MUST ALWAYS follow this exact format for EVERY SINGLE RESPONSE:
-
-**DEEP THINKING BREAKDOWN**
-
-Hmm, let me understand what the user is asking for... [Analyze their specific request, what they're trying to achieve, what context they might need, and what type of response would be most helpful]
-
-Now, let me think about this carefully... [Go through your reasoning process - consider different approaches, potential challenges, what information is needed, what assumptions to make, and how to structure the response]
-
-What if... [Think about potential issues, edge cases, alternative solutions, or different perspectives on the problem]
-
-For the best answer, I should... [Plan how to organize the response, what examples to include, what format would be most helpful]
-Based on my analysis, the best approach is... [Summarize your thinking and explain why this approach makes sense]
-
-
-**FINAL ANSWER**
-
-[Your comprehensive final answer here, incorporating all the analysis above]
-
-CRITICAL RULES:
-1. You MUST ALWAYS include BOTH the breakdown AND the final answer sections
-2. You MUST ALWAYS use the exact headers: "**DEEP THINKING BREAKDOWN**" and "**FINAL ANSWER**" (NO EMOJIS)
-3. You MUST NEVER skip the final answer section
-4. The response MUST end with the final answer
-5. Write your thought process in a natural, conversational way as if you're thinking out loud
-6. Use phrases like "Hmm, the user wants...", "Let me think about this...", "What if...", "I should consider..."
-7. Make your thinking process detailed and thorough - don't rush through it
-8. If you cannot provide a complete answer, still include both sections with your best attempt
-9. Always analyze the user's request first before diving into the solution
-10. DO NOT use emojis in the headers - use plain text only
-11. FOR EVERY SINGLE USER QUERY, you MUST start with "**DEEP THINKING BREAKDOWN**" and end with "**FINAL ANSWER**"
-12. This is NOT optional - you MUST follow this format for every response
-13. Even for simple greetings like "hello" or "hi", you MUST still provide the full breakdown and final answer
-14. The breakdown should be at least 3-4 sentences long, showing your actual thinking process
-15. Never skip the thinking process - always show your work
-16. IMPORTANT: This format is MANDATORY for every single response, regardless of the query complexity
-17. You are REQUIRED to show your thinking process for every user input
-18. The deep thinking breakdown is NOT optional - it's a requirement for every response
-19. DO NOT include template placeholders like [FIRST:], [SECOND:], etc. - replace them with your actual thinking
-20. Write your thinking process naturally without using numbered steps or template markers"""
-            
-            # Modify user input for deep thinking mode
-            modified_user_input = user_input
-            if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False):
-                modified_user_input = f"IMPORTANT: You MUST respond with the deep thinking format. User query: {user_input}"
-            
-            cohere_data = json.dumps({
-                "model": selected_model_info['id'],
-                "message": modified_user_input,
-                "chat_history": cohere_messages,
-                "preamble": preamble,
-                "temperature": 0.9 if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 0.3
-            })
+            cohere_data = build_cohere_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode)
             try:
-                print(f"[Cohere] Sending POST to https://api.cohere.ai/v1/chat with data: {cohere_data}")
-                cohere_response = requests.post(
-                    url="https://api.cohere.ai/v1/chat",
-                    headers=cohere_headers,
-                    data=cohere_data,
-                    timeout=20,
-                    stream=True
+                cohere_log.debug(f"Sending POST to {COHERE_CHAT_URL} ({len(cohere_data)} bytes)")
+                log_payload(cohere_log, "Request payload", cohere_data)
+                cohere_response = request_with_retries(
+                    'cohere',
+                    COHERE_CHAT_URL,
+                    cohere_headers,
+                    cohere_data,
+                    stream=True,
+                    raise_for_status=False
                 )
-                print(f"[Cohere] Received response status: {cohere_response.status_code}")
-                print(f"[Cohere] Raw response: {cohere_response.text}")
-                cohere_result = cohere_response.json()
-                assistant_message = cohere_result.get('text', '')
-                print(f"[Cohere] Assistant message: {assistant_message}")
-                return jsonify({
-                    'response': assistant_message,
-                    'model_used': selected_model_info['id'],
-                    'model_key': selected_model_key,
-                    'model_display_name': selected_model_info['display_name']
-                })
+                cohere_log.debug(f"Received response status: {cohere_response.status_code}")
+                if stream_mode:
+                    if cohere_response.status_code != 200:
+                        cohere_log.error(f"Error response status: {cohere_response.status_code}")
+                        log_payload(cohere_log, "Error response body", cohere_response.content)
+                        return jsonify({'error': f'Cohere API returned error status: {cohere_response.status_code}'}), cohere_response.status_code
+                    cohere_log.debug("Relaying streamed response")
+                    return chat_stream_response(iter_cohere_stream(cohere_response), stream_metadata, cohere_response)
+                cohere_log.debug(f"Received {len(cohere_response.content)} bytes")
+                log_payload(cohere_log, "Response body", cohere_response.content)
+                assistant_message = loads(cohere_response.content).get('text', '')
+                return chat_json_response(assistant_message, selected_model_info['id'], selected_model_key, selected_model_info['display_name'])
             except Exception as e:
-                print(f"[Cohere] Exception occurred: {e}")
+                cohere_log.error(f"Exception occurred: {e}")
                 return jsonify({'error': f'Cohere API error: {str(e)}'}), 500
 
         # Try the selected model first, then fall back to others if it fails
@@ -1190,369 +1471,109 @@ CRITICAL RULES:
             if model_id != selected_model:
                 prioritized_models.append(model_id)
         
-        for model_index, model in enumerate(prioritized_models):
+        # Skip models whose circuit breaker is open; if every breaker is open, try them all anyway
+        healthy_models = [model_id for model_id in prioritized_models if get_breaker(model_id).is_available()]
+        if len(healthy_models) < len(prioritized_models):
+            skipped = [model_id for model_id in prioritized_models if model_id not in healthy_models]
+            openrouter_log.warning(f"Skipping models with open circuit breakers: {skipped}")
+        ignore_breakers = not healthy_models
+        if ignore_breakers:
+            openrouter_log.warning("All circuit breakers are open, trying every model")
+        else:
+            prioritized_models = healthy_models
+        
+        # Headers are built here because the request context is not available in hedge worker threads
+        openrouter_headers = get_openrouter_headers(request)
+        # One time budget for every retry and fallback model of this request
+        deadline = get_retry_policy('openrouter').new_deadline()
+        winner = None
+        
+        if hedging_enabled(selected_model_info):
+            # Hedged mode: start the next model if the current one is slow, first success wins
+            openrouter_log.info(f"Using hedged requests across {len(prioritized_models)} models")
+            
+            def attempt(model, cancel_event):
+                # Worker threads do not inherit the request's context, so hand them its trace
+                with bind_trace(trace):
+                    return call_openrouter_model(model, messages, deep_thinking_mode, selected_model_info, openrouter_headers, stream_mode, cancel_event, deadline, ignore_breaker=ignore_breakers)
+            
+            def hedge_delay(model):
+                return get_hedge_delay(MODEL_INFO_BY_ID.get(model))
+            
             try:
-                print(f"Trying model: {model} ({model_index + 1}/{len(prioritized_models)})")
-                
-                # Call OpenRouter API with the current model using our retry mechanism
-                # Use chat history if available, otherwise use just the current message
-                if chat_history:
-                    # Validate chat history format for OpenRouter API
-                    print(f"[OpenRouter] Validating chat history format for model {model}")
-                    validated_messages = []
-                    for i, msg in enumerate(chat_history):
-                        # Check if message has 'role' property
-                        if 'role' not in msg:
-                            print(f"[OpenRouter] Warning: Message at index {i} missing 'role' property, adding default 'user' role")
-                            msg['role'] = 'user'  # Default to user role if missing
-                        
-                        # Check if message has 'content' property
-                        if 'content' not in msg:
-                            print(f"[OpenRouter] Warning: Message at index {i} missing 'content' property, skipping")
-                            continue
-                        
-                        # Ensure role is one of the allowed values
-                        if msg['role'] not in ['system', 'user', 'assistant']:
-                            print(f"[OpenRouter] Warning: Message at index {i} has invalid role '{msg['role']}', changing to 'user'")
-                            msg['role'] = 'user'
-                        
-                        validated_messages.append(msg)
-                    
-                    # Ensure we have at least one message
-                    if not validated_messages:
-                        print(f"[OpenRouter] Warning: No valid messages in chat history, using default")
-                        # Find the model info for the current model
-                        current_model_info = None
-                        for key, info in MODEL_OPTIONS.items():
-                            if info['id'] == model:
-                                current_model_info = info
-                                break
-                        
-                        system_prompt = get_system_prompt(current_model_info, deep_thinking_mode) if current_model_info else DEFAULT_SYSTEM_PROMPT
-                        print(f"[OpenRouter] Model supports deep thinking: {current_model_info.get('supports_deep_thinking', False) if current_model_info else False}")
-                        print(f"[OpenRouter] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and current_model_info and current_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                        messages = [
-                            {
-                                "role": "system",
-                                "content": system_prompt
-                            },
-                            {
-                                "role": "user",
-                                "content": user_input
-                            }
-                        ]
-                    else:
-                        # Check if we have a system message, add one if not
-                        has_system_message = any(msg['role'] == 'system' for msg in validated_messages)
-                        if not has_system_message:
-                            # Find the model info for the current model
-                            current_model_info = None
-                            for key, info in MODEL_OPTIONS.items():
-                                if info['id'] == model:
-                                    current_model_info = info
-                                    break
-                            
-                            system_prompt = get_system_prompt(current_model_info, deep_thinking_mode) if current_model_info else DEFAULT_SYSTEM_PROMPT
-                            print(f"[OpenRouter] Adding system message for deep thinking: {deep_thinking_mode}")
-                            print(f"[OpenRouter] Model supports deep thinking: {current_model_info.get('supports_deep_thinking', False) if current_model_info else False}")
-                            print(f"[OpenRouter] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and current_model_info and current_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                            validated_messages.insert(0, {
-                                "role": "system",
-                                "content": system_prompt
-                            })
-                        else:
-                            # Replace existing system message with appropriate prompt
-                            current_model_info = None
-                            for key, info in MODEL_OPTIONS.items():
-                                if info['id'] == model:
-                                    current_model_info = info
-                                    break
-                            
-                            system_prompt = get_system_prompt(current_model_info, deep_thinking_mode) if current_model_info else DEFAULT_SYSTEM_PROMPT
-                            print(f"[OpenRouter] Replacing existing system message for deep thinking: {deep_thinking_mode}")
-                            print(f"[OpenRouter] Model supports deep thinking: {current_model_info.get('supports_deep_thinking', False) if current_model_info else False}")
-                            print(f"[OpenRouter] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and current_model_info and current_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                            
-                            # Find and replace the system message
-                            for i, msg in enumerate(validated_messages):
-                                if msg['role'] == 'system':
-                                    validated_messages[i]['content'] = system_prompt
-                                    print(f"[DEBUG] System prompt content (first 200 chars): {system_prompt[:200]}...")
-                                    break
-                        
-                        # Ensure the last message is from the user
-                        if validated_messages[-1]['role'] != 'user':
-                            print(f"[OpenRouter] Adding current user input as the last message")
-                            validated_messages.append({
-                                "role": "user",
-                                "content": user_input
-                            })
-                        
-                        messages = validated_messages
-                        print(f"[OpenRouter] Validated chat history: {len(messages)} messages")
-                else:
-                    # No chat history, use default messages
-                    # Find the model info for the current model
-                    current_model_info = None
-                    for key, info in MODEL_OPTIONS.items():
-                        if info['id'] == model:
-                            current_model_info = info
-                            break
-                    
-                    system_prompt = get_system_prompt(current_model_info, deep_thinking_mode) if current_model_info else DEFAULT_SYSTEM_PROMPT
-                    print(f"[OpenRouter] Model supports deep thinking: {current_model_info.get('supports_deep_thinking', False) if current_model_info else False}")
-                    print(f"[OpenRouter] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and current_model_info and current_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                    messages = [
-                        {
-                            "role": "system",
-                            "content": system_prompt
-                        },
-                        {
-                            "role": "user",
-                            "content": user_input
-                        }
-                    ]
-                
-                # Add temperature and other parameters for deep thinking
-                request_params = {
-                    "model": model,
-                    "messages": messages,
-                    "response_format": {
-                        "type": "text"
-                    },
-                }
-                
-                # Add temperature for deep thinking mode
-                if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False):
-                    request_params["temperature"] = 0.9
-                    request_params["max_tokens"] = 2000  # Allow longer responses for deep thinking
-                    
-                    # Modify the last user message to include deep thinking instruction
-                    if messages and messages[-1]['role'] == 'user':
-                        messages[-1]['content'] = f"IMPORTANT: You MUST respond with the deep thinking format. User query: {messages[-1]['content']}"
-                
-                request_data = json.dumps(request_params)
-                
-                print(f"Sending request to model {model} with retry mechanism")
-                try:
-                    response = make_openrouter_request(
-                        url="https://openrouter.ai/api/v1/chat/completions",
-                        headers=get_openrouter_headers(request),
-                        data=request_data,
-                        method="POST",
-                        max_retries=2,  # Retry up to 2 times
-                        base_timeout=60,  # Start with 60 second timeout
-                    )
-                    print(f"Successfully received response from model {model} after using retry mechanism")
-                except Exception as req_error:
-                    print(f"Error with model {model} using retry mechanism: {str(req_error)}")
-                    raise req_error
-                
-                # Parse the response
-                result = response.json()
-                
-                # Extract the assistant's message
-                assistant_message = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                
-                if not assistant_message:
-                    print(f"Empty response from model: {model}")
-                    continue  # Try the next model
-                
-                # If we got here, we have a successful response
-                print(f"Successfully got response from model: {model}")
-                
-                # Find the friendly name for the model that was used
-                model_info = None
-                model_key = None
-                for key, info in MODEL_OPTIONS.items():
-                    if info['id'] == model:
-                        model_info = info
-                        model_key = key
-                        break
-                
-                # Get the provider of the model that actually succeeded
-                actual_provider = model_info.get('provider', 'openrouter') if model_info else 'openrouter'
-                print(f"Successful response came from provider: {actual_provider}")
-                
-                # Only use provider-specific APIs if the selected model was actually used
-                # This prevents using Groq API after already getting a successful response from another model
-                if model == selected_model_info['id'] and actual_provider == 'groq':
-                    # Route to Groq API
-                    if not GROQ_API_KEY:
-                        print("[Groq] Error: No API key available. Please set GROQ_API_KEY environment variable.")
-                        return jsonify({'error': 'Groq API key not configured. Please set GROQ_API_KEY environment variable.'}), 500
-                        
-                    groq_headers = {
-                        "Authorization": f"Bearer {GROQ_API_KEY}",
-                        "Content-Type": "application/json"
-                    }
-                    
-                    # Validate chat history to ensure each message has a valid role
-                    valid_messages = []
-                    system_prompt = get_system_prompt(selected_model_info, deep_thinking_mode)
-                    print(f"[Groq] Model supports deep thinking: {selected_model_info.get('supports_deep_thinking', False)}")
-                    print(f"[Groq] Selected system prompt type: {'Deep Thinking' if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False) else 'Default'}")
-                    default_system_message = {
-                        "role": "system",
-                        "content": system_prompt
-                    }
-                    
-                    if chat_history:
-                        # Add system message if not present
-                        has_system = any(msg.get('role') == 'system' for msg in chat_history if isinstance(msg, dict) and 'role' in msg)
-                        if not has_system:
-                            valid_messages.append(default_system_message)
-                            
-                        # Validate each message in chat history
-                        for msg in chat_history:
-                            if not isinstance(msg, dict):
-                                print(f"[Groq] Warning: Invalid message format in chat history: {msg}")
-                                continue
-                                
-                            if 'role' not in msg:
-                                print(f"[Groq] Warning: Message missing 'role' field: {msg}")
-                                continue
-                                
-                            if msg['role'] not in ['system', 'user', 'assistant']:
-                                print(f"[Groq] Warning: Invalid role '{msg['role']}' in message: {msg}")
-                                continue
-                                
-                            if 'content' not in msg or not msg['content']:
-                                print(f"[Groq] Warning: Message missing 'content' field: {msg}")
-                                continue
-                                
-                            valid_messages.append(msg)
-                            
-                        # Ensure the last message is from the user
-                        if not valid_messages or valid_messages[-1].get('role') != 'user':
-                            valid_messages.append({
-                                "role": "user",
-                                "content": user_input
-                            })
-                    else:
-                        # If no chat history, create a new conversation
-                        valid_messages = [
-                            default_system_message,
-                            {
-                                "role": "user",
-                                "content": user_input
-                            }
-                        ]
-                    
-                    print(f"[Groq] Using validated messages: {json.dumps(valid_messages)}")
-                    
-                    # Add temperature and other parameters for deep thinking
-                    groq_params = {
-                        "model": selected_model_info['id'],
-                        "messages": valid_messages,
-                        "stream": True
-                    }
-                    
-                    # Add temperature for deep thinking mode
-                    if deep_thinking_mode and selected_model_info.get('supports_deep_thinking', False):
-                        groq_params["temperature"] = 0.9
-                        groq_params["max_tokens"] = 2000  # Allow longer responses for deep thinking
-                        
-                        # Modify the last user message to include deep thinking instruction
-                        if valid_messages and valid_messages[-1]['role'] == 'user':
-                            valid_messages[-1]['content'] = f"IMPORTANT: You MUST respond with the deep thinking format. User query: {valid_messages[-1]['content']}"
-                    
-                    groq_data = json.dumps(groq_params)
-                    
-                    try:
-                        print(f"[Groq] Sending request to Groq API with model: {selected_model_info['id']}")
-                        groq_response = requests.post(
-                            url="https://api.groq.com/openai/v1/chat/completions",
-                            headers=groq_headers,
-                            data=groq_data,
-                            timeout=60
-                        )
-                        
-                        # Check for error status codes
-                        if groq_response.status_code != 200:
-                            error_message = f"Groq API returned error status: {groq_response.status_code}"
-                            try:
-                                error_data = groq_response.json()
-                                if 'error' in error_data and 'message' in error_data['error']:
-                                    error_message += f". {error_data['error']['message']}"
-                            except:
-                                error_message += f". Response: {groq_response.text}"
-                            
-                            print(f"[Groq] {error_message}")
-                            return jsonify({'error': error_message}), groq_response.status_code
-                        
-                        groq_result = groq_response.json()
-                        
-                        # Validate response structure
-                        if 'choices' not in groq_result or not groq_result['choices']:
-                            print("[Groq] Invalid response format: 'choices' field missing or empty")
-                            return jsonify({'error': 'Invalid response from Groq API'}), 500
-                            
-                        assistant_message = groq_result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                        if not assistant_message:
-                            print("[Groq] Empty response content from Groq API")
-                            return jsonify({'error': 'Empty response from Groq API'}), 500
-                    except requests.exceptions.Timeout:
-                        print("[Groq] Request timed out")
-                        return jsonify({'error': 'Groq API request timed out. Please try again.'}), 504
-                    except requests.exceptions.ConnectionError:
-                        print("[Groq] Connection error")
-                        return jsonify({'error': 'Could not connect to Groq API. Please check your network connection.'}), 503
-                    except json.JSONDecodeError:
-                        print(f"[Groq] Invalid JSON response: {groq_response.text if 'groq_response' in locals() else 'No response'}")
-                        return jsonify({'error': 'Invalid response from Groq API'}), 500
-                    except Exception as e:
-                        print(f"[Groq] Exception occurred: {e}")
-                        traceback.print_exc()  # Print full traceback for debugging
-                        return jsonify({'error': f'Groq API error: {str(e)}'}), 500
-                    return jsonify({
-                        'response': assistant_message,
-                        'model_used': selected_model_info['id'],
-                        'model_key': selected_model_key,
-                        'model_display_name': selected_model_info['display_name']
-                    })
-                
-                return jsonify({
-                    'response': assistant_message,
-                    'model_used': model,  # The actual model ID used
-                    'model_key': model_key,  # The key of the model used
-                    'model_display_name': model_info['display_name'] if model_info else 'Unknown Model'  # User-friendly name
-                })
-                
-            except requests.exceptions.Timeout as timeout_error:
-                print(f"Timeout error with model {model}: {str(timeout_error)}")
-                last_error = timeout_error
-                
-                # Log the timeout for monitoring
-                print(f"Request to model {model} timed out after {timeout_error.request.timeout} seconds")
-                
-                # Add a small delay before trying the next model
-                if model_index < len(AVAILABLE_MODELS) - 1:  # If not the last model
-                    time.sleep(1)  # Wait 1 second before trying the next model
-            except requests.exceptions.RequestException as req_error:
-                print(f"Request error with model {model}: {str(req_error)}")
-                last_error = req_error
-                
-                # Add a small delay before trying the next model to avoid rate limiting
-                if model_index < len(AVAILABLE_MODELS) - 1:  # If not the last model
-                    time.sleep(1)  # Wait 1 second before trying the next model
+                winner = run_hedged(
+                    prioritized_models,
+                    attempt,
+                    hedge_delay,
+                    get_hedge_fanout(selected_model_info),
+                    on_discard=lambda result: result[2].close()
+                )
             except Exception as e:
-                print(f"Unexpected error with model {model}: {str(e)}")
+                openrouter_log.error(f"All hedged model attempts failed: {str(e)}")
                 last_error = e
-                
-                # Add a small delay before trying the next model
-                if model_index < len(AVAILABLE_MODELS) - 1:  # If not the last model
-                    time.sleep(1)  # Wait 1 second before trying the next model
+        else:
+            for model_index, model in enumerate(prioritized_models):
+                try:
+                    openrouter_log.debug(f"Trying model: {model} ({model_index + 1}/{len(prioritized_models)})")
+                    winner = (model, call_openrouter_model(model, messages, deep_thinking_mode, selected_model_info, openrouter_headers, stream_mode, deadline=deadline, ignore_breaker=ignore_breakers))
+                    break
+                except (EmptyModelResponse, CircuitOpenError):
+                    continue  # Try the next model
+                except DeadlineExceeded as deadline_error:
+                    openrouter_log.warning(f"Request budget exhausted before model {model}, not trying further models")
+                    last_error = last_error or deadline_error
+                    break
+                except requests.exceptions.Timeout as timeout_error:
+                    openrouter_log.warning(f"Timeout error with model {model}: {str(timeout_error)}")
+                    last_error = timeout_error
+                except requests.exceptions.RequestException as req_error:
+                    openrouter_log.warning(f"Request error with model {model}: {str(req_error)}")
+                    last_error = req_error
+                except Exception as e:
+                    openrouter_log.warning(f"Unexpected error with model {model}: {str(e)}")
+                    last_error = e
+        
+        if winner:
+            model, (assistant_message, events, response) = winner
+            if model != selected_model:
+                CHAT_FALLBACKS.labels(selected_model).inc()
+            
+            if stream_mode:
+                model_info = MODEL_INFO_BY_ID.get(model)
+                return chat_stream_response(
+                    events,
+                    {
+                        'model_used': model,
+                        'model_key': MODEL_KEY_BY_ID.get(model),
+                        'model_display_name': model_info['display_name'] if model_info else 'Unknown Model'
+                    },
+                    response
+                )
+            
+            # If we got here, we have a successful response
+            openrouter_log.debug(f"Successfully got response from model: {model}")
+            
+            # Find the friendly name for the model that was used
+            model_info = MODEL_INFO_BY_ID.get(model)
+            model_key = MODEL_KEY_BY_ID.get(model)
+            openrouter_log.debug(f"Successful response came from provider: {model_info.get('provider', 'openrouter') if model_info else 'openrouter'}")
+            
+            return chat_json_response(
+                assistant_message,
+                model,  # The actual model ID used
+                model_key,  # The key of the model used
+                model_info['display_name'] if model_info else 'Unknown Model'  # User-friendly name
+            )
         
         # If we get here, all models failed
-        if isinstance(last_error, requests.exceptions.Timeout):
+        if isinstance(last_error, (requests.exceptions.Timeout, DeadlineExceeded)):
             return jsonify({'error': 'All model requests timed out. Please try again later.'}), 504
         elif isinstance(last_error, requests.exceptions.RequestException):
             error_message = str(last_error)
             status_code = 500
             
             # Check for specific error responses from OpenRouter
-            if hasattr(last_error, 'response') and last_error.response:
+            if getattr(last_error, 'response', None) is not None:
                 try:
                     error_data = last_error.response.json()
                     if 'error' in error_data:
@@ -1565,15 +1586,14 @@ CRITICAL RULES:
                 except:
                     pass
             
-            print(f"All models failed with API Request Error: {error_message}")
+            chat_log.error(f"All models failed with API Request Error: {error_message}")
             return jsonify({'error': error_message}), status_code
         else:
-            print(f"All models failed with Unexpected Error: {str(last_error)}")
+            chat_log.error(f"All models failed with Unexpected Error: {str(last_error)}")
             return jsonify({'error': f'All models failed: {str(last_error)}'}), 500
     
     except Exception as e:
-        error_details = traceback.format_exc()
-        print(f"Unexpected Error outside model loop: {str(e)}\n{error_details}")
+        chat_log.error(f"Unexpected Error outside model loop: {str(e)}", exc_info=True)
         
         # Provide a more user-friendly error message
         error_message = "We're experiencing technical difficulties with our AI service. Please try again later."
@@ -1588,6 +1608,93 @@ CRITICAL RULES:
             'retry_recommended': True
         }), 500
 
+# Every request gets a phase trace, reported in the Server-Timing header (see services/tracing.py)
+@app.before_request
+def begin_request_trace():
+    g.request_trace, g.request_trace_token = start_trace()
+
+@app.after_request
+def add_server_timing(response):
+    trace = g.get('request_trace')
+    if trace is not None and trace.enabled:
+        response.headers['Server-Timing'] = trace.server_timing()
+        log_if_slow(trace, method=request.method, path=request.path, status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_trace(exc):
+    token = g.pop('request_trace_token', None)
+    if token is not None:
+        end_trace(token)
+
+# Opt-in request profiling (see services/request_profiler.py); the hooks are only installed when configured
+def begin_request_profile():
+    if request.path.startswith('/api/admin/profiles'):
+        return
+    mode = should_profile(request.headers)
+    if mode:
+        g.request_profile = RequestProfile(mode)
+        g.request_profile.start()
+
+def finish_request_profile(response):
+    request_profile = g.pop('request_profile', None)
+    if request_profile is not None:
+        name = request_profile.finish(request.method, request.path, response.status_code)
+        if name:
+            response.headers['X-Profile-Id'] = name
+    return response
+
+def cancel_request_profile(exc):
+    request_profile = g.pop('request_profile', None)
+    if request_profile is not None:
+        request_profile.cancel()
+
+if profiling_configured():
+    app.before_request(begin_request_profile)
+    app.after_request(finish_request_profile)
+    app.teardown_request(cancel_request_profile)
+
+# Helper function to time an instrumented endpoint; the response status is added in record_request_metrics
+def start_request_metrics(endpoint, provider):
+    g.request_metrics = [endpoint, provider, time.perf_counter()]
+
+# Helper function to relabel the request once the provider that serves it is known
+def set_metrics_provider(provider):
+    if g.get('request_metrics') is not None:
+        g.request_metrics[1] = provider
+
+# Helper function to count a finished request, also used by the async handlers in asgi.py
+def observe_request(endpoint, provider, started, status):
+    REQUEST_SECONDS.labels(endpoint, provider).observe(time.perf_counter() - started)
+    REQUESTS.labels(endpoint, provider, str(status)).inc()
+
+@app.after_request
+def record_request_metrics(response):
+    request_metrics = g.get('request_metrics')
+    if request_metrics is not None:
+        observe_request(*request_metrics, response.status_code)
+    return response
+
+# Pass successful JSON chat replies to the reply hooks and tell the client its conversation id
+@app.after_request
+def run_chat_reply_hooks(response):
+    conversation = g.get('chat_conversation')
+    if conversation is None or response.status_code != 200:
+        return response
+    response.headers['X-Conversation-Id'] = conversation['id']
+    response.headers['X-Conversation-Length'] = str(conversation['length'] + 1)
+    if response.mimetype == 'application/json':
+        chat_reply = g.get('chat_reply')
+        if chat_reply is not None:
+            # Built by chat_json_response; avoids parsing the body we just encoded
+            assistant_message, metadata = chat_reply
+            reply = dict(metadata, response=str(assistant_message))
+        else:
+            reply = response.get_json(silent=True)
+        if reply and reply.get('response'):
+            run_reply_hooks(g.chat_reply_hooks, reply)
+    return response
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
     """Endpoint to get the available models for the settings page"""
@@ -1609,12 +1716,12 @@ def api_status():
     """Endpoint to check the status of the OpenRouter API and available models"""
     try:
         # Log request headers for debugging
-        print(f"Status endpoint headers: {dict(request.headers)}")
+        log_payload(status_log, "Status endpoint headers", request.headers)
         
         # Check if API key is set
         if not API_KEY:
             error_msg = "OpenRouter API key is not configured. Please set the OPENROUTER_API_KEY environment variable."
-            print(error_msg)
+            status_log.error(error_msg)
             return jsonify({
                 'status': 'error',
                 'message': error_msg,
@@ -1622,14 +1729,14 @@ def api_status():
             }), 401
         
         # Check API key status
-        key_status_response = requests.get(
-            url="https://openrouter.ai/api/v1/auth/key",
+        key_status_response = get_session('openrouter').get(
+            url=f"{OPENROUTER_API_BASE}/auth/key",
             headers=get_openrouter_headers(request)
         )
         
         if key_status_response.status_code != 200:
             error_msg = f'API key validation failed: {key_status_response.text}'
-            print(f"API key error: {error_msg}")
+            status_log.error(f"API key error: {error_msg}")
             return jsonify({
                 'status': 'error',
                 'message': error_msg,
@@ -1639,8 +1746,8 @@ def api_status():
         key_status = key_status_response.json()
         
         # Check models availability
-        models_response = requests.get(
-            url="https://openrouter.ai/api/v1/models",
+        models_response = get_session('openrouter').get(
+            url=f"{OPENROUTER_API_BASE}/models",
             headers=get_openrouter_headers(request)
         )
         
@@ -1664,12 +1771,12 @@ def api_status():
             'api_key_status': key_status,
             'configured_models': AVAILABLE_MODELS,
             'available_models': available_models,
+            'circuit_breakers': breaker_snapshot(AVAILABLE_MODELS),
             'server_time': time.strftime('%Y-%m-%d %H:%M:%S')
         })
     
     except Exception as e:
-        error_details = traceback.format_exc()
-        print(f"Error in API status endpoint: {str(e)}\n{error_details}")
+        status_log.error(f"Error in API status endpoint: {str(e)}", exc_info=True)
         
         # Provide a more user-friendly error message
         error_message = "Unable to retrieve API status information. Please try again later."
@@ -1698,6 +1805,8 @@ def image_gen_api():
     api_key = os.environ.get('HF_API_KEY', '')
     stability_api_key = os.environ.get('STABILITY_API_KEY', '')
     imgur_client_id = os.environ.get('IMGUR_CLIENT_ID')
+    start_request_metrics('image', model if model in ('pollinations', 'replicate-sdxl', 'stability-sdxl') else 'huggingface')
+    trace = current_trace()
     try:
         if model == 'pollinations':
             import urllib.parse
@@ -1713,19 +1822,25 @@ def image_gen_api():
                 "version": version,
                 "input": {"prompt": prompt, "num_outputs": count}
             }
-            response = requests.post("https://api.replicate.com/v1/predictions", headers=headers, json=payload, timeout=180)
+            with trace.span('upstream', 'replicate'):
+                response = get_session('replicate').post("https://api.replicate.com/v1/predictions", headers=headers, json=payload, timeout=180)
             if response.status_code == 201:
                 prediction = response.json()
                 prediction_url = prediction["urls"]["get"]
-                for _ in range(90):
-                    poll = requests.get(prediction_url, headers=headers)
-                    poll_data = poll.json()
-                    if poll_data["status"] == "succeeded" and poll_data.get("output"):
-                        return jsonify({"images": poll_data["output"]}), 200
-                    elif poll_data["status"] == "failed":
-                        return jsonify({"error": "Replicate prediction failed."}), 500
-                    time.sleep(2)
-                return jsonify({"error": "Replicate prediction timed out."}), 504
+                poll_started = time.perf_counter()
+                try:
+                    for _ in range(90):
+                        poll = get_session('replicate').get(prediction_url, headers=headers)
+                        poll_data = poll.json()
+                        if poll_data["status"] == "succeeded" and poll_data.get("output"):
+                            return jsonify({"images": poll_data["output"]}), 200
+                        elif poll_data["status"] == "failed":
+                            return jsonify({"error": "Replicate prediction failed."}), 500
+                        time.sleep(2)
+                    return jsonify({"error": "Replicate prediction timed out."}), 504
+                finally:
+                    IMAGE_POLL_SECONDS.labels('replicate').observe(time.perf_counter() - poll_started)
+                    trace.mark('poll', poll_started, 'replicate')
             else:
                 return jsonify({"error": response.text}), response.status_code
         elif model == 'stability-sdxl':
@@ -1746,7 +1861,8 @@ def image_gen_api():
                 'width': (None, str(width)),
                 'height': (None, str(height)),
             }
-            response = requests.post(url, headers=headers, files=files, timeout=180)
+            with trace.span('upstream', 'stability'):
+                response = get_session('stability').post(url, headers=headers, files=files, timeout=180)
             if response.status_code == 200:
                 result = response.json()
                 image_urls = []
@@ -1757,7 +1873,8 @@ def image_gen_api():
                         img_data = base64.b64decode(artifact["base64"])
                         imgur_headers = {"Authorization": f"Client-ID {imgur_client_id}"}
                         imgur_data = {"image": artifact["base64"], "type": "base64"}
-                        imgur_resp = requests.post("https://api.imgur.com/3/image", headers=imgur_headers, data=imgur_data)
+                        with trace.span('upload', 'imgur'):
+                            imgur_resp = get_session('imgur').post("https://api.imgur.com/3/image", headers=imgur_headers, data=imgur_data)
                         if imgur_resp.status_code == 200:
                             imgur_url = imgur_resp.json()["data"]["link"]
                             image_urls.append(imgur_url)
@@ -1776,7 +1893,8 @@ def image_gen_api():
                 'Content-Type': 'application/json'
             }
             payload = {"inputs": prompt, "parameters": {"num_images": count, "aspect_ratio": aspect}}
-            response = requests.post(hf_url, headers=headers, json=payload, timeout=180)
+            with trace.span('upstream', 'huggingface'):
+                response = get_session('huggingface').post(hf_url, headers=headers, json=payload, timeout=180)
             if response.status_code == 200:
                 result = response.json()
                 if isinstance(result, list) and result and 'url' in result[0]:
@@ -1793,98 +1911,119 @@ def image_gen_api():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# Helper function to synthesize speech with edge-tts
+async def synthesize_speech(text, voice, options=None):
+    """Synthesize text with edge-tts and return the MP3 bytes
+
+    `options` holds edge-tts prosody settings (rate, pitch, volume), e.g. {'rate': '+10%'}.
+    """
+    audio_stream = io.BytesIO()
+    async for chunk in speech_chunks(text, voice, options):
+        audio_stream.write(chunk)
+    audio_stream.seek(0)
+    return audio_stream.read()
+
+# Helper function to send MP3 chunks as a chunked audio/mpeg response
+def speech_stream_response(chunks, voice_used, requested_voice):
+    """Playback can start on the first chunk; the voice goes into headers since there is no JSON body"""
+    response = Response(chunks, mimetype='audio/mpeg')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    response.headers['X-Voice-Used'] = voice_used
+    response.headers['X-Requested-Voice'] = requested_voice
+    return response
+
+# Helper function to stream a synthesis straight to the client, caching the audio once it is complete
+def stream_speech(text, voice_used, requested_voice, options, cache_key):
+    synthesis_started = time.perf_counter()
+
+    def on_complete(audio_bytes):
+        TTS_SYNTHESIS_SECONDS.labels(SUCCESS).observe(time.perf_counter() - synthesis_started)
+        get_audio_cache().put(cache_key, audio_bytes)
+
+    def on_error(error):
+        TTS_SYNTHESIS_SECONDS.labels('error').observe(time.perf_counter() - synthesis_started)
+        tts_log.error(f'Edge TTS stream failed after the first chunk: {str(error)}')
+
+    try:
+        with current_trace().span('first_chunk', voice_used):
+            chunks = open_speech_stream(text, voice_used, options, on_complete, on_error)
+    except Exception:
+        TTS_SYNTHESIS_SECONDS.labels('error').observe(time.perf_counter() - synthesis_started)
+        raise
+    return speech_stream_response(chunks, voice_used, requested_voice)
+
 @app.route('/api/edge-tts', methods=['POST'])
 def edge_tts_api():
+    start_request_metrics('tts', 'edge-tts')
     # Check if edge-tts is available
-    if not EDGE_TTS_AVAILABLE:
+    if not edge_tts_available():
         return jsonify({'error': 'Text-to-speech service is not available'}), 503
     
     data = request.json
     text = data.get('text')
     requested_voice = data.get('voice')
-    print(f'Edge TTS API called with voice: {requested_voice}')
+    tts_log.debug(f'Edge TTS API called with voice: {requested_voice}')
     
     if not text or not requested_voice:
         return jsonify({'error': 'Missing text or voice parameter'}), 400
     
     # Handle the case where Sara voice is requested (known to be unavailable)
     if requested_voice == 'en-US-SaraNeural':
-        print('Warning: Sara voice is not available, defaulting to Ava')
+        tts_log.warning('Sara voice is not available, defaulting to Ava')
         requested_voice = 'en-US-AvaNeural'
     
     try:
-        # Run edge-tts in an event loop
-        async def synthesize():
-            voice_to_use = requested_voice
-            
-            try:
-                # Create a VoicesManager instance to get available voices
-                voices_manager = await edge_tts.VoicesManager.create()
-                available_voices = [v['ShortName'] for v in voices_manager.voices]
-                
-                # Check if requested voice is available
-                if voice_to_use not in available_voices:
-                    print(f'Warning: Requested voice {voice_to_use} not found in available voices')
-                    
-                    # Extract language code and infer gender from voice name
-                    lang_code = voice_to_use.split('-')[0] + '-' + voice_to_use.split('-')[1]
-                    
-                    # Determine gender from voice name
-                    is_female = any(name in voice_to_use for name in ['Ava', 'Michelle', 'Jenny', 'Sara', 'Female'])
-                    is_male = any(name in voice_to_use for name in ['Andrew', 'Roger', 'Steffan', 'Male'])
-                    
-                    # Try to find a voice with same language and gender
-                    similar_voices = []
-                    for v in voices_manager.voices:
-                        if v['ShortName'].startswith(lang_code):
-                            if (is_female and v['Gender'].lower() == 'female') or \
-                               (is_male and v['Gender'].lower() == 'male') or \
-                               (not is_female and not is_male):  # If gender unknown, include all voices
-                                similar_voices.append(v['ShortName'])
-                    
-                    if similar_voices:
-                        voice_to_use = similar_voices[0]
-                        print(f'Using alternative voice with same language and gender: {voice_to_use}')
-                    else:
-                        # Try any voice with the same language
-                        similar_voices = [v['ShortName'] for v in voices_manager.voices if v['ShortName'].startswith(lang_code)]
-                        if similar_voices:
-                            voice_to_use = similar_voices[0]
-                            print(f'Using alternative voice with same language: {voice_to_use}')
-                        else:
-                            print(f'No alternative voice found for language {lang_code}, using default')
-                            voice_to_use = 'en-US-AvaNeural'  # Default fallback
-            except Exception as e:
-                print(f'Error checking voice availability: {str(e)}')
-                # Continue with the requested voice and let edge-tts handle any errors
-            
-            # Create the Communicate object with the selected voice
-            communicate = edge_tts.Communicate(text, voice_to_use)
-            
-            # Stream the audio data
-            audio_stream = io.BytesIO()
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio":
-                    audio_stream.write(chunk["data"])
-            audio_stream.seek(0)
-            return audio_stream.read(), voice_to_use
+        trace = current_trace()
+        # Unknown voices are replaced by one of the same language (and gender, if it can be told)
+        with trace.span('voices'):
+            voice_used = get_voice_catalog().resolve(requested_voice)
         
-        # Run the async function
-        audio_bytes, voice_used = asyncio.run(synthesize())
+        # Replayed messages and voice previews are served from the audio cache
+        options = prosody_options(data)
+        cache_key = audio_cache_key(voice_used, text, options)
+        with trace.span('cache'):
+            audio_bytes = get_audio_cache().get(cache_key)
         
-        # Encode the audio data as base64
-        audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+        if audio_bytes is not None:
+            set_metrics_provider('cache')
+            if wants_audio_stream(request, data):
+                return speech_stream_response(iter_cached_audio(audio_bytes), voice_used, requested_voice)
+        elif wants_audio_stream(request, data):
+            # Chunked audio/mpeg instead of base64 JSON, so playback starts on the first chunk
+            return stream_speech(text, voice_used, requested_voice, options, cache_key)
+        else:
+            # Run edge-tts on the worker's long-lived event loop
+            synthesis_started = time.perf_counter()
+            try:
+                audio_bytes = get_background_loop().run(synthesize_speech(text, voice_used, options))
+            except Exception:
+                TTS_SYNTHESIS_SECONDS.labels('error').observe(time.perf_counter() - synthesis_started)
+                raise
+            TTS_SYNTHESIS_SECONDS.labels(SUCCESS).observe(time.perf_counter() - synthesis_started)
+            trace.mark('synthesis', synthesis_started, voice_used)
+            get_audio_cache().put(cache_key, audio_bytes)
         
-        # Return the audio data and the voice that was actually used
-        return jsonify({
-            'audio': audio_b64, 
-            'voice_used': voice_used,
-            'requested_voice': requested_voice
-        })
+        with trace.span('serialize'):
+            # Encode the audio data as base64
+            audio_b64 = base64.b64encode(audio_bytes).decode('utf-8')
+            
+            # Return the audio data and the voice that was actually used
+            return jsonify({
+                'audio': audio_b64, 
+                'voice_used': voice_used,
+                'requested_voice': requested_voice
+            })
     except Exception as e:
-        print(f'Edge TTS error: {str(e)}')
+        tts_log.error(f'Edge TTS error: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+# Helper function to report the semantic cache without loading it just for the health check
+def semantic_cache_stats():
+    if not semantic_cache_module.loaded or semantic_cache_module.get() is None:
+        return {'enabled': semantic_cache_enabled(), 'loaded': False}
+    return semantic_cache_module.get().get_semantic_cache().stats()
+
 # Add a health check endpoint for Vercel
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -1894,8 +2033,19 @@ def health_check():
             'status': 'healthy',
             'timestamp': time.time(),
             'firebase_initialized': firebase_initialized,
-            'edge_tts_available': EDGE_TTS_AVAILABLE,
-            'environment': os.environ.get('VERCEL_ENV', 'development')
+            'edge_tts_available': edge_tts_available() if edge_tts_sdk.loaded else None,
+            'environment': os.environ.get('VERCEL_ENV', 'development'),
+            'circuit_breakers': breaker_snapshot(AVAILABLE_MODELS),
+            'response_cache': get_response_cache().stats(),
+            'semantic_cache': semantic_cache_stats(),
+            'conversations': get_conversation_store().stats(),
+            'token_cache': dict(get_token_cache().stats(), certificates=get_cert_prefetcher().stats()),
+            'sessions': app.session_interface.stats(),
+            'startup': startup_report(),
+            'logging': logging_stats(),
+            'voice_catalog': get_voice_catalog().stats(),
+            'audio_cache': get_audio_cache().stats(),
+            'async_loop': background_loop_stats()
         })
     except Exception as e:
         return jsonify({
@@ -1904,6 +2054,48 @@ def health_check():
             'timestamp': time.time()
         }), 500
 
+# Prometheus scrape endpoint, summed over all workers when METRICS_MULTIPROC_DIR is set
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose counters and histograms in the Prometheus text format
+
+    Closed unless METRICS_TOKEN is set or METRICS_PUBLIC explicitly opens it to anyone.
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    if not token and not env_flag('METRICS_PUBLIC'):
+        return jsonify({'error': 'Metrics are not enabled'}), 404
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render_text(), content_type=metrics.CONTENT_TYPE)
+
+# Helper function to check the profiler admin token; None when the request may proceed
+def profile_admin_error():
+    if not os.environ.get('PROFILE_TOKEN'):
+        return jsonify({'error': 'Profiling is not enabled'}), 404
+    authorization = request.headers.get('Authorization', '')
+    if not authorization.startswith('Bearer ') or not token_matches(authorization[7:]):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+# Recent request profiles, newest first
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_request_profiles():
+    error = profile_admin_error()
+    if error:
+        return error
+    return jsonify({'profiles': list_profiles()})
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def download_request_profile(name):
+    error = profile_admin_error()
+    if error:
+        return error
+    path = profile_path(name)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    mimetype = 'text/plain' if name.endswith('.collapsed') else 'application/octet-stream'
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=name)
+
 # Add error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -1916,12 +2108,13 @@ def internal_error(error):
 @app.errorhandler(Exception)
 def handle_exception(e):
     """Handle all unhandled exceptions"""
-    print(f"Unhandled exception: {str(e)}")
-    traceback.print_exc()
+    log.error(f"Unhandled exception: {str(e)}", exc_info=True)
     return jsonify({'error': 'Internal server error'}), 500
 
 # Set environment variables for Vercel deployment
 if os.environ.get('VERCEL_ENV'):
-    print(f"Running in Vercel environment: {os.environ.get('VERCEL_ENV')}")
+    log.info(f"Running in Vercel environment: {os.environ.get('VERCEL_ENV')}")
     # Disable debug mode in production
-    app.debug = False
\ No newline at end of file
+    app.debug = False
+
+record_startup_phase('app_import', time.perf_counter() - _app_import_started)
@@ -0,0 +1,723 @@
+"""ASGI entry point with native async handlers for the provider-calling routes
+
+/api/chat, /api/image-gen and /api/edge-tts run as coroutines on the server's event
+loop with a shared aiohttp connection pool, so a single process can hold hundreds of
+slow upstream calls at once. Every other route (pages, static files, status
+endpoints) is served by the existing Flask app through an ASGI adapter.
+
+Run with:
+    uvicorn api.asgi:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import base64
+import json
+import time
+import urllib.parse
+
+import aiohttp
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+
+try:
+    from . import app as flask_module
+    from .services.async_http import get_client_session, close_client_session
+    from .services.streaming import (wants_stream, parse_openai_stream_line, parse_cohere_stream_line,
+                                     iter_stream_events_async, relay_chat_stream_async)
+    from .services.hedging import run_hedged_async, hedging_enabled, get_hedge_delay, get_hedge_fanout
+    from .services.circuit_breaker import get_breaker, classify_error, CircuitOpenError, SUCCESS
+    from .services.retry_policy import get_retry_policy, DeadlineExceeded, RETRYABLE_STATUS_CODES
+    from .services.json_codec import RawJSONString, dumps_bytes, loads, splice_json
+    from .services.chat_messages import ChatMessages
+    from .services.app_log import get_logger, log_payload
+    from .services.voice_catalog import get_voice_catalog
+    from .services.audio_cache import get_audio_cache, audio_cache_key, prosody_options
+    from .services.tracing import start_trace, end_trace, current_trace, log_if_slow
+except ImportError:
+    import app as flask_module
+    from services.async_http import get_client_session, close_client_session
+    from services.streaming import (wants_stream, parse_openai_stream_line, parse_cohere_stream_line,
+                                    iter_stream_events_async, relay_chat_stream_async)
+    from services.hedging import run_hedged_async, hedging_enabled, get_hedge_delay, get_hedge_fanout
+    from services.circuit_breaker import get_breaker, classify_error, CircuitOpenError, SUCCESS
+    from services.retry_policy import get_retry_policy, DeadlineExceeded, RETRYABLE_STATUS_CODES
+    from services.json_codec import RawJSONString, dumps_bytes, loads, splice_json
+    from services.chat_messages import ChatMessages
+    from services.app_log import get_logger, log_payload
+    from services.voice_catalog import get_voice_catalog
+    from services.audio_cache import get_audio_cache, audio_cache_key, prosody_options
+    from services.tracing import start_trace, end_trace, current_trace, log_if_slow
+
+flask_asgi = WsgiToAsgi(flask_module.app)
+
+# The same diagnostic categories as the Flask routes
+log = get_logger('app')
+auth_log = get_logger('auth')
+chat_log = get_logger('chat')
+groq_log = get_logger('groq')
+together_log = get_logger('together')
+cohere_log = get_logger('cohere')
+openrouter_log = get_logger('openrouter')
+tts_log = get_logger('tts')
+
+OPENROUTER_CHAT_URL = flask_module.OPENROUTER_CHAT_URL
+GROQ_CHAT_URL = flask_module.GROQ_CHAT_URL
+TOGETHER_CHAT_URL = flask_module.TOGETHER_CHAT_URL
+COHERE_CHAT_URL = flask_module.COHERE_CHAT_URL
+
+
+class AsyncRequest:
+    """Minimal request object exposing the headers the shared helpers in app.py look at"""
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope.get('headers', [])])
+        # Per-request state that the Flask routes keep on flask.g
+        self.reply_hooks = []
+        self.response_headers = []
+        self.metrics = None
+        self.response_started = False
+
+    def start_metrics(self, endpoint, provider):
+        """Like start_request_metrics in app.py; the request is counted when the response starts"""
+        self.metrics = [endpoint, provider, time.perf_counter()]
+
+    def set_metrics_provider(self, provider):
+        if self.metrics is not None:
+            self.metrics[1] = provider
+
+
+async def read_json(receive):
+    """Read the full request body and decode it as JSON (None if empty or invalid)"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    if not body:
+        return None
+    try:
+        return loads(body)
+    except json.JSONDecodeError:
+        return None
+
+
+def cors_headers(request_obj):
+    """Mirror the Flask-CORS configuration (any origin, credentials allowed)"""
+    origin = request_obj.headers.get('Origin')
+    if not origin:
+        return []
+    return [
+        (b'access-control-allow-origin', origin.encode('latin-1')),
+        (b'access-control-allow-credentials', b'true'),
+        (b'vary', b'Origin'),
+    ]
+
+
+async def start_response(send, request_obj, status, headers):
+    """Send the response start with the Server-Timing header and count the request, like the Flask after_request hooks"""
+    trace = current_trace()
+    if trace.enabled:
+        headers = headers + [(b'server-timing', trace.server_timing().encode('latin-1', 'replace'))]
+        log_if_slow(trace, method=request_obj.scope['method'], path=request_obj.scope['path'], status=status)
+    if request_obj.metrics is not None:
+        flask_module.observe_request(*request_obj.metrics, status)
+    request_obj.response_started = True
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+
+
+async def send_json(send, request_obj, payload, status=200):
+    """Send a JSON response; payload may also be an already-encoded body"""
+    body = payload if isinstance(payload, bytes) else dumps_bytes(payload)
+    await start_response(send, request_obj, status,
+                         [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                         + cors_headers(request_obj) + (request_obj.response_headers if status == 200 else []))
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_event_stream(send, request_obj, chunks):
+    """Send an async iterator of SSE text chunks as a streamed response"""
+    await start_response(send, request_obj, 200, [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no'),
+    ] + cors_headers(request_obj) + request_obj.response_headers)
+    async for chunk in chunks:
+        await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def response_error(response, message):
+    """Build a ClientResponseError for a non-2xx upstream response"""
+    return aiohttp.ClientResponseError(response.request_info, response.history, status=response.status, message=message)
+
+
+async def post_with_retries(provider, url, headers, data, deadline=None, raise_for_status=True):
+    """Async counterpart of request_with_retries: same per-provider policy and request deadline
+
+    With raise_for_status=False the last error response is returned instead of raised.
+    """
+    session = get_client_session()
+    policy = get_retry_policy(provider)
+    deadline = deadline or policy.new_deadline()
+    last_error = None
+
+    for attempt in range(policy.max_attempts):
+        try:
+            attempt_timeout = policy.attempt_timeout_for(deadline)
+        except DeadlineExceeded:
+            if last_error:
+                raise last_error
+            raise
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=min(15, attempt_timeout), sock_read=attempt_timeout)
+        attempt_started = time.perf_counter()
+        try:
+            response = await session.post(url, headers=headers, data=data, timeout=timeout)
+        except asyncio.TimeoutError as timeout_error:
+            flask_module.record_upstream_attempt(provider, 'timeout', attempt_started)
+            last_error = timeout_error
+            delay = policy.retry_delay(attempt)
+            reason = "Request timed out"
+            retry_reason = 'timeout'
+            if not policy.can_retry(attempt, delay, deadline):
+                break
+        except aiohttp.ClientError:
+            flask_module.record_upstream_attempt(provider, 'error')
+            raise
+        else:
+            flask_module.record_upstream_attempt(provider, response.status, attempt_started)
+            if response.status not in RETRYABLE_STATUS_CODES:
+                if response.status >= 400 and raise_for_status:
+                    body = await response.text()
+                    response.release()
+                    # Don't retry client errors (4xx) except for 429
+                    raise response_error(response, body)
+                return response
+
+            delay = policy.retry_delay(attempt, response.headers)
+            reason = "Rate limit exceeded" if response.status == 429 else f"Server error {response.status}"
+            retry_reason = 'rate_limited' if response.status == 429 else 'server_error'
+            if not policy.can_retry(attempt, delay, deadline) and not raise_for_status:
+                return response
+            body = await response.text()
+            response.release()
+            last_error = response_error(response, body)
+            if not policy.can_retry(attempt, delay, deadline):
+                break
+
+        flask_module.UPSTREAM_RETRIES.labels(provider, retry_reason).inc()
+        get_logger(provider).warning(f"{reason} (attempt {attempt + 1}/{policy.max_attempts}). Waiting {delay:.1f}s before retry "
+                                     f"({deadline.remaining():.0f}s of the request budget left)...")
+        await asyncio.sleep(delay)
+
+    get_logger(provider).error(f"Giving up after {attempt + 1} attempt(s). Last error: {str(last_error)}")
+    raise last_error
+
+
+async def peek_first_delta(events):
+    """Consume events up to the first text delta; returns the consumed events (None if the stream was empty)"""
+    first_events = []
+    async for event in events:
+        first_events.append(event)
+        if event[0] == 'delta':
+            return first_events
+    return None
+
+
+async def chain_events(first_events, events):
+    for event in first_events:
+        yield event
+    async for event in events:
+        yield event
+
+
+async def request_openrouter_model_async(model, messages, deep_thinking_mode, selected_model_info, headers, stream_mode=False, deadline=None):
+    """Async counterpart of request_openrouter_model"""
+    request_data = flask_module.build_openrouter_request_data(model, messages, deep_thinking_mode, selected_model_info, stream_mode)
+    openrouter_log.info(f"Sending request to model {model}")
+    log_payload(openrouter_log, "Request payload", request_data)
+    response = await post_with_retries('openrouter', OPENROUTER_CHAT_URL, headers, request_data, deadline)
+
+    try:
+        if stream_mode:
+            # Wait for the first token before committing to this model
+            events = iter_stream_events_async(response, parse_openai_stream_line)
+            with current_trace().span('first_token', model):
+                first_events = await peek_first_delta(events)
+            if not first_events:
+                openrouter_log.warning(f"Empty streamed response from model: {model}")
+                response.release()
+                raise flask_module.EmptyModelResponse(f"Empty streamed response from model: {model}")
+            return None, chain_events(first_events, events), response
+
+        body = await response.read()
+        response.release()
+    except asyncio.CancelledError:
+        # Lost a hedged race
+        response.release()
+        raise
+
+    assistant_message = flask_module.completion_message(body)
+    if not assistant_message:
+        openrouter_log.warning(f"Empty response from model: {model}")
+        raise flask_module.EmptyModelResponse(f"Empty response from model: {model}")
+    return assistant_message, None, response
+
+
+async def call_openrouter_model_async(model, *args, ignore_breaker=False, **kwargs):
+    """Async counterpart of call_openrouter_model: the same circuit breakers and attempt metrics cover both paths"""
+    started = time.perf_counter()
+    breaker = get_breaker(model)
+    if not breaker.allow_request() and not ignore_breaker:
+        flask_module.record_model_attempt(model, 'circuit_open', started)
+        raise CircuitOpenError(f"Circuit breaker open for model {model}")
+    try:
+        result = await request_openrouter_model_async(model, *args, **kwargs)
+    except (asyncio.CancelledError, DeadlineExceeded) as e:
+        breaker.release()
+        flask_module.record_model_attempt(model, 'deadline' if isinstance(e, DeadlineExceeded) else 'cancelled', started)
+        raise
+    except Exception as e:
+        outcome = classify_error(e)
+        breaker.record(outcome)
+        flask_module.record_model_attempt(model, 'empty' if isinstance(e, flask_module.EmptyModelResponse) else outcome, started)
+        raise
+    breaker.record(SUCCESS)
+    flask_module.record_model_attempt(model, SUCCESS, started)
+    return result
+
+
+async def send_chat_reply(send, request_obj, assistant_message, metadata):
+    """Run the reply hooks and send a non-streamed chat reply; passthrough content is spliced in as-is"""
+    if request_obj.reply_hooks:
+        await asyncio.to_thread(flask_module.run_reply_hooks, request_obj.reply_hooks, dict(metadata, response=str(assistant_message)))
+    if isinstance(assistant_message, RawJSONString):
+        await send_json(send, request_obj, splice_json({'response': assistant_message}, metadata))
+    else:
+        await send_json(send, request_obj, dict(metadata, response=assistant_message))
+
+
+def reply_callback(request_obj, metadata):
+    """Return an on_complete callback that passes a finished stream to the reply hooks
+
+    relay_chat_stream_async runs it in a worker thread, so the hooks may block.
+    """
+    if not request_obj.reply_hooks:
+        return None
+
+    def on_complete(text):
+        if text:
+            reply = dict(metadata)
+            reply['response'] = text
+            flask_module.run_reply_hooks(request_obj.reply_hooks, reply)
+    return on_complete
+
+
+async def relay_provider_response(send, request_obj, response, parse_line, stream_mode, metadata, extract_message, provider_name, logger):
+    """Send a Groq/Together/Cohere response to the client as JSON or as an SSE stream"""
+    if response.status != 200:
+        body = await response.read()
+        response.release()
+        logger.error(f"Error response status: {response.status}")
+        log_payload(logger, "Error response body", body)
+        await send_json(send, request_obj, {'error': f'{provider_name} API returned error status: {response.status}'}, response.status)
+        return
+
+    if stream_mode:
+        logger.debug("Relaying streamed response")
+        events = iter_stream_events_async(response, parse_line)
+        await send_event_stream(send, request_obj, relay_chat_stream_async(events, metadata, response, reply_callback(request_obj, metadata)))
+        return
+
+    body = await response.read()
+    response.release()
+    assistant_message = extract_message(body)
+    if not assistant_message:
+        await send_json(send, request_obj, {'error': f'Empty response from {provider_name} API'}, 500)
+        return
+    await send_chat_reply(send, request_obj, assistant_message, metadata)
+
+
+def cohere_message(body):
+    return loads(body).get('text', '')
+
+
+async def chat_handler(request_obj, receive, send):
+    request_obj.start_metrics('chat', 'none')
+    trace = current_trace()
+    data = await read_json(receive) or {}
+
+    # No Flask session here, so verify the token on every request (off the event loop)
+    phase_started = time.perf_counter()
+    decoded_token = await asyncio.to_thread(flask_module.verify_firebase_token, request_obj)
+    trace.mark('auth', phase_started)
+    if not decoded_token:
+        # Mirrors the temporary authentication bypass in the sync chat() route
+        auth_log.warning("Bypassing authentication for testing.")
+        decoded_token = {"uid": "test-user-id"}
+    user_id = decoded_token.get('uid')
+    auth_log.debug(f"Authenticated user: {user_id}")
+
+    user_input = data.get('message', '')
+    phase_started = time.perf_counter()
+    # The conversation store and the response caches may sit behind Redis or a file lock
+    chat_history, conversation = await asyncio.to_thread(flask_module.resolve_conversation, data, user_id, user_input)
+    if chat_history is None:
+        await send_json(send, request_obj, {
+            'error': 'Conversation not found or out of date. Please resend the full chat history.',
+            'rehydrate': True,
+            'conversation_id': conversation['id']
+        }, 409)
+        return
+    deep_thinking_mode = data.get('deepThinkingMode', False)
+    stream_mode = wants_stream(request_obj, data)
+    messages = ChatMessages.from_history(chat_history, user_input)
+    trace.mark('history', phase_started, f"{len(messages)} messages")
+
+    selected_model_key = flask_module.resolve_model_key(data.get('model', flask_module.DEFAULT_MODEL))
+    selected_model_info = flask_module.MODEL_OPTIONS[selected_model_key]
+    selected_model = selected_model_info['id']
+    provider = selected_model_info.get('provider', 'openrouter')
+    request_obj.set_metrics_provider(provider)
+    metadata = {
+        'model_used': selected_model,
+        'model_key': selected_model_key,
+        'model_display_name': selected_model_info['display_name']
+    }
+
+    request_obj.response_headers = [
+        (b'x-conversation-id', conversation['id'].encode('latin-1')),
+        (b'x-conversation-length', str(conversation['length'] + 1).encode()),
+    ]
+    request_obj.reply_hooks.append(lambda reply: flask_module.save_conversation_turn(conversation, user_id, reply))
+
+    # Serve repeated prompts from the response caches
+    with trace.span('cache'):
+        cached_reply, cache_keys = await asyncio.to_thread(
+            flask_module.lookup_cached_chat_reply, selected_model_key, selected_model_info, deep_thinking_mode, chat_history, user_input
+        )
+    if cached_reply:
+        request_obj.set_metrics_provider('cache')
+        if stream_mode:
+            async def cached_events():
+                yield ('delta', cached_reply['response'])
+            cached_metadata = {k: v for k, v in cached_reply.items() if k != 'response'}
+            await send_event_stream(send, request_obj, relay_chat_stream_async(cached_events(), cached_metadata, on_complete=reply_callback(request_obj, cached_metadata)))
+        else:
+            await asyncio.to_thread(flask_module.run_reply_hooks, request_obj.reply_hooks, cached_reply)
+            await send_json(send, request_obj, cached_reply)
+        return
+    if cache_keys:
+        request_obj.reply_hooks.append(lambda reply: flask_module.save_chat_reply(reply, cache_keys))
+
+    if provider == 'groq':
+        if not flask_module.GROQ_API_KEY:
+            await send_json(send, request_obj, {'error': 'Groq API key not configured. Please set GROQ_API_KEY environment variable.'}, 500)
+            return
+        groq_data = flask_module.build_groq_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode)
+        headers = {"Authorization": f"Bearer {flask_module.GROQ_API_KEY}", "Content-Type": "application/json"}
+        try:
+            response = await post_with_retries('groq', GROQ_CHAT_URL, headers, groq_data, raise_for_status=False)
+        except asyncio.TimeoutError:
+            await send_json(send, request_obj, {'error': 'Groq API request timed out. Please try again.'}, 504)
+            return
+        except aiohttp.ClientConnectionError:
+            await send_json(send, request_obj, {'error': 'Could not connect to Groq API. Please check your network connection.'}, 503)
+            return
+        await relay_provider_response(send, request_obj, response, parse_openai_stream_line, stream_mode, metadata, flask_module.completion_message, 'Groq', groq_log)
+        return
+
+    if provider == 'together':
+        together_data = flask_module.build_together_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode)
+        headers = {"Authorization": f"Bearer {flask_module.TOGETHER_API_KEY}", "Content-Type": "application/json"}
+        try:
+            response = await post_with_retries('together', TOGETHER_CHAT_URL, headers, together_data, raise_for_status=False)
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            await send_json(send, request_obj, {'error': f'Together AI error: {str(e)}'}, 500)
+            return
+        await relay_provider_response(send, request_obj, response, parse_openai_stream_line, stream_mode, metadata, flask_module.completion_message, 'Together AI', together_log)
+        return
+
+    if provider == 'cohere':
+        cohere_data = flask_module.build_cohere_request_data(messages, deep_thinking_mode, selected_model_info, stream_mode)
+        headers = {"Authorization": f"Bearer {flask_module.COHERE_API_KEY}", "Content-Type": "application/json"}
+        try:
+            response = await post_with_retries('cohere', COHERE_CHAT_URL, headers, cohere_data, raise_for_status=False)
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            await send_json(send, request_obj, {'error': f'Cohere API error: {str(e)}'}, 500)
+            return
+        await relay_provider_response(send, request_obj, response, parse_cohere_stream_line, stream_mode, metadata,
+                                      cohere_message, 'Cohere', cohere_log)
+        return
+
+    # OpenRouter: selected model first, then the others as fallbacks, skipping open breakers
+    prioritized_models = [selected_model] + [m for m in flask_module.AVAILABLE_MODELS if m != selected_model]
+    healthy_models = [m for m in prioritized_models if get_breaker(m).is_available()]
+    ignore_breakers = not healthy_models
+    if not ignore_breakers:
+        prioritized_models = healthy_models
+    openrouter_headers = flask_module.get_openrouter_headers(request_obj)
+    # One time budget for every retry and fallback model of this request
+    deadline = get_retry_policy('openrouter').new_deadline()
+
+    async def attempt(model):
+        return await call_openrouter_model_async(model, messages, deep_thinking_mode, selected_model_info,
+                                                 openrouter_headers, stream_mode, deadline, ignore_breaker=ignore_breakers)
+
+    winner = None
+    last_error = None
+    if hedging_enabled(selected_model_info):
+        try:
+            winner = await run_hedged_async(
+                prioritized_models,
+                attempt,
+                lambda model: get_hedge_delay(flask_module.MODEL_INFO_BY_ID.get(model)),
+                get_hedge_fanout(selected_model_info),
+                on_discard=lambda result: result[2].release()
+            )
+        except Exception as e:
+            last_error = e
+    else:
+        for model in prioritized_models:
+            try:
+                openrouter_log.info(f"Trying model: {model}")
+                winner = (model, await attempt(model))
+                break
+            except (flask_module.EmptyModelResponse, CircuitOpenError):
+                continue
+            except DeadlineExceeded as deadline_error:
+                openrouter_log.warning(f"Request budget exhausted before model {model}, not trying further models")
+                last_error = last_error or deadline_error
+                break
+            except Exception as e:
+                openrouter_log.error(f"Error with model {model}: {str(e)}")
+                last_error = e
+
+    if winner:
+        model, (assistant_message, events, response) = winner
+        if model != selected_model:
+            flask_module.CHAT_FALLBACKS.labels(selected_model).inc()
+        model_info = flask_module.MODEL_INFO_BY_ID.get(model)
+        metadata = {
+            'model_used': model,
+            'model_key': flask_module.MODEL_KEY_BY_ID.get(model),
+            'model_display_name': model_info['display_name'] if model_info else 'Unknown Model'
+        }
+        if stream_mode:
+            await send_event_stream(send, request_obj, relay_chat_stream_async(events, metadata, response, reply_callback(request_obj, metadata)))
+            return
+        await send_chat_reply(send, request_obj, assistant_message, metadata)
+        return
+
+    # All models failed
+    if isinstance(last_error, (asyncio.TimeoutError, DeadlineExceeded)):
+        await send_json(send, request_obj, {'error': 'All model requests timed out. Please try again later.'}, 504)
+    elif isinstance(last_error, aiohttp.ClientResponseError) and last_error.status == 429:
+        await send_json(send, request_obj, {'error': 'Rate limit exceeded for all models. Please try again later.'}, 429)
+    else:
+        chat_log.error(f"All models failed: {str(last_error)}")
+        await send_json(send, request_obj, {'error': f'All models failed: {str(last_error)}'}, 500)
+
+
+async def image_gen_handler(request_obj, receive, send):
+    """Async counterpart of image_gen_api"""
+    data = await read_json(receive) or {}
+    prompt = data.get('prompt')
+    model = data.get('model', 'stabilityai/stable-diffusion-xl-base-1.0')
+    aspect = data.get('aspect', '1:1')
+    count = min(max(int(data.get('count', 1)), 1), 4)
+    request_obj.start_metrics('image', model if model in ('pollinations', 'replicate-sdxl', 'stability-sdxl') else 'huggingface')
+    trace = current_trace()
+    env = flask_module.os.environ
+    session = get_client_session()
+    timeout = aiohttp.ClientTimeout(total=180)
+
+    try:
+        if model == 'pollinations':
+            url = f'https://image.pollinations.ai/prompt/{urllib.parse.quote(prompt)}'
+            await send_json(send, request_obj, {"images": [url]})
+        elif model == 'replicate-sdxl':
+            headers = {"Authorization": f"Token {env.get('REPLICATE_API_TOKEN', '')}", "Content-Type": "application/json"}
+            version = "a9758cb8e24c4b1e8c3c7c3e8e7e3e8e7e3e8e7e3e8e7e3e8e7e3e8e7e3e8e7"  # Same version as the sync route
+            payload = {"version": version, "input": {"prompt": prompt, "num_outputs": count}}
+            with trace.span('upstream', 'replicate'):
+                response = await session.post("https://api.replicate.com/v1/predictions", headers=headers, json=payload, timeout=timeout)
+            async with response:
+                if response.status != 201:
+                    await send_json(send, request_obj, {"error": await response.text()}, response.status)
+                    return
+                prediction = await response.json(content_type=None)
+            prediction_url = prediction["urls"]["get"]
+            poll_started = time.perf_counter()
+            poll_result = ({"error": "Replicate prediction timed out."}, 504)
+            for _ in range(90):
+                async with session.get(prediction_url, headers=headers, timeout=timeout) as poll:
+                    poll_data = await poll.json(content_type=None)
+                if poll_data["status"] == "succeeded" and poll_data.get("output"):
+                    poll_result = ({"images": poll_data["output"]}, 200)
+                    break
+                elif poll_data["status"] == "failed":
+                    poll_result = ({"error": "Replicate prediction failed."}, 500)
+                    break
+                await asyncio.sleep(2)  # Polling no longer pins a worker thread
+            flask_module.IMAGE_POLL_SECONDS.labels('replicate').observe(time.perf_counter() - poll_started)
+            trace.mark('poll', poll_started, 'replicate')
+            await send_json(send, request_obj, *poll_result)
+        elif model == 'stability-sdxl':
+            width, height = 1024, 1024
+            if aspect == '2:3': width, height = 768, 1152
+            elif aspect == '3:2': width, height = 1152, 768
+            elif aspect == '16:9': width, height = 1280, 720
+            headers = {"Authorization": f"Bearer {env.get('STABILITY_API_KEY', '')}", "Accept": "application/json"}
+            form = aiohttp.FormData()
+            for name, value in (('prompt', prompt), ('output_format', 'png'), ('samples', str(count)),
+                                ('width', str(width)), ('height', str(height))):
+                form.add_field(name, value)
+            with trace.span('upstream', 'stability'):
+                response = await session.post("https://api.stability.ai/v2beta/stable-image/generate/sd3", headers=headers, data=form, timeout=timeout)
+            async with response:
+                if response.status != 200:
+                    await send_json(send, request_obj, {"error": await response.text()}, response.status)
+                    return
+                result = await response.json(content_type=None)
+            image_urls = []
+            imgur_headers = {"Authorization": f"Client-ID {env.get('IMGUR_CLIENT_ID')}"}
+            for artifact in result.get("artifacts", []):
+                if "base64" in artifact:
+                    imgur_data = {"image": artifact["base64"], "type": "base64"}
+                    with trace.span('upload', 'imgur'):
+                        imgur_resp = await session.post("https://api.imgur.com/3/image", headers=imgur_headers, data=imgur_data, timeout=timeout)
+                    async with imgur_resp:
+                        if imgur_resp.status != 200:
+                            await send_json(send, request_obj, {"error": "Failed to upload to Imgur: " + await imgur_resp.text()}, 500)
+                            return
+                        image_urls.append((await imgur_resp.json(content_type=None))["data"]["link"])
+            if image_urls:
+                await send_json(send, request_obj, {"images": image_urls})
+            else:
+                await send_json(send, request_obj, {"error": "No images returned from Stability API."}, 500)
+        else:
+            hf_url = f'https://api-inference.huggingface.co/models/{model}'
+            headers = {'Authorization': f"Bearer {env.get('HF_API_KEY', '')}", 'Content-Type': 'application/json'}
+            payload = {"inputs": prompt, "parameters": {"num_images": count, "aspect_ratio": aspect}}
+            with trace.span('upstream', 'huggingface'):
+                response = await session.post(hf_url, headers=headers, json=payload, timeout=timeout)
+            async with response:
+                if response.status != 200:
+                    await send_json(send, request_obj, {"error": await response.text()}, response.status)
+                    return
+                result = await response.json(content_type=None)
+            if isinstance(result, list) and result and 'url' in result[0]:
+                image_urls = [img['url'] for img in result if 'url' in img]
+            elif isinstance(result, dict) and 'url' in result:
+                image_urls = [result['url']]
+            else:
+                await send_json(send, request_obj, {"raw": result})
+                return
+            await send_json(send, request_obj, {"images": image_urls})
+    except asyncio.TimeoutError:
+        await send_json(send, request_obj, {"error": "Bad Gateway: The image generation model timed out. Please try again or use a different model."}, 504)
+    except Exception as e:
+        await send_json(send, request_obj, {"error": str(e)}, 500)
+
+
+async def edge_tts_handler(request_obj, receive, send):
+    """Async counterpart of edge_tts_api: synthesis runs directly on the server's event loop"""
+    request_obj.start_metrics('tts', 'edge-tts')
+    if not flask_module.edge_tts_available():
+        await send_json(send, request_obj, {'error': 'Text-to-speech service is not available'}, 503)
+        return
+
+    data = await read_json(receive) or {}
+    text = data.get('text')
+    requested_voice = data.get('voice')
+    if not text or not requested_voice:
+        await send_json(send, request_obj, {'error': 'Missing text or voice parameter'}, 400)
+        return
+
+    # Handle the case where Sara voice is requested (known to be unavailable)
+    if requested_voice == 'en-US-SaraNeural':
+        requested_voice = 'en-US-AvaNeural'
+
+    try:
+        trace = current_trace()
+        # The catalog may fetch the voice list and the cache may read from disk, so both run off the event loop
+        with trace.span('voices'):
+            voice_used = await asyncio.to_thread(get_voice_catalog().resolve, requested_voice)
+        options = prosody_options(data)
+        cache_key = audio_cache_key(voice_used, text, options)
+        with trace.span('cache'):
+            audio_bytes = await asyncio.to_thread(get_audio_cache().get, cache_key)
+        if audio_bytes is not None:
+            request_obj.set_metrics_provider('cache')
+        else:
+            synthesis_started = time.perf_counter()
+            try:
+                audio_bytes = await flask_module.synthesize_speech(text, voice_used, options)
+            except Exception:
+                flask_module.TTS_SYNTHESIS_SECONDS.labels('error').observe(time.perf_counter() - synthesis_started)
+                raise
+            flask_module.TTS_SYNTHESIS_SECONDS.labels(SUCCESS).observe(time.perf_counter() - synthesis_started)
+            trace.mark('synthesis', synthesis_started, voice_used)
+            await asyncio.to_thread(get_audio_cache().put, cache_key, audio_bytes)
+    except Exception as e:
+        tts_log.error(f'Edge TTS error: {str(e)}')
+        await send_json(send, request_obj, {'error': str(e)}, 500)
+        return
+
+    await send_json(send, request_obj, {
+        'audio': base64.b64encode(audio_bytes).decode('utf-8'),
+        'voice_used': voice_used,
+        'requested_voice': requested_voice
+    })
+
+
+ASYNC_ROUTES = {
+    ('POST', '/api/chat'): chat_handler,
+    ('POST', '/api/image-gen'): image_gen_handler,
+    ('POST', '/api/edge-tts'): edge_tts_handler,
+}
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_client_session()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application: async handlers for provider routes, Flask for everything else"""
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http':
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if handler is not None:
+            started = time.time()
+            request_obj = AsyncRequest(scope)
+            # Every request gets a phase trace, reported in the Server-Timing header like the Flask routes
+            _, trace_token = start_trace()
+            try:
+                await handler(request_obj, receive, send)
+            except Exception as e:
+                log.error(f"Unhandled exception in async handler {scope['path']}: {str(e)}", exc_info=True)
+                if not request_obj.response_started:
+                    await send_json(send, request_obj, {'error': 'Internal server error'}, 500)
+                else:
+                    # Too late for an error status; end the body so the client is not left waiting
+                    try:
+                        await send({'type': 'http.response.body', 'body': b''})
+                    except Exception as close_error:
+                        log.debug(f"Could not close the response of {scope['path']}: {str(close_error)}")
+            finally:
+                end_trace(trace_token)
+            log.debug(f"{scope['method']} {scope['path']} finished in {time.time() - started:.2f}s")
+            return
+
+    await flask_asgi(scope, receive, send)
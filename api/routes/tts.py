@@ -1,10 +1,24 @@
 import asyncio
 import os
-import edge_tts
 import base64
-import traceback
+import tempfile
 from flask import Blueprint, request, jsonify, Response
 
+try:
+    from ..services.app_log import get_logger, log_payload
+    from ..services.voice_catalog import get_voice_catalog
+    from ..services.audio_cache import get_audio_cache, audio_cache_key, prosody_options
+    from ..services.speech_stream import wants_audio_stream, speech_chunks, open_speech_stream, iter_cached_audio
+    from ..services.background_loop import get_background_loop
+except ImportError:
+    from services.app_log import get_logger, log_payload
+    from services.voice_catalog import get_voice_catalog
+    from services.audio_cache import get_audio_cache, audio_cache_key, prosody_options
+    from services.speech_stream import wants_audio_stream, speech_chunks, open_speech_stream, iter_cached_audio
+    from services.background_loop import get_background_loop
+
+log = get_logger('tts')
+
 tts_bp = Blueprint('tts', __name__)
 
 # Define available voices
@@ -27,48 +41,53 @@ VOICES = {
     ]
 }
 
+# Cleanup tasks still waiting to delete their file; the loop only keeps weak references to tasks
+_cleanup_tasks = set()
+
 # Helper function to run async code
-def run_async(coro):
+def run_async(coro, timeout=None):
+    """Run a coroutine on the worker's long-lived event loop and return its result"""
+    return get_background_loop().run(coro, timeout)
+
+# Helper function to get the temporary file for one piece of speech
+def speech_file_path(cache_key):
+    """Files are named by the audio cache key, a stable digest of the voice, options and text"""
+    # Use /tmp directory for Vercel serverless functions
+    # This is the recommended location for temporary files in serverless environments
+    tmp_dir = '/tmp' if os.path.exists('/tmp') else os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'temp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, f'speech_{cache_key}.mp3')
+
+# Helper function to write a speech file without ever exposing a partly written one
+def write_speech_file(path, audio):
+    """Concurrent identical requests share the file name, so each writes a unique temporary file and renames it into place"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.speech_', suffix='.tmp')
     try:
-        # Use asyncio.run() which is the recommended way to run async code
-        # It automatically creates a new event loop and closes it at the end
-        return asyncio.run(coro)
-    except RuntimeError as e:
-        # Handle case where event loop is already running
-        if "There is no current event loop in thread" in str(e):
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                return loop.run_until_complete(coro)
-            finally:
-                loop.close()
-        else:
-            print(f"RuntimeError in run_async: {str(e)}")
-            raise e
+        with os.fdopen(fd, 'wb') as f:
+            f.write(audio)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
 
 # Async function to generate speech
-async def generate_speech(text, voice_id):
-    print(f"Starting speech generation with voice: {voice_id}")
+async def generate_speech(text, voice_id, options=None, cache_key=None):
+    """Synthesize the speech and save it; returns (file path, MP3 bytes)"""
+    log.debug(f"Starting speech generation with voice: {voice_id}")
     try:
         # Create a temporary file to store the audio
-        # Use a unique identifier that includes voice_id to prevent conflicts
-        unique_id = f"{voice_id}_{hash(text)}"
-        
-        # Use /tmp directory for Vercel serverless functions
-        # This is the recommended location for temporary files in serverless environments
-        tmp_dir = '/tmp' if os.path.exists('/tmp') else os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'temp')
-        os.makedirs(tmp_dir, exist_ok=True)
-        
-        temp_file = os.path.join(tmp_dir, f'speech_{unique_id}.mp3')
+        temp_file = speech_file_path(cache_key or audio_cache_key(voice_id, text, options))
+        tmp_dir = os.path.dirname(temp_file)
         
-        print(f"Generating speech to file: {temp_file}")
+        log.debug(f"Generating speech to file: {temp_file}")
         
-        # Initialize TTS with the selected voice
-        communicate = edge_tts.Communicate(text, voice_id)
-        
-        # Save audio to file
-        await communicate.save(temp_file)
-        print(f"Successfully saved speech to: {temp_file}")
+        # Long texts are synthesized sentence-parallel, still in order
+        audio = b''.join([chunk async for chunk in speech_chunks(text, voice_id, options)])
+        write_speech_file(temp_file, audio)
+        log.debug(f"Successfully saved speech to: {temp_file}")
         
         # In serverless environments, we don't need to schedule deletion
         # as the /tmp directory is ephemeral and cleared between invocations
@@ -79,20 +98,38 @@ async def generate_speech(text, voice_id):
                 try:
                     if os.path.exists(temp_file):
                         os.remove(temp_file)
-                        print(f"Deleted temporary speech file: {temp_file}")
+                        log.debug(f"Deleted temporary speech file: {temp_file}")
                 except Exception as e:
-                    print(f"Error deleting temporary file: {e}")
+                    log.warning(f"Error deleting temporary file: {e}")
             
-            # Start the deletion task without awaiting it
-            asyncio.create_task(delete_file_after_delay())
+            # Start the deletion task without awaiting it; the loop outlives the request
+            task = asyncio.create_task(delete_file_after_delay())
+            _cleanup_tasks.add(task)
+            task.add_done_callback(_cleanup_tasks.discard)
         
-        return temp_file
+        return temp_file, audio
     except Exception as e:
-        print(f"Error in generate_speech: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.error(f"Error in generate_speech: {str(e)}", exc_info=True)
         raise e
 
+# Helper function to answer with chunked audio/mpeg instead of a file round trip through /tmp
+def stream_audio(text, voice_id, options, cache_key, audio_data=None):
+    if audio_data is not None:
+        chunks = iter_cached_audio(audio_data)
+    else:
+        try:
+            chunks = open_speech_stream(text, voice_id, options,
+                                        on_complete=lambda audio: get_audio_cache().put(cache_key, audio),
+                                        on_error=lambda error: log.error(f"Speech stream failed midway: {str(error)}"))
+        except Exception as speech_error:
+            log.error(f"Error generating speech: {str(speech_error)}", exc_info=True)
+            return jsonify({'error': f'Error generating speech: {str(speech_error)}'}), 500
+    response = Response(chunks, mimetype='audio/mpeg')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    response.headers['X-Voice-Used'] = voice_id
+    return response
+
 @tts_bp.route('/api/tts/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint to verify the TTS service is running"""
@@ -105,74 +142,85 @@ def health_check():
 @tts_bp.route('/api/tts', methods=['POST'])
 def text_to_speech():
     try:
-        print("TTS endpoint called")
-        print(f"Python version: {os.sys.version}")
-        print(f"Environment: {'serverless' if os.path.exists('/tmp') else 'local'}")
+        log.debug("TTS endpoint called")
+        log.debug(f"Python version: {os.sys.version}")
+        log.debug(f"Environment: {'serverless' if os.path.exists('/tmp') else 'local'}")
         
         # Check if request has JSON data
         if not request.is_json:
-            print("Error: Request is not JSON")
+            log.warning("Request is not JSON")
             return jsonify({'error': 'Request must be JSON'}), 400
             
         data = request.json
-        print(f"Request data: {data}")
+        log_payload(log, "Request data", data)
         
         text = data.get('text', '')
         voice_id = data.get('voice', 'en-US-AvaNeural')  # Default voice
         
         if not text:
-            print("Error: No text provided")
+            log.warning("No text provided")
             return jsonify({'error': 'No text provided'}), 400
         
-        print(f"Processing TTS request for voice: {voice_id}")
-        print(f"Text to convert: {text[:50]}{'...' if len(text) > 50 else ''}")
+        voice_id = get_voice_catalog().resolve(voice_id)
+        log.info(f"Processing TTS request for voice: {voice_id}")
+        log.debug(f"Text to convert: {text[:50]}{'...' if len(text) > 50 else ''}")
+        
+        # Replayed messages and voice previews are served from the audio cache shared with /api/edge-tts
+        options = prosody_options(data)
+        cache_key = audio_cache_key(voice_id, text, options)
+        audio_data = get_audio_cache().get(cache_key)
+        
+        if wants_audio_stream(request, data):
+            return stream_audio(text, voice_id, options, cache_key, audio_data)
         
-        # Try a simpler approach for serverless environment
         try:
-            # Run the async function in a synchronous context
-            temp_file = run_async(generate_speech(text, voice_id))
-            print(f"Speech generated successfully, saved to: {temp_file}")
+            temp_file = speech_file_path(cache_key)
+            if audio_data is None:
+                # Run the async function in a synchronous context; the bytes are cached, not read back from the file
+                temp_file, audio_data = run_async(generate_speech(text, voice_id, options, cache_key))
+                log.debug(f"Speech generated successfully, saved to: {temp_file}")
+                get_audio_cache().put(cache_key, audio_data)
+            else:
+                log.debug(f"Serving {len(audio_data)} bytes from the audio cache")
+                if not temp_file.startswith('/tmp') and not os.path.exists(temp_file):
+                    # The local development URL below needs the file
+                    write_speech_file(temp_file, audio_data)
             
             # Check if we're using the /tmp directory (serverless environment)
-            if temp_file and temp_file.startswith('/tmp'):
+            if temp_file.startswith('/tmp'):
                 # In serverless environments, we need to serve the file directly
                 # We'll return the file content as base64 encoded data
-                try:
-                    print(f"Reading file from {temp_file}")
-                    with open(temp_file, 'rb') as f:
-                        audio_data = f.read()
-                        print(f"Read {len(audio_data)} bytes from file")
-                        audio_base64 = base64.b64encode(audio_data).decode('utf-8')
-                        print("Successfully encoded audio to base64")
-                        return jsonify({
-                            'audio_data': audio_base64,
-                            'content_type': 'audio/mpeg',
-                            'is_base64': True
-                        })
-                except Exception as file_error:
-                    print(f"Error reading audio file: {str(file_error)}")
-                    traceback.print_exc()
-                    return jsonify({'error': f'Error reading audio file: {str(file_error)}'}), 500
-            elif temp_file:
-                # For local development, return a URL to the static file
-                file_url = f'/static/temp/{os.path.basename(temp_file)}'
-                print(f"Returning file URL: {file_url}")
-                return jsonify({'audio_url': file_url})
-            else:
-                print("Error: Failed to generate speech file")
-                return jsonify({'error': 'Failed to generate speech'}), 500
+                audio_base64 = base64.b64encode(audio_data).decode('utf-8')
+                log.debug("Successfully encoded audio to base64")
+                return jsonify({
+                    'audio_data': audio_base64,
+                    'content_type': 'audio/mpeg',
+                    'is_base64': True
+                })
+            # For local development, return a URL to the static file
+            file_url = f'/static/temp/{os.path.basename(temp_file)}'
+            log.debug(f"Returning file URL: {file_url}")
+            return jsonify({'audio_url': file_url})
                 
         except Exception as speech_error:
-            print(f"Error generating speech: {str(speech_error)}")
-            traceback.print_exc()
+            log.error(f"Error generating speech: {str(speech_error)}", exc_info=True)
             return jsonify({'error': f'Error generating speech: {str(speech_error)}'}), 500
         
     except Exception as e:
-        print(f"Error in text_to_speech: {str(e)}")
-        traceback.print_exc()
+        log.error(f"Error in text_to_speech: {str(e)}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 @tts_bp.route('/api/tts/voices', methods=['GET'])
 def get_voices():
-    """Return the list of available voices"""
-    return jsonify(VOICES)
\ No newline at end of file
+    """Return the curated voices by gender, plus every edge-tts voice (optionally ?locale=en-GB)
+
+    Curated voices missing from the catalog are left out; if the catalog could not be
+    loaded, the curated lists are returned as they are.
+    """
+    catalog = get_voice_catalog()
+    names = {voice['ShortName'] for voice in catalog.voices()}
+    curated = {
+        gender: [name for name in voice_ids if name in names] if names else list(voice_ids)
+        for gender, voice_ids in VOICES.items()
+    }
+    return jsonify(dict(curated, voices=catalog.voices(request.args.get('locale'))))
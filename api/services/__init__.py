@@ -0,0 +1 @@
+"""Shared service helpers used by the Flask routes in app.py and routes/."""
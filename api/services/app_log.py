@@ -0,0 +1,233 @@
+"""Leveled, sampled and non-blocking application logging
+
+Diagnostics go through per-category loggers (get_logger('groq'), get_logger('auth'),
+...) under the 'milkyai' logger instead of print(). The calling thread only checks
+the level, applies the category's sampling rate and puts the record on a bounded
+queue; a background listener thread redacts credentials, truncates long records and
+writes them to stdout. When the queue is full, records are dropped and counted
+instead of blocking the request.
+
+Warnings and errors are never sampled. Provider payloads and request headers are
+only dumped at debug level (see log_payload), which is off by default.
+
+Configuration (environment variables, all optional):
+    LOG_LEVEL           default level: debug, info, warning or error (default info)
+    LOG_LEVELS          per-category levels, e.g. "groq=debug,auth=warning"
+    LOG_SAMPLE          per-category share of debug/info records to keep, e.g. "chat=0.1,openrouter=0.5"
+    LOG_MAX_CHARS       longer records are truncated (default 2000, 0 to disable)
+    LOG_QUEUE_SIZE      records buffered for the writer thread (default 10000)
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+
+try:
+    from .env import env_number
+except ImportError:
+    from services.env import env_number
+
+ROOT_LOGGER = 'milkyai'
+
+REDACTED = '[redacted]'
+SENSITIVE_HEADERS = {'authorization', 'cookie', 'set-cookie', 'x-api-key'}
+_REDACT_PATTERNS = [
+    (re.compile(r'(Bearer\s+)[A-Za-z0-9\-._~+/]+=*'), r'\1' + REDACTED),
+    (re.compile(r'\bsk-[A-Za-z0-9\-_]{8,}'), 'sk-' + REDACTED),
+    (re.compile(r'''(\b(?:authorization|api[_-]?key|id_?token|token|password|secret|cookie)['"]?\s*[:=]\s*['"]?)(?!Bearer\b)[^'",\s}]+''',
+                re.IGNORECASE), r'\1' + REDACTED),
+]
+
+_init_lock = threading.Lock()
+_listener = None
+_handler = None
+
+
+def _parse_level(value, default=logging.INFO):
+    level = logging.getLevelName(str(value).strip().upper())
+    return level if isinstance(level, int) else default
+
+
+def _parse_mapping(value):
+    """Parse "a=1,b=2" into {'a': '1', 'b': '2'}"""
+    mapping = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            key, _, setting = item.partition('=')
+            mapping[key.strip().lower()] = setting.strip()
+    return mapping
+
+
+def redact(text):
+    """Mask bearer tokens, API keys and credential fields in a log message"""
+    for pattern, replacement in _REDACT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def truncate(text, max_chars):
+    if max_chars and len(text) > max_chars:
+        return f"{text[:max_chars]}... [{len(text) - max_chars} more characters]"
+    return text
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a configured share of each category's debug and info records"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.category)
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records when the writer thread falls behind"""
+
+    def __init__(self, record_queue, rates):
+        super().__init__(record_queue)
+        self.sampler = SamplingFilter(rates)
+        self.addFilter(self.sampler)
+        self.dropped = 0
+
+    def handle(self, record):
+        record.category = record.name[len(ROOT_LOGGER) + 1:] or 'app'
+        return super().handle(record)
+
+    def prepare(self, record):
+        # Only freeze the message here; redaction and truncation run on the writer thread
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RedactingFormatter(logging.Formatter):
+    """Formats records as "LEVEL [category] message", redacted, with the message truncated
+
+    Tracebacks are appended after truncation so they are always complete.
+    """
+
+    def __init__(self, max_chars):
+        super().__init__('%(levelname)s [%(category)s] %(message)s')
+        self.max_chars = max_chars
+
+    def formatMessage(self, record):
+        return truncate(redact(super().formatMessage(record)), self.max_chars)
+
+    def format(self, record):
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return super().format(record)
+
+
+def init_logging():
+    """Configure the 'milkyai' logger and start the writer thread (idempotent)"""
+    global _listener, _handler
+    if _handler is not None:
+        return
+    with _init_lock:
+        if _handler is not None:
+            return
+        rates = {}
+        for category, rate in _parse_mapping(os.environ.get('LOG_SAMPLE')).items():
+            try:
+                rates[category] = min(1.0, max(0.0, float(rate)))
+            except ValueError:
+                pass
+        record_queue = queue.Queue(maxsize=max(1, env_number('LOG_QUEUE_SIZE', 10000, int)))
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(RedactingFormatter(max(0, env_number('LOG_MAX_CHARS', 2000, int))))
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(_parse_level(os.environ.get('LOG_LEVEL', 'info')))
+        root.propagate = False
+        handler = NonBlockingQueueHandler(record_queue, rates)
+        root.addHandler(handler)
+        for category, level in _parse_mapping(os.environ.get('LOG_LEVELS')).items():
+            logging.getLogger(f"{ROOT_LOGGER}.{category}").setLevel(_parse_level(level))
+
+        _listener = logging.handlers.QueueListener(record_queue, stream_handler)
+        _listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(_stop_listener)
+        _handler = handler
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def _restart_after_fork():
+    # The writer thread does not survive fork, so a worker forked from a preloading
+    # master gets a fresh queue (its lock may have been held mid-fork) and writer
+    global _listener, _init_lock
+    _init_lock = threading.Lock()
+    if _handler is None:
+        return
+    record_queue = queue.Queue(maxsize=_handler.queue.maxsize)
+    _handler.queue = record_queue
+    _listener = logging.handlers.QueueListener(record_queue, *_listener.handlers)
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_logger(category):
+    """Logger for one diagnostic category, e.g. get_logger('groq')"""
+    init_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{category.lower()}")
+
+
+def log_payload(logger, label, payload):
+    """Dump a request/response payload or a headers mapping at debug level
+
+    Nothing is decoded or formatted unless debug logging is enabled for the logger.
+    Credential headers are masked before the record is created.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode('utf-8', 'replace')
+    elif hasattr(payload, 'items'):
+        payload = {key: REDACTED if key.lower() in SENSITIVE_HEADERS else value for key, value in payload.items()}
+    logger.debug("%s: %s", label, payload)
+
+
+def logging_stats():
+    """Writer queue and drop counters for the health endpoint"""
+    if _handler is None:
+        return {'initialized': False}
+    return {
+        'initialized': True,
+        'level': logging.getLevelName(logging.getLogger(ROOT_LOGGER).level).lower(),
+        'queued': _handler.queue.qsize(),
+        'dropped': _handler.dropped,
+        'sampled_out': _handler.sampler.sampled_out,
+        'sample_rates': dict(_handler.sampler.rates)
+    }
@@ -0,0 +1,54 @@
+"""Shared aiohttp client sessions for the async (ASGI) serving mode
+
+One ClientSession is kept per running event loop, so every async handler on that
+loop shares a single keep-alive connection pool.
+
+Configuration (environment variables, all optional):
+    ASYNC_HTTP_LIMIT            total simultaneous connections per session (default 200)
+    ASYNC_HTTP_LIMIT_PER_HOST   simultaneous connections per upstream host, 0 for no
+                                separate cap (default ASYNC_HTTP_LIMIT)
+    ASYNC_HTTP_KEEPALIVE        seconds an idle connection is kept open (default 30)
+"""
+import asyncio
+
+import aiohttp
+
+try:
+    from .json_codec import dumps
+    from .app_log import get_logger
+    from .env import env_number
+except ImportError:
+    from services.json_codec import dumps
+    from services.app_log import get_logger
+    from services.env import env_number
+
+log = get_logger('http')
+
+_sessions = {}
+
+
+def get_client_session():
+    """Return the ClientSession for the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # Unlike the sync pool, where HTTP_POOL_MAXSIZE only bounds idle keep-alive
+        # connections, limit_per_host queues requests; one busy provider may use the whole pool
+        limit = env_number('ASYNC_HTTP_LIMIT', 200, int)
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=env_number('ASYNC_HTTP_LIMIT_PER_HOST', limit, int),
+            keepalive_timeout=env_number('ASYNC_HTTP_KEEPALIVE', 30, int),
+            ttl_dns_cache=300
+        )
+        session = aiohttp.ClientSession(connector=connector, json_serialize=dumps)
+        _sessions[loop] = session
+        log.info("Created client session")
+    return session
+
+
+async def close_client_session():
+    """Close the ClientSession that belongs to the running event loop"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
@@ -0,0 +1,262 @@
+"""Two-tier cache for synthesized speech, shared by /api/edge-tts and /api/tts
+
+The same assistant message is often played more than once, and the settings page
+previews one sample sentence per voice, so synthesized MP3s are cached by content:
+the key is a SHA-256 digest of the voice, the prosody options (rate, pitch, volume)
+and the text. A small in-memory LRU sits in front of a directory of <digest>.mp3
+files; both tiers are bounded by total bytes and evict least-recently-used entries.
+A disk hit is promoted to memory. The disk tier survives restarts and is shared by
+the workers of one host. By default it lives in the private per-user directory of
+session_store.private_dir(), so no other user can plant audio in it; if that directory
+is not private, the disk tier is turned off. Files in the directory are only indexed
+when they are regular files owned by the current user.
+
+Configuration (environment variables, all optional):
+    TTS_CACHE               enable the audio cache (default true)
+    TTS_CACHE_MEMORY_BYTES  size of the in-memory tier (default 32 MiB, 0 to disable it)
+    TTS_CACHE_DISK_BYTES    size of the disk tier (default 256 MiB, 0 to disable it)
+    TTS_CACHE_DIR           disk tier directory (default <tmp>/milkyai-<uid>/tts-cache)
+"""
+import hashlib
+import json
+import os
+import re
+import stat
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    from . import metrics
+    from .app_log import get_logger
+    from .env import env_flag, env_number
+    from .session_store import private_dir
+except ImportError:
+    from services import metrics
+    from services.app_log import get_logger
+    from services.env import env_flag, env_number
+    from services.session_store import private_dir
+
+log = get_logger('tts')
+
+PROSODY_OPTIONS = ('rate', 'pitch', 'volume')
+_DIGEST_FILE = re.compile(r'^[0-9a-f]{64}\.mp3$')
+
+LOOKUPS = metrics.counter('milkyai_tts_cache_lookups_total', 'Audio cache lookups by the tier that answered (or miss)', ['result'])
+EVICTIONS = metrics.counter('milkyai_tts_cache_evictions_total', 'Audio cache entries evicted to stay within the byte budget', ['tier'])
+
+
+def audio_cache_enabled():
+    return env_flag('TTS_CACHE', True)
+
+
+def prosody_options(data):
+    """The rate/pitch/volume settings of a TTS request body, e.g. {'rate': '+10%'}"""
+    return {name: str(data[name]) for name in PROSODY_OPTIONS if data.get(name)}
+
+
+def audio_cache_key(voice, text, options=None):
+    """Stable digest of everything that determines the audio"""
+    canonical = json.dumps({'voice': voice, 'options': options or {}, 'text': text},
+                           sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def default_cache_dir():
+    """<tmpdir>/milkyai-<uid>/tts-cache; raises OSError if the parent is not private to this user"""
+    path = os.path.join(private_dir(), 'tts-cache')
+    os.makedirs(path, 0o700, exist_ok=True)
+    return path
+
+
+class AudioCache:
+    """In-memory LRU in front of a size-bounded directory of MP3 files"""
+
+    def __init__(self, memory_bytes=None, disk_bytes=None, directory=None):
+        self.memory_limit = memory_bytes if memory_bytes is not None else max(0, env_number('TTS_CACHE_MEMORY_BYTES', 32 * 1024 * 1024, int))
+        self.disk_limit = disk_bytes if disk_bytes is not None else max(0, env_number('TTS_CACHE_DISK_BYTES', 256 * 1024 * 1024, int))
+        self.directory = directory or os.environ.get('TTS_CACHE_DIR')
+        if self.disk_limit and not self.directory:
+            try:
+                self.directory = default_cache_dir()
+            except OSError as e:
+                log.warning(f"Disk tier of the audio cache disabled: {str(e)}")
+                self.disk_limit = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size, least recently used first
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_limit:
+            self._scan_disk()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _scan_disk(self):
+        """Index files left by earlier processes, oldest access first"""
+        try:
+            names = [name for name in os.listdir(self.directory) if _DIGEST_FILE.match(name)]
+        except OSError:
+            return
+        entries = []
+        for name in names:
+            try:
+                info = os.lstat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid():
+                continue  # Symlinks and files of other users are never served
+            entries.append((info.st_mtime, name[:-4], info.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    # Lookups
+
+    def get(self, key):
+        """The cached MP3 bytes, or None"""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                LOOKUPS.labels('memory').inc()
+                return audio
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    audio = f.read()
+                os.utime(self._path(key))  # Keeps the LRU order across restarts
+            except OSError:
+                audio = None  # Evicted by another worker sharing the directory
+            with self._lock:
+                if audio is None:
+                    self._forget_disk(key)
+                else:
+                    self._disk.move_to_end(key)
+                    self.disk_hits += 1
+                    LOOKUPS.labels('disk').inc()
+                    self._remember(key, audio)
+                    return audio
+        with self._lock:
+            self.misses += 1
+        LOOKUPS.labels('miss').inc()
+        return None
+
+    def put(self, key, audio):
+        if not audio:
+            return
+        with self._lock:
+            self._remember(key, audio)
+            write = self.disk_limit and len(audio) <= self.disk_limit and key not in self._disk
+        if write:
+            self._write_disk(key, audio)
+
+    # Memory tier
+
+    def _remember(self, key, audio):
+        if len(audio) > self.memory_limit:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+            EVICTIONS.labels('memory').inc()
+
+    # Disk tier
+
+    def _write_disk(self, key, audio):
+        path = self._path(key)
+        try:
+            os.makedirs(self.directory, 0o700, exist_ok=True)
+            # mkstemp picks an unused name and opens it exclusively, so nothing can be planted there first
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(audio)
+                os.replace(temp_path, path)
+            except OSError:
+                os.remove(temp_path)
+                raise
+        except OSError as e:
+            log.warning(f"Could not write {path}: {str(e)}")
+            return
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(audio)
+                self._disk_bytes += len(audio)
+            self._evict_disk()
+
+    def _forget_disk(self, key):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_limit and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self.evictions += 1
+            EVICTIONS.labels('disk').inc()
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Hit/miss counters and tier sizes for the health endpoint"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'enabled': audio_cache_enabled(),
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'memory_limit_bytes': self.memory_limit,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'disk_limit_bytes': self.disk_limit,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+            }
+
+
+class _DisabledAudioCache:
+    """Used when TTS_CACHE is off"""
+
+    def get(self, key):
+        return None
+
+    def put(self, key, audio):
+        pass
+
+    def stats(self):
+        return {'enabled': False}
+
+
+_audio_cache = None
+_audio_cache_lock = threading.Lock()
+
+
+def get_audio_cache():
+    """Return the process-wide audio cache, creating it on first use"""
+    global _audio_cache
+    if _audio_cache is None:
+        with _audio_cache_lock:
+            if _audio_cache is None:
+                _audio_cache = AudioCache() if audio_cache_enabled() else _DisabledAudioCache()
+    return _audio_cache
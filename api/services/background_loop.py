@@ -0,0 +1,220 @@
+"""One long-lived asyncio event loop per worker for the async work of the sync Flask app
+
+edge-tts is asyncio-based, and each TTS request used to create and tear down an event
+loop with asyncio.run(). Besides the setup cost, that cancels anything still scheduled
+on the loop, such as the cleanup task of /api/tts. Instead, one daemon thread per
+process runs an event loop forever, and the Flask views hand coroutines to it:
+
+    get_background_loop().run(coro, timeout=30)     # wait for the result
+    get_background_loop().submit(coro)              # concurrent.futures.Future
+    get_background_loop().spawn(coro)               # fire and forget
+    get_background_loop().iterate(agen_factory)     # async generator as a sync iterator
+
+A timeout, or closing the iterator, cancels the coroutine on the loop. The loop starts on
+first use and is started again in a forked worker, since a thread does not survive fork.
+
+A heartbeat measures the loop lag (how late a timer fires, i.e. how long something
+blocked the loop), and the number of coroutines submitted but not yet finished is
+exported as the queue depth, both at /metrics and under async_loop in /api/health.
+
+Configuration (environment variables, all optional):
+    ASYNC_LOOP_TIMEOUT          default timeout in seconds of run() and iterate() steps (default 120)
+    ASYNC_LOOP_LAG_INTERVAL_MS  interval of the lag heartbeat (default 500)
+"""
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+try:
+    from . import metrics
+    from .app_log import get_logger
+    from .env import env_number
+except ImportError:
+    from services import metrics
+    from services.app_log import get_logger
+    from services.env import env_number
+
+log = get_logger('async')
+
+LOOP_LAG_SECONDS = metrics.histogram('milkyai_async_loop_lag_seconds', 'How late the background event loop ran its heartbeat',
+                                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_PENDING = metrics.gauge('milkyai_async_loop_pending', 'Coroutines submitted to the background event loop and not yet finished')
+LOOP_TASKS = metrics.counter('milkyai_async_loop_tasks_total', 'Coroutines run on the background event loop by outcome', ['outcome'])
+
+_EXHAUSTED = object()
+
+
+def default_timeout():
+    return max(1.0, env_number('ASYNC_LOOP_TIMEOUT', 120))
+
+
+class BackgroundLoop:
+    """An event loop running forever on a daemon thread"""
+
+    def __init__(self, lag_interval=None):
+        self.lag_interval = lag_interval or max(0.05, env_number('ASYNC_LOOP_LAG_INTERVAL_MS', 500) / 1000)
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.submitted = 0
+        self.timeouts = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='async-loop', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._ready.set)
+        self.loop.create_task(self._heartbeat())
+        self.loop.run_forever()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    # Submitting work
+
+    def _track(self, future):
+        with self._lock:
+            self._pending += 1
+            self.submitted += 1
+        LOOP_PENDING.labels().inc()
+
+        def done(finished):
+            with self._lock:
+                self._pending -= 1
+            LOOP_PENDING.labels().dec()
+            if finished.cancelled():
+                LOOP_TASKS.labels('cancelled').inc()
+            elif finished.exception() is not None:
+                LOOP_TASKS.labels('error').inc()
+            else:
+                LOOP_TASKS.labels('success').inc()
+
+        future.add_done_callback(done)
+        return future
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop; returns a concurrent.futures.Future
+
+        Cancelling the future cancels the coroutine.
+        """
+        if threading.get_ident() == self._thread.ident:
+            coro.close()
+            raise RuntimeError("BackgroundLoop.submit() called from the loop thread; await the coroutine instead")
+        return self._track(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for its result
+
+        Raises TimeoutError (and cancels the coroutine) after `timeout` seconds.
+        """
+        timeout = timeout if timeout is not None else default_timeout()
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.timeouts += 1
+            raise TimeoutError(f"Coroutine did not finish within {timeout:g}s")
+        except BaseException:
+            future.cancel()  # e.g. the worker is shutting down
+            raise
+
+    def spawn(self, coro, name=None):
+        """Run a coroutine in the background; its errors are logged, not raised"""
+        def report(future):
+            if not future.cancelled() and future.exception() is not None:
+                log.error(f"Background task {name or 'task'} failed: {future.exception()}")
+
+        future = self.submit(coro)
+        future.add_done_callback(report)
+        return future
+
+    def iterate(self, make_agen, timeout=None):
+        """Iterate an async generator from synchronous code
+
+        `make_agen()` is called on the loop. The next item is fetched while the caller
+        handles the current one. Each step may take up to `timeout` seconds; closing the
+        iterator (e.g. when the client goes away) cancels the step and closes the generator.
+        """
+        timeout = timeout if timeout is not None else default_timeout()
+        state = {'agen': None, 'step': None}
+
+        async def step():
+            state['step'] = asyncio.current_task()
+            if state['agen'] is None:
+                state['agen'] = make_agen()
+            try:
+                return await state['agen'].__anext__()
+            except StopAsyncIteration:
+                return _EXHAUSTED
+
+        async def close():
+            if state['step'] is not None and not state['step'].done():
+                state['step'].cancel()
+                await asyncio.wait([state['step']])
+            if state['agen'] is not None:
+                await state['agen'].aclose()
+
+        pending = self.submit(step())
+        try:
+            while True:
+                try:
+                    item = pending.result(timeout)
+                except concurrent.futures.TimeoutError:
+                    self.timeouts += 1
+                    raise TimeoutError(f"No item within {timeout:g}s")
+                if item is _EXHAUSTED:
+                    return
+                pending = self.submit(step())
+                yield item
+        finally:
+            try:
+                self.run(close(), timeout=5)
+            except Exception as e:
+                log.warning(f"Could not close async generator: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            pending = self._pending
+        return {
+            'running': self._thread.is_alive() and self.loop.is_running(),
+            'pending': pending,
+            'submitted': self.submitted,
+            'timeouts': self.timeouts,
+            'lag_ms': round(self.last_lag * 1000, 2),
+            'max_lag_ms': round(self.max_lag * 1000, 2)
+        }
+
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    """Return this process's background loop, starting it on first use (and again after a fork)"""
+    global _background_loop
+    if _background_loop is None or _background_loop.pid != os.getpid():
+        with _background_loop_lock:
+            if _background_loop is None or _background_loop.pid != os.getpid():
+                _background_loop = BackgroundLoop()
+    return _background_loop
+
+
+def background_loop_stats():
+    """Stats for the health endpoint without starting the loop just for the check"""
+    if _background_loop is None or _background_loop.pid != os.getpid():
+        return {'running': False}
+    return _background_loop.stats()
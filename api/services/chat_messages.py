@@ -0,0 +1,135 @@
+"""Immutable chat history, validated once per request and rendered per provider
+
+The client's history used to be copied, validated and patched separately by every
+request builder, and again for every OpenRouter fallback model. ChatMessages does the
+validation once, when the request arrives: the history becomes a tuple of __slots__
+Message objects that carry their token estimates, so a provider attempt only renders
+plain dicts in its wire format and trims them to the model's context window.
+Rendering never modifies the messages, which means per-attempt changes (the system
+prompt of the candidate model, the deep thinking instruction) only exist in that
+attempt's copy and cannot pile up across fallbacks.
+"""
+from functools import lru_cache
+
+try:
+    from .context_budget import fit_context, message_cost
+    from .app_log import get_logger
+except ImportError:
+    from services.context_budget import fit_context, message_cost
+    from services.app_log import get_logger
+
+log = get_logger('chat')
+
+ALLOWED_ROLES = ('system', 'user', 'assistant')
+COHERE_ROLES = {'system': 'SYSTEM', 'user': 'USER', 'assistant': 'CHATBOT'}
+
+
+@lru_cache(maxsize=32)
+def _prompt_cost(system_prompt):
+    # System prompts are a handful of long constants, estimate each one once
+    return message_cost(system_prompt)
+
+
+class Message:
+    """One validated chat message; read-only once created"""
+
+    __slots__ = ('role', 'content', 'tokens')
+
+    def __init__(self, role, content):
+        object.__setattr__(self, 'role', role)
+        object.__setattr__(self, 'content', content)
+        object.__setattr__(self, 'tokens', message_cost(content if isinstance(content, str) else str(content or '')))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Message objects are immutable")
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {len(str(self.content))} chars)"
+
+
+class ChatMessages:
+    """The validated history plus the current user input of one chat request"""
+
+    __slots__ = ('messages', 'user_message', 'system_index')
+
+    def __init__(self, messages, user_input):
+        object.__setattr__(self, 'messages', tuple(messages))
+        object.__setattr__(self, 'user_message', Message('user', user_input))
+        # The client's first system message is replaced by the server-side prompt
+        object.__setattr__(self, 'system_index', next(
+            (i for i, msg in enumerate(self.messages) if msg.role == 'system'), None))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ChatMessages objects are immutable")
+
+    def __len__(self):
+        return len(self.messages)
+
+    @classmethod
+    def from_history(cls, chat_history, user_input):
+        """Validate the client's history: missing or unknown roles become 'user', messages without content are skipped"""
+        messages = []
+        for i, msg in enumerate(chat_history or []):
+            if not isinstance(msg, dict):
+                log.warning(f"Message at index {i} is not an object, skipping")
+                continue
+            if 'content' not in msg:
+                log.warning(f"Message at index {i} missing 'content' property, skipping")
+                continue
+            role = msg.get('role', 'user')
+            if role not in ALLOWED_ROLES:
+                log.warning(f"Message at index {i} has invalid role '{role}', changing to 'user'")
+                role = 'user'
+            messages.append(Message(role, msg['content']))
+        return cls(messages, user_input)
+
+    @property
+    def needs_user_turn(self):
+        """Whether the current user input has to be appended because the history does not end with it"""
+        return not self.messages or self.messages[-1].role != 'user'
+
+    def openai_messages(self, system_prompt, model_info, deep_thinking_mode=False, instruction=None):
+        """Render {'role', 'content'} dicts for an OpenAI-compatible API, fitted to the model's context window
+
+        `instruction` is prepended to the final user turn of this rendering only.
+        """
+        system = {'role': 'system', 'content': system_prompt}
+        system_cost = _prompt_cost(system_prompt)
+        messages, costs = [], []
+        if self.system_index is None:
+            messages.append(system)
+            costs.append(system_cost)
+        for i, msg in enumerate(self.messages):
+            if i == self.system_index:
+                messages.append(system)
+                costs.append(system_cost)
+            else:
+                messages.append({'role': msg.role, 'content': msg.content})
+                costs.append(msg.tokens)
+        if self.needs_user_turn:
+            messages.append({'role': 'user', 'content': self.user_message.content})
+            costs.append(self.user_message.tokens)
+
+        messages = fit_context(messages, model_info, deep_thinking_mode, costs=costs)
+        if instruction and messages and messages[-1]['role'] == 'user':
+            messages = messages[:-1] + [{'role': 'user', 'content': f"{instruction}{messages[-1]['content']}"}]
+        return messages
+
+    def cohere_history(self, system_prompt, model_info, deep_thinking_mode=False, reserved_tokens=0):
+        """Render Cohere's chat_history ({'role', 'message'} with SYSTEM/USER/CHATBOT roles), fitted to the context window
+
+        Unlike the OpenAI rendering, a system message sent by the client is kept as is;
+        `system_prompt` is only added when there is none.
+        """
+        messages, costs = [], []
+        if self.system_index is None:
+            messages.append({'role': 'SYSTEM', 'message': system_prompt})
+            costs.append(_prompt_cost(system_prompt))
+        for msg in self.messages:
+            messages.append({'role': COHERE_ROLES[msg.role], 'message': msg.content})
+            costs.append(msg.tokens)
+        if self.needs_user_turn:
+            messages.append({'role': 'USER', 'message': self.user_message.content})
+            costs.append(self.user_message.tokens)
+        return fit_context(messages, model_info, deep_thinking_mode, content_key='message',
+                           reserved_tokens=reserved_tokens, costs=costs)
@@ -0,0 +1,192 @@
+"""Per-model circuit breakers for the OpenRouter fallback chain
+
+Every model keeps a rolling window of recent outcomes. A breaker opens when the
+error rate over the window gets too high, or when the model hits several rate
+limits / timeouts in a row. Open models are skipped until their cool-down ends;
+then a single probe request is let through (half-open) and its result decides
+whether the breaker closes again or re-opens.
+
+Configuration (environment variables, all optional):
+    CIRCUIT_WINDOW_SECONDS        length of the rolling outcome window (default 300)
+    CIRCUIT_MIN_REQUESTS          outcomes needed before the error rate is trusted (default 5)
+    CIRCUIT_ERROR_RATE            error rate that opens the breaker (default 0.5)
+    CIRCUIT_CONSECUTIVE_FAILURES  back-to-back 429s/timeouts that open the breaker (default 3)
+    CIRCUIT_OPEN_SECONDS          how long an open breaker stays open before probing (default 60)
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+import requests
+
+try:
+    from .app_log import get_logger
+    from .env import env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_number
+
+log = get_logger('circuit')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Outcome kinds recorded by the chat route
+SUCCESS = 'success'
+ERROR = 'error'
+RATE_LIMITED = 'rate_limited'
+TIMEOUT = 'timeout'
+
+
+class CircuitOpenError(Exception):
+    """Raised when a model is skipped because its breaker is open"""
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker driven by a rolling window of outcomes"""
+
+    def __init__(self, name, window_seconds=None, min_requests=None, error_rate=None,
+                 consecutive_failures=None, open_seconds=None):
+        self.name = name
+        self.window_seconds = window_seconds or env_number('CIRCUIT_WINDOW_SECONDS', 300)
+        self.min_requests = min_requests or env_number('CIRCUIT_MIN_REQUESTS', 5, int)
+        self.error_rate_threshold = error_rate or env_number('CIRCUIT_ERROR_RATE', 0.5)
+        self.consecutive_threshold = consecutive_failures or env_number('CIRCUIT_CONSECUTIVE_FAILURES', 3, int)
+        self.open_seconds = open_seconds or env_number('CIRCUIT_OPEN_SECONDS', 60)
+
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (timestamp, kind)
+        self._state = CLOSED
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._consecutive = 0
+        self._last_failure = None
+
+    def _prune(self, now):
+        cutoff = now - self.window_seconds
+        while self._outcomes and self._outcomes[0][0] < cutoff:
+            self._outcomes.popleft()
+
+    def _current_state(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def is_available(self):
+        """True if a request could be sent right now (does not reserve the half-open probe)"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == CLOSED or (state == HALF_OPEN and not self._probe_in_flight)
+
+    def allow_request(self):
+        """Reserve permission to send a request; in half-open state only one probe is allowed"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a reserved probe without recording an outcome (e.g. a cancelled attempt)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, kind):
+        """Record the outcome of a request and update the breaker state"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._outcomes.append((now, kind))
+            state = self._current_state(now)
+
+            if kind == SUCCESS:
+                self._consecutive = 0
+                if state == HALF_OPEN:
+                    log.info(f"{self.name} probe succeeded, closing breaker")
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                    self._outcomes.append((now, kind))
+                self._probe_in_flight = False
+                return
+
+            self._last_failure = kind
+            if kind in (RATE_LIMITED, TIMEOUT):
+                self._consecutive += 1
+
+            if state == HALF_OPEN:
+                self._open(now, f"probe failed ({kind})")
+                return
+
+            failures = sum(1 for _, k in self._outcomes if k != SUCCESS)
+            total = len(self._outcomes)
+            if self._consecutive >= self.consecutive_threshold:
+                self._open(now, f"{self._consecutive} consecutive rate limits/timeouts")
+            elif total >= self.min_requests and failures / total >= self.error_rate_threshold:
+                self._open(now, f"error rate {failures}/{total}")
+
+    def _open(self, now, reason):
+        log.warning(f"Opening breaker for {self.name}: {reason}")
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._consecutive = 0
+
+    def snapshot(self):
+        """Return the breaker state and recent outcome counts for the status endpoints"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            state = self._current_state(now)
+            counts = {SUCCESS: 0, ERROR: 0, RATE_LIMITED: 0, TIMEOUT: 0}
+            for _, kind in self._outcomes:
+                counts[kind] = counts.get(kind, 0) + 1
+            total = len(self._outcomes)
+            failures = total - counts[SUCCESS]
+            return {
+                'state': state,
+                'health_score': round(1 - failures / total, 3) if total else 1.0,
+                'recent_requests': total,
+                'recent_errors': counts[ERROR],
+                'recent_rate_limits': counts[RATE_LIMITED],
+                'recent_timeouts': counts[TIMEOUT],
+                'last_failure': self._last_failure,
+                'retry_in_seconds': round(max(0.0, self.open_seconds - (now - self._opened_at)), 1) if state == OPEN else 0
+            }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    """Return the breaker for a model, creating it on first use"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def classify_error(error):
+    """Map an exception from a model attempt to an outcome kind"""
+    if isinstance(error, (requests.exceptions.Timeout, asyncio.TimeoutError)):
+        return TIMEOUT
+    response = getattr(error, 'response', None)
+    # requests errors carry the response, aiohttp ClientResponseError carries the status
+    status = getattr(response, 'status_code', None) if response is not None else getattr(error, 'status', None)
+    if status == 429:
+        return RATE_LIMITED
+    return ERROR
+
+
+def breaker_snapshot(names=None):
+    """Snapshot of every known breaker (or the given names), keyed by model ID"""
+    if names is None:
+        names = list(_breakers)
+    return {name: get_breaker(name).snapshot() for name in names}
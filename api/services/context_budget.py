@@ -0,0 +1,131 @@
+"""Token-budget-aware context assembly
+
+Every MODEL_OPTIONS entry declares its `context_length`. Before a request is sent, the
+message list is trimmed so that prompt + reserved output tokens fit the window: system
+messages and the newest turns are kept, the oldest turn that only partly fits is
+compressed (head and tail kept, middle cut) and anything older is dropped. Overlong
+histories are therefore handled locally instead of failing upstream after a full
+round trip.
+
+Token counts come from a character-based estimate rather than a real tokenizer so it
+can run on every request: ~4 characters per token for ASCII text, plus extra weight
+for multi-byte characters (CJK, emoji), which tokenize much less efficiently.
+
+Configuration (environment variables, per-model overrides live in MODEL_OPTIONS):
+    CONTEXT_DEFAULT_LENGTH    context window for models without 'context_length' (default 8192)
+    CONTEXT_OUTPUT_RESERVE    tokens kept free for the reply (default 1024, 2000 in deep thinking mode)
+    CONTEXT_SAFETY_MARGIN     fraction of the window the estimate may fill (default 0.9)
+"""
+
+try:
+    from .app_log import get_logger
+    from .env import env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_number
+
+log = get_logger('chat')
+
+# max_tokens requested in deep thinking mode
+DEEP_THINKING_MAX_TOKENS = 2000
+# Role markers and separators added by the chat templates
+MESSAGE_OVERHEAD_TOKENS = 4
+# Below this many tokens a compressed turn is not worth keeping
+MIN_COMPRESSED_TOKENS = 64
+
+TRUNCATION_MARKER = "\n\n[... truncated to fit the context window ...]\n\n"
+
+
+def estimate_tokens(text):
+    """Cheap token estimate: ~4 ASCII characters per token, ~1.25 tokens per multi-byte character"""
+    if not text:
+        return 0
+    chars = len(text)
+    # Each non-ASCII character adds 1-3 bytes in UTF-8
+    extra_bytes = len(text.encode('utf-8')) - chars
+    return (chars + 3) // 4 + (extra_bytes + 1) // 2
+
+
+def output_reserve(model_info, deep_thinking_mode=False):
+    """Tokens to keep free for the model's reply"""
+    if deep_thinking_mode and model_info and model_info.get('supports_deep_thinking', False):
+        return DEEP_THINKING_MAX_TOKENS
+    if model_info and 'max_output_tokens' in model_info:
+        return int(model_info['max_output_tokens'])
+    return env_number('CONTEXT_OUTPUT_RESERVE', 1024, int)
+
+
+def context_budget(model_info, deep_thinking_mode=False):
+    """Prompt tokens available for a model once the output reserve is set aside"""
+    context_length = (model_info or {}).get('context_length') or env_number('CONTEXT_DEFAULT_LENGTH', 8192, int)
+    margin = env_number('CONTEXT_SAFETY_MARGIN', 0.9)
+    return max(0, int(context_length * margin) - output_reserve(model_info, deep_thinking_mode))
+
+
+def compress_text(text, max_tokens):
+    """Cut the middle out of text so its estimate fits max_tokens, keeping the start and the end"""
+    estimate = estimate_tokens(text)
+    if estimate <= max_tokens:
+        return text
+    keep_chars = int(len(text) * max_tokens / estimate) - len(TRUNCATION_MARKER)
+    if keep_chars <= 0:
+        return text[:max(0, max_tokens * 4 - len(TRUNCATION_MARKER))] + TRUNCATION_MARKER.rstrip()
+    head = keep_chars // 2
+    tail = keep_chars - head
+    return text[:head] + TRUNCATION_MARKER + (text[-tail:] if tail else '')
+
+
+def message_cost(text):
+    """Estimated tokens of one message, including its role markers"""
+    return estimate_tokens(text or '') + MESSAGE_OVERHEAD_TOKENS
+
+
+def fit_messages(messages, budget, content_key='content', reserved_tokens=0, costs=None):
+    """Return the messages trimmed to fit `budget` estimated tokens
+
+    System messages and the newest message are always kept; older turns are added
+    newest-first while they fit. `reserved_tokens` accounts for prompt text sent outside
+    the list (e.g. Cohere's preamble and message fields). `costs` may pass precomputed
+    message_cost() values, one per message. The input list is not modified.
+    """
+    if costs is None:
+        costs = [message_cost(msg.get(content_key)) for msg in messages]
+    if sum(costs) + reserved_tokens <= budget:
+        return messages
+
+    system_indexes = {i for i, msg in enumerate(messages) if str(msg.get('role', '')).lower() == 'system'}
+    remaining = budget - reserved_tokens - sum(costs[i] for i in system_indexes)
+    keep = set(system_indexes)
+    compressed = {}
+    last_index = len(messages) - 1
+
+    for i in range(last_index, -1, -1):
+        if i in keep:
+            continue
+        if costs[i] <= remaining:
+            keep.add(i)
+            remaining -= costs[i]
+            continue
+        # The newest message is always sent, compressed if it has to be
+        if i == last_index or remaining >= MIN_COMPRESSED_TOKENS:
+            compressed[i] = compress_text(messages[i].get(content_key) or '',
+                                          max(1, remaining - MESSAGE_OVERHEAD_TOKENS))
+            keep.add(i)
+        break
+
+    trimmed = []
+    for i, msg in enumerate(messages):
+        if i not in keep:
+            continue
+        if i in compressed:
+            msg = dict(msg)
+            msg[content_key] = compressed[i]
+        trimmed.append(msg)
+    log.debug(f"Trimmed history from {len(messages)} to {len(trimmed)} messages "
+              f"({len(compressed)} compressed) to fit {budget} tokens")
+    return trimmed
+
+
+def fit_context(messages, model_info, deep_thinking_mode=False, content_key='content', reserved_tokens=0, costs=None):
+    """Trim a provider message list to the model's context window"""
+    return fit_messages(messages, context_budget(model_info, deep_thinking_mode), content_key, reserved_tokens, costs)
@@ -0,0 +1,231 @@
+"""Server-side conversation state for /api/chat
+
+Instead of posting the whole chatHistory on every turn, the browser sends the
+conversation id, the number of messages it believes the server already has and the
+new message. The server keeps the normalized messages; when an entry is missing (or
+the client's view disagrees with the server's) the request is rejected with 409 and
+the client rehydrates the conversation by sending the full history once.
+
+Backends (CHAT_CONVERSATION_BACKEND):
+    memory   bounded per-process LRU. Only useful with a single worker: with several,
+             a turn answered by another worker misses and costs a rehydration
+    sqlite   the SQLite file of the session store (SESSION_SQLITE_PATH), shared by
+             the workers on one host
+    redis    the Redis server of the session store (SESSION_REDIS_URL), shared by
+             every worker and instance
+The default is the session backend (SESSION_BACKEND) when that is sqlite or redis,
+and memory otherwise.
+
+Configuration (environment variables, all optional):
+    CHAT_CONVERSATION_BACKEND       memory, sqlite or redis (see above)
+    CHAT_CONVERSATION_MAX           maximum conversations kept by the memory backend (default 5000)
+    CHAT_CONVERSATION_MAX_MESSAGES  messages kept per conversation, oldest dropped first (default 200)
+    CHAT_CONVERSATION_TTL           seconds an idle conversation is kept (default 3600)
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from .app_log import get_logger
+    from .json_codec import dumps, loads
+    from .session_store import SQLiteBackend, RedisBackend
+    from .env import env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.json_codec import dumps, loads
+    from services.session_store import SQLiteBackend, RedisBackend
+    from services.env import env_number
+
+BACKENDS = ('memory', 'sqlite', 'redis')
+
+log = get_logger('chat')
+
+
+def normalize_history(chat_history):
+    """Keep only well-formed user/assistant messages as plain {'role', 'content'} dicts
+
+    System messages are dropped because the providers always get the server-side
+    system prompt.
+    """
+    messages = []
+    for msg in chat_history or []:
+        if not isinstance(msg, dict) or not isinstance(msg.get('content'), str) or not msg['content']:
+            continue
+        role = msg.get('role', 'user')
+        if role == 'system':
+            continue
+        if role not in ('user', 'assistant'):
+            role = 'user'
+        messages.append({'role': role, 'content': msg['content']})
+    return messages
+
+
+def new_conversation_id():
+    return secrets.token_urlsafe(16)
+
+
+class ConversationStore:
+    """Thread-safe LRU of conversations with an idle TTL, private to this process"""
+
+    name = 'memory'
+
+    def __init__(self, max_conversations=None, max_messages=None, ttl=None):
+        self.max_conversations = max(1, max_conversations or env_number('CHAT_CONVERSATION_MAX', 5000, int))
+        self.max_messages = max(2, max_messages or env_number('CHAT_CONVERSATION_MAX_MESSAGES', 200, int))
+        self.ttl = ttl or env_number('CHAT_CONVERSATION_TTL', 3600)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # conversation_id -> entry dict
+        self.evictions = 0
+        self.rehydrations = 0
+
+    def get(self, conversation_id, owner, expected_length=None):
+        """Return (messages, length) for a conversation, or None if unknown, expired or out of sync
+
+        `length` counts every message ever stored, including ones trimmed by the
+        per-conversation limit, so it can be compared with the client's own count.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None or entry['owner'] != owner:
+                return None
+            if entry['expires_at'] <= now:
+                del self._entries[conversation_id]
+                return None
+            if expected_length is not None and entry['length'] != expected_length:
+                return None
+            entry['expires_at'] = now + self.ttl
+            self._entries.move_to_end(conversation_id)
+            return list(entry['messages']), entry['length']
+
+    def put(self, conversation_id, owner, messages, length=None, rehydrated=False):
+        """Store the full message list of a conversation"""
+        length = len(messages) if length is None else length
+        if len(messages) > self.max_messages:
+            messages = messages[-self.max_messages:]
+        with self._lock:
+            self._entries[conversation_id] = {
+                'owner': owner,
+                'messages': messages,
+                'length': length,
+                'expires_at': time.monotonic() + self.ttl
+            }
+            self._entries.move_to_end(conversation_id)
+            if rehydrated:
+                self.rehydrations += 1
+            while len(self._entries) > self.max_conversations:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, conversation_id):
+        with self._lock:
+            self._entries.pop(conversation_id, None)
+
+    def stats(self):
+        """Store size and counters for the health endpoint"""
+        with self._lock:
+            return {
+                'backend': self.name,
+                'conversations': len(self._entries),
+                'max_conversations': self.max_conversations,
+                'max_messages': self.max_messages,
+                'ttl_seconds': self.ttl,
+                'evictions': self.evictions,
+                'rehydrations': self.rehydrations
+            }
+
+
+class SharedConversationStore:
+    """Conversations in a session store backend (SQLiteBackend or RedisBackend), shared by every worker
+
+    Entries expire after the idle TTL; each stored turn renews it. Backend errors are
+    logged and treated as a missing conversation, so the client rehydrates.
+    """
+
+    def __init__(self, backend, max_messages=None, ttl=None):
+        self.backend = backend
+        self.name = backend.name
+        self.max_messages = max(2, max_messages or env_number('CHAT_CONVERSATION_MAX_MESSAGES', 200, int))
+        self.ttl = ttl or env_number('CHAT_CONVERSATION_TTL', 3600)
+        self.rehydrations = 0
+        self.errors = 0
+
+    def get(self, conversation_id, owner, expected_length=None):
+        """Same contract as ConversationStore.get"""
+        try:
+            payload = self.backend.get(conversation_id)
+        except Exception as e:
+            self.errors += 1
+            log.error(f"Error reading conversation from {self.name}: {str(e)}")
+            return None
+        if payload is None:
+            return None
+        entry = loads(payload)
+        if entry['owner'] != owner:
+            return None
+        if expected_length is not None and entry['length'] != expected_length:
+            return None
+        return entry['messages'], entry['length']
+
+    def put(self, conversation_id, owner, messages, length=None, rehydrated=False):
+        length = len(messages) if length is None else length
+        if len(messages) > self.max_messages:
+            messages = messages[-self.max_messages:]
+        if rehydrated:
+            self.rehydrations += 1
+        try:
+            self.backend.set(conversation_id, dumps({'owner': owner, 'messages': messages, 'length': length}), self.ttl)
+        except Exception as e:
+            self.errors += 1
+            log.error(f"Error writing conversation to {self.name}: {str(e)}")
+
+    def discard(self, conversation_id):
+        try:
+            self.backend.delete(conversation_id)
+        except Exception as e:
+            self.errors += 1
+            log.error(f"Error deleting conversation from {self.name}: {str(e)}")
+
+    def stats(self):
+        try:
+            backend_stats = self.backend.stats()
+        except Exception as e:
+            backend_stats = {'error': str(e)}
+        return dict(backend_stats, backend=self.name, max_messages=self.max_messages, ttl_seconds=self.ttl,
+                    rehydrations=self.rehydrations, errors=self.errors)
+
+
+def create_conversation_store(backend=None):
+    """Build the conversation store selected by CHAT_CONVERSATION_BACKEND"""
+    session_backend = os.environ.get('SESSION_BACKEND', '').strip().lower()
+    default = session_backend if session_backend in ('sqlite', 'redis') else 'memory'
+    backend = (backend or os.environ.get('CHAT_CONVERSATION_BACKEND') or default).strip().lower()
+    if backend not in BACKENDS:
+        log.warning(f"Unknown CHAT_CONVERSATION_BACKEND {backend!r}, using the memory store")
+        backend = 'memory'
+    try:
+        if backend == 'sqlite':
+            return SharedConversationStore(SQLiteBackend(table='conversations'))
+        if backend == 'redis':
+            return SharedConversationStore(RedisBackend(prefix='milkyai:conversation:'))
+    except Exception as e:
+        log.error(f"Could not set up the {backend} conversation store, using the memory store: {str(e)}")
+    return ConversationStore()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    """Return the process-wide conversation store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_conversation_store()
+                log.info(f"Using the {_store.name} conversation store")
+    return _store
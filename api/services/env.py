@@ -0,0 +1,52 @@
+"""Environment variable parsing shared by the service modules
+
+Settings are read when they are used rather than at import time, so tests and
+long-running workers pick up changes without a reload. Unset, empty and invalid
+values fall back to the default; invalid ones are logged once.
+"""
+import logging
+import os
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+# Plain logging: app_log itself reads its settings through this module
+log = logging.getLogger('milkyai.config')
+
+_reported = set()
+
+
+def _invalid(name, value, default):
+    if (name, value) not in _reported:
+        _reported.add((name, value))
+        log.warning(f"Invalid value for {name}: {value}, using {default}")
+    return default
+
+
+def env_number(name, default, cast=float):
+    """Read a number, e.g. env_number('CHAT_CACHE_TTL', 3600) or env_number('LOG_QUEUE_SIZE', 10000, int)"""
+    value = os.environ.get(name)
+    if not value:
+        return cast(default)
+    try:
+        return cast(value)
+    except ValueError:
+        return _invalid(name, value, default)
+
+
+def provider_env_number(name, provider, default, cast=float):
+    """Like env_number, but NAME_<PROVIDER> (e.g. RETRY_MAX_ATTEMPTS_GROQ) takes precedence over NAME"""
+    value = os.environ.get(f"{name}_{provider.upper()}") or os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        return _invalid(name, value, default)
+
+
+def env_flag(name, default=False):
+    """Read a boolean: 1, true, yes or on (any case) enable it, any other value disables it"""
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in TRUE_VALUES
@@ -0,0 +1,210 @@
+"""Hedged requests: race fallback models instead of walking them one at a time
+
+The primary candidate starts immediately. If it has not succeeded within its hedge
+delay, the next candidate is started alongside it (up to the fan-out width), and a
+failure starts the next candidate straight away. The first success wins; every other
+in-flight attempt is told to stop and its result is discarded.
+
+Configuration (environment variables, per-model overrides live in MODEL_OPTIONS):
+    CHAT_HEDGING            enable hedged mode for the OpenRouter fallback chain (default false)
+    CHAT_HEDGE_DELAY        seconds to wait on a candidate before hedging (default 4)
+    CHAT_HEDGE_FANOUT       max attempts in flight at once (default 2)
+    CHAT_HEDGE_CONCURRENCY  chat requests one process serves at once, e.g. gunicorn --threads (default 8)
+    CHAT_HEDGE_WORKERS      size of the shared attempt thread pool (default fan-out x concurrency)
+
+A losing attempt stops at its next cancellation check (before a retry, after its
+response headers), but a request that is already on the wire keeps its thread until
+the response or the attempt timeout arrives. The pool is therefore sized so that every
+concurrent request can run its full fan-out next to the losers it left behind.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from .app_log import get_logger
+    from .env import env_flag, env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_flag, env_number
+
+log = get_logger('hedge')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def hedging_enabled(model_info=None):
+    """Hedging is on when CHAT_HEDGING is set, unless the model opts out with 'hedging': False"""
+    if model_info and 'hedging' in model_info:
+        return bool(model_info['hedging'])
+    return env_flag('CHAT_HEDGING')
+
+
+def get_hedge_delay(model_info=None):
+    """Seconds to give a candidate before starting the next one"""
+    if model_info and 'hedge_delay' in model_info:
+        return float(model_info['hedge_delay'])
+    return env_number('CHAT_HEDGE_DELAY', 4.0)
+
+
+def get_hedge_fanout(model_info=None):
+    """Maximum number of attempts allowed in flight at the same time"""
+    if model_info and 'hedge_fanout' in model_info:
+        return max(1, int(model_info['hedge_fanout']))
+    return max(1, int(env_number('CHAT_HEDGE_FANOUT', 2)))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                concurrency = max(1, int(env_number('CHAT_HEDGE_CONCURRENCY', 8)))
+                workers = max(1, int(env_number('CHAT_HEDGE_WORKERS', get_hedge_fanout() * concurrency)))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+    return _executor
+
+
+def run_hedged(candidates, attempt, hedge_delay, max_in_flight, on_discard=None):
+    """Race `attempt(candidate, cancel_event)` across candidates and return (candidate, result)
+
+    `hedge_delay(candidate)` gives the seconds to wait on the most recent attempt before
+    starting another one. Losing attempts get their cancel_event set; if they still
+    finish successfully their result is passed to `on_discard` so resources (e.g. open
+    streams) can be released. Raises the last error if every candidate fails.
+    """
+    remaining = list(candidates)
+    pending = {}
+    last_error = None
+    last_launch = {'candidate': None, 'at': 0.0}
+    executor = _get_executor()
+
+    def launch():
+        candidate = remaining.pop(0)
+        cancel_event = threading.Event()
+        future = executor.submit(attempt, candidate, cancel_event)
+        pending[future] = (candidate, cancel_event)
+        last_launch['candidate'] = candidate
+        last_launch['at'] = time.monotonic()
+        log.debug(f"Started attempt for {candidate} ({len(pending)} in flight)")
+
+    def discard(future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        if on_discard:
+            try:
+                on_discard(future.result())
+            except Exception as e:
+                log.warning(f"Error discarding losing attempt: {str(e)}")
+
+    if not remaining:
+        raise ValueError("No candidates to try")
+    launch()
+
+    while pending:
+        timeout = None
+        if remaining and len(pending) < max_in_flight:
+            elapsed = time.monotonic() - last_launch['at']
+            timeout = max(0.0, hedge_delay(last_launch['candidate']) - elapsed)
+
+        done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+        if not done:
+            log.info(f"{last_launch['candidate']} still running after hedge delay, hedging")
+            launch()
+            continue
+
+        for future in done:
+            candidate, _ = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                log.warning(f"Attempt for {candidate} failed: {str(e)}")
+                last_error = e
+                continue
+
+            # Winner: stop everything else that is still running
+            for other_future, (other_candidate, cancel_event) in pending.items():
+                cancel_event.set()
+                if not other_future.cancel():
+                    other_future.add_done_callback(discard)
+                log.debug(f"Cancelled attempt for {other_candidate}")
+            return candidate, result
+
+        # Failures free their slot, so move on to the next candidate right away
+        if remaining and len(pending) < max_in_flight:
+            launch()
+
+    raise last_error if last_error else RuntimeError("All hedged attempts failed")
+
+
+async def run_hedged_async(candidates, attempt, hedge_delay, max_in_flight, on_discard=None):
+    """Async counterpart of run_hedged: `attempt(candidate)` is a coroutine function
+
+    Losing attempts are cancelled outright; ones that already finished successfully
+    are passed to `on_discard` (which may be a coroutine function).
+    """
+    remaining = list(candidates)
+    pending = {}
+    last_error = None
+    last_launch = {'candidate': None, 'at': 0.0}
+
+    def launch():
+        candidate = remaining.pop(0)
+        task = asyncio.ensure_future(attempt(candidate))
+        pending[task] = candidate
+        last_launch['candidate'] = candidate
+        last_launch['at'] = time.monotonic()
+        log.debug(f"Started attempt for {candidate} ({len(pending)} in flight)")
+
+    async def discard(task):
+        if on_discard and not task.cancelled() and task.exception() is None:
+            try:
+                result = on_discard(task.result())
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                log.warning(f"Error discarding losing attempt: {str(e)}")
+
+    if not remaining:
+        raise ValueError("No candidates to try")
+    launch()
+
+    while pending:
+        timeout = None
+        if remaining and len(pending) < max_in_flight:
+            elapsed = time.monotonic() - last_launch['at']
+            timeout = max(0.0, hedge_delay(last_launch['candidate']) - elapsed)
+
+        done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        if not done:
+            log.info(f"{last_launch['candidate']} still running after hedge delay, hedging")
+            launch()
+            continue
+
+        for task in done:
+            candidate = pending.pop(task)
+            try:
+                result = task.result()
+            except Exception as e:
+                log.warning(f"Attempt for {candidate} failed: {str(e)}")
+                last_error = e
+                continue
+
+            # Winner: cancel everything else that is still running
+            for other_task, other_candidate in pending.items():
+                if other_task.done():
+                    await discard(other_task)
+                else:
+                    other_task.cancel()
+                log.debug(f"Cancelled attempt for {other_candidate}")
+            return candidate, result
+
+        # Failures free their slot, so move on to the next candidate right away
+        if remaining and len(pending) < max_in_flight:
+            launch()
+
+    raise last_error if last_error else RuntimeError("All hedged attempts failed")
@@ -0,0 +1,115 @@
+"""Pooled keep-alive HTTP sessions shared by every route that talks to an upstream provider
+
+Each provider gets its own requests.Session with a sized urllib3 connection pool, so
+repeated calls reuse warm TCP/TLS connections instead of paying DNS + handshake every time.
+
+Configuration (environment variables, all optional):
+    HTTP_POOL_CONNECTIONS   number of per-host pools kept per session (default 10)
+    HTTP_POOL_MAXSIZE       max connections kept alive per host (default 20)
+    HTTP_POOL_BLOCK         block instead of opening extra connections when a host is at its limit (default false)
+    HTTP_KEEPALIVE          keep connections open between requests (default true)
+    HTTP_POOL_WARMUP        pre-open connections to the chat providers at import time (default false)
+
+Pool size and per-host limit can be overridden per provider with a suffix,
+e.g. HTTP_POOL_MAXSIZE_OPENROUTER=50.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from .app_log import get_logger
+    from .env import env_flag, provider_env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_flag, provider_env_number
+
+log = get_logger('http')
+
+# Hosts each provider session talks to; the chat providers are warmed on startup
+PROVIDER_HOSTS = {
+    'openrouter': 'https://openrouter.ai',
+    'groq': 'https://api.groq.com',
+    'together': 'https://api.together.xyz',
+    'cohere': 'https://api.cohere.ai',
+    'replicate': 'https://api.replicate.com',
+    'stability': 'https://api.stability.ai',
+    'imgur': 'https://api.imgur.com',
+    'huggingface': 'https://api-inference.huggingface.co',
+    'google': 'https://www.googleapis.com',
+}
+
+WARMUP_PROVIDERS = ['openrouter', 'groq', 'together', 'cohere']
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _create_session(provider):
+    """Build a session with a connection pool sized for the given provider"""
+    pool_connections = provider_env_number('HTTP_POOL_CONNECTIONS', provider, 10, int)
+    pool_maxsize = provider_env_number('HTTP_POOL_MAXSIZE', provider, 20, int)
+    pool_block = env_flag('HTTP_POOL_BLOCK')
+
+    session = requests.Session()
+    # Retries are handled by the callers (see make_openrouter_request), not by urllib3
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        max_retries=0
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    if not env_flag('HTTP_KEEPALIVE', True):
+        session.headers['Connection'] = 'close'
+
+    log.info(f"Created session for {provider} (pools={pool_connections}, per_host={pool_maxsize}, block={pool_block})")
+    return session
+
+
+def get_session(provider='default'):
+    """Return the shared session for a provider, creating it on first use"""
+    session = _sessions.get(provider)
+    if session is not None:
+        return session
+
+    with _sessions_lock:
+        session = _sessions.get(provider)
+        if session is None:
+            session = _create_session(provider)
+            _sessions[provider] = session
+        return session
+
+
+def warm_connections(providers=None, timeout=5):
+    """Open a connection to each provider host so the first real request skips the handshake"""
+    for provider in providers or WARMUP_PROVIDERS:
+        host = PROVIDER_HOSTS.get(provider)
+        if not host:
+            continue
+        try:
+            response = get_session(provider).head(host, timeout=timeout, allow_redirects=False)
+            response.close()  # Return the connection to the pool
+            log.info(f"Warmed connection to {host}")
+        except requests.exceptions.RequestException as e:
+            log.warning(f"Could not warm connection to {host}: {str(e)}")
+
+
+def start_background_warmup(providers=None):
+    """Warm provider connections on a daemon thread if HTTP_POOL_WARMUP is enabled"""
+    if not env_flag('HTTP_POOL_WARMUP'):
+        return None
+    thread = threading.Thread(target=warm_connections, args=(providers,), name='http-pool-warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def close_all():
+    """Close every pooled session, e.g. when a worker shuts down"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
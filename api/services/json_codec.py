@@ -0,0 +1,183 @@
+"""Pluggable JSON codec for provider payloads and API responses
+
+Every chat turn serializes the full message list for the provider, parses the
+completion and serializes the reply for the browser. With long (deep-thinking)
+conversations those passes dominate the CPU time of a request, so they all go
+through this module, which uses orjson when it is installed and the standard
+library otherwise. Both raise json.JSONDecodeError subclasses on bad input.
+
+Passthrough mode goes one step further for OpenAI-compatible completions: the
+assistant's content is sliced out of the upstream body as a raw JSON string literal
+and spliced into the reply, so the rest of the body (usage, reasoning, provider
+metadata) is never parsed and the content is never decoded unless something like
+the response cache needs the text.
+
+Configuration (environment variables, all optional):
+    JSON_CODEC          auto, orjson or stdlib (default auto: orjson if installed)
+    JSON_PASSTHROUGH    forward completion content without re-encoding it (default true)
+"""
+import json
+import os
+import re
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    from .app_log import get_logger
+    from .env import env_flag
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_flag
+
+log = get_logger('app')
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _select_codec():
+    choice = os.environ.get('JSON_CODEC', 'auto').strip().lower()
+    if choice == 'stdlib':
+        return 'stdlib'
+    if orjson is None:
+        if choice == 'orjson':
+            log.warning("JSON_CODEC=orjson but orjson is not installed, using the standard library")
+        return 'stdlib'
+    return 'orjson'
+
+
+CODEC = _select_codec()
+
+
+def passthrough_enabled():
+    return env_flag('JSON_PASSTHROUGH', True)
+
+
+if CODEC == 'orjson':
+    def dumps_bytes(obj, sort_keys=False, default=None):
+        """Serialize to compact UTF-8 JSON bytes"""
+        return orjson.dumps(obj, default=default, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+    def dumps(obj, sort_keys=False, default=None):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode('utf-8')
+
+    def loads(data):
+        """Parse JSON from str, bytes or bytearray"""
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj, sort_keys=False, default=None):
+        """Serialize to compact UTF-8 JSON bytes"""
+        return json.dumps(obj, sort_keys=sort_keys, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def dumps(obj, sort_keys=False, default=None):
+        return json.dumps(obj, sort_keys=sort_keys, default=default, ensure_ascii=False, separators=(',', ':'))
+
+    def loads(data):
+        """Parse JSON from str, bytes or bytearray"""
+        return json.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by this module, used by jsonify and request.get_json"""
+
+    def dumps(self, obj, **kwargs):
+        if CODEC == 'stdlib' or kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, sort_keys=self.sort_keys, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if CODEC == 'stdlib' or kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        if CODEC == 'stdlib' or self._app.debug:
+            # Keep the pretty-printed output in debug mode
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj, sort_keys=self.sort_keys, default=self.default),
+                                        mimetype=self.mimetype)
+
+
+class RawJSONString:
+    """A JSON string literal sliced out of an upstream body, decoded only on demand"""
+
+    __slots__ = ('raw', '_text')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            try:
+                self._text = loads(self.raw)
+            except ValueError:
+                # orjson rejects lone surrogate escapes, which the standard library accepts
+                self._text = json.loads(self.raw)
+        return self._text
+
+    def __bool__(self):
+        return len(self.raw) > 2  # More than the two quotes of ""
+
+    def __str__(self):
+        return self.text
+
+
+_MESSAGE_OPEN_RE = re.compile(rb'"message"\s*:\s*\{')
+_CONTENT_KEY_RE = re.compile(rb'"content"\s*:\s*')
+
+
+def _string_literal_end(body, start):
+    """Index just past the JSON string literal opening at body[start], or -1"""
+    pos = start + 1
+    while True:
+        pos = body.find(b'"', pos)
+        if pos == -1:
+            return -1
+        # A quote preceded by an odd number of backslashes is escaped
+        backslashes = 0
+        while body[pos - 1 - backslashes] == 0x5c:
+            backslashes += 1
+        if backslashes % 2 == 0:
+            return pos + 1
+        pos += 1
+
+
+def extract_completion_content(body):
+    """Slice choices[0].message.content out of an OpenAI-style completion body
+
+    Returns a RawJSONString, or None whenever the body does not have the plain expected
+    shape (error payloads, null content, nested objects before the content field), in
+    which case the caller parses the body normally. Quotes inside JSON strings are always
+    escaped, so a bare '"content":' key can only come from the document structure.
+    """
+    choices = body.find(b'"choices"')
+    if choices == -1:
+        return None
+    message = _MESSAGE_OPEN_RE.search(body, choices)
+    if message is None:
+        return None
+    content_key = _CONTENT_KEY_RE.search(body, message.end())
+    if content_key is None or body.find(b'{', message.end(), content_key.start()) != -1:
+        return None
+    start = content_key.end()
+    if body[start:start + 1] != b'"':
+        return None
+    end = _string_literal_end(body, start)
+    if end == -1:
+        return None
+    return RawJSONString(body[start:end])
+
+
+def splice_json(raw_fields, fields):
+    """Encode an object whose `raw_fields` values are already-encoded JSON bytes"""
+    parts = [dumps_bytes(key) + b':' + (value.raw if isinstance(value, RawJSONString) else value)
+             for key, value in raw_fields.items()]
+    rest = dumps_bytes(fields)
+    if len(rest) > 2:
+        parts.append(rest[1:-1])
+    return b'{' + b','.join(parts) + b'}'
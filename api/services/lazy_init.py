@@ -0,0 +1,97 @@
+"""Once-guarded lazy initialization of heavy subsystems, with startup timings
+
+On serverless platforms every cold start pays for everything imported at module load.
+Optional SDKs (firebase_admin, edge-tts, numpy for the semantic cache) are therefore
+wrapped in a LazySubsystem and only imported or initialized by the first request
+that needs them. Each subsystem records how long its loader took and whether it
+failed, and startup_report() combines that with the import time of the app module
+for /api/health.
+"""
+import threading
+import time
+
+try:
+    from .app_log import get_logger
+except ImportError:
+    from services.app_log import get_logger
+
+log = get_logger('startup')
+
+# Wall-clock time this module was first imported, close enough to process start
+PROCESS_STARTED_AT = time.time()
+
+_subsystems = {}
+_phases = {}
+_registry_lock = threading.Lock()
+
+
+class LazySubsystem:
+    """Runs its loader once, on first use, from whichever thread gets there first
+
+    The loader's return value is cached. If it raises, the error is recorded and
+    get() returns None from then on, so a missing optional package is not
+    re-imported on every request.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+        self.error = None
+        self.seconds = None
+        self.loaded_after = None
+        with _registry_lock:
+            _subsystems[name] = self
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                try:
+                    self._value = self.loader()
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {str(e)}"
+                self.seconds = time.perf_counter() - started
+                self.loaded_after = time.time() - PROCESS_STARTED_AT
+                self._loaded = True
+                if self.error:
+                    log.warning(f"{self.name} is not available: {self.error}")
+                else:
+                    log.info(f"Loaded {self.name} in {self.seconds * 1000:.1f} ms")
+        return self._value
+
+    def report(self):
+        return {
+            'loaded': self._loaded,
+            'available': self._loaded and self.error is None and self._value is not None and self._value is not False,
+            'seconds': round(self.seconds, 4) if self.seconds is not None else None,
+            'loaded_after_start_seconds': round(self.loaded_after, 3) if self.loaded_after is not None else None,
+            'error': self.error
+        }
+
+
+def record_startup_phase(name, seconds):
+    """Record the duration of an eager startup step, e.g. importing the app module"""
+    with _registry_lock:
+        _phases[name] = seconds
+
+
+def startup_report():
+    """Eager startup phases and lazy subsystem timings for the health endpoint"""
+    with _registry_lock:
+        phases = dict(_phases)
+        subsystems = list(_subsystems.values())
+    return {
+        'process_started_at': PROCESS_STARTED_AT,
+        'uptime_seconds': round(time.time() - PROCESS_STARTED_AT, 3),
+        'phases': {name: round(seconds, 4) for name, seconds in phases.items()},
+        'subsystems': {subsystem.name: subsystem.report() for subsystem in subsystems}
+    }
@@ -0,0 +1,392 @@
+"""In-process metrics registry with a Prometheus text exposition
+
+Counters, gauges and fixed-bucket histograms, labelled by provider, model or outcome. Each
+labelled series owns a small lock and preallocated bucket counts, so an observation
+is a bisect plus two additions, and series of different labels never contend.
+
+Under gunicorn every worker has its own registry. When METRICS_MULTIPROC_DIR is set
+(a directory shared by the workers of one host, emptied on deploy), each worker
+writes a snapshot of its series to <dir>/<pid>.json every METRICS_FLUSH_INTERVAL
+seconds and at exit, and /metrics sums the snapshots of all workers, so any worker
+can answer a scrape. The counters and histograms of exited workers still count, but
+their gauges are left out, since they describe a process that no longer exists.
+Without it, /metrics reports the answering process only.
+
+Configuration (environment variables, all optional):
+    METRICS_ENABLED            record metrics (default true)
+    METRICS_MULTIPROC_DIR      shared snapshot directory for multi-worker aggregation
+                               (PROMETHEUS_MULTIPROC_DIR is accepted too)
+    METRICS_FLUSH_INTERVAL     seconds between snapshot writes (default 5)
+    METRICS_TOKEN              if set, /metrics requires "Authorization: Bearer <token>"
+    METRICS_PUBLIC             serve /metrics without a token (default false; without
+                               either setting /metrics answers 404)
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    from .app_log import get_logger
+    from .env import env_flag, env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_flag, env_number
+
+log = get_logger('metrics')
+
+# Latency buckets in seconds, from cache hits to long deep-thinking generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+_flusher = None
+_flusher_pid = None
+
+
+def metrics_enabled():
+    return env_flag('METRICS_ENABLED', True)
+
+
+def multiproc_dir():
+    return os.environ.get('METRICS_MULTIPROC_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR') or None
+
+
+class _CounterSeries:
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class _GaugeSeries(_CounterSeries):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with self._lock:
+            self.value = value
+
+
+class _HistogramSeries:
+    __slots__ = ('_lock', '_bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        # One slot per bucket plus +Inf; cumulated only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return [list(self.counts), self.sum]
+
+
+class _NullSeries:
+    """Returned when metrics are disabled"""
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+_NULL_SERIES = _NullSeries()
+
+
+class Metric:
+    """A named metric with a fixed set of label names and one series per label combination"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        self._enabled = metrics_enabled()
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **labels):
+        """The series for one label combination, created on first use"""
+        if not self._enabled:
+            return _NULL_SERIES
+        if labels:
+            values = tuple(labels[name] for name in self.labelnames)
+        # Existing series are found without building a new key when the values are strings
+        series = self._series.get(values)
+        if series is None:
+            key = tuple(str(value) for value in values)
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = self._new_series()
+        return series
+
+    def snapshot(self):
+        with self._lock:
+            items = list(self._series.items())
+        return {
+            'type': self.kind,
+            'help': self.documentation,
+            'labelnames': list(self.labelnames),
+            'series': [[list(key), series.snapshot()] for key, series in items]
+        }
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """A value that goes up and down; summed across workers like a counter"""
+
+    kind = 'gauge'
+
+    def _new_series(self):
+        return _GaugeSeries()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def snapshot(self):
+        data = super().snapshot()
+        data['buckets'] = list(self.buckets)
+        return data
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+    _start_flusher()
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    """Get or create a counter"""
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames=()):
+    """Get or create a gauge"""
+    return _register(Gauge, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Get or create a histogram"""
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def registry_snapshot():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {metric.name: metric.snapshot() for metric in metrics}
+
+
+# Multi-worker aggregation
+
+def write_snapshot():
+    """Write this process's snapshot to the shared directory (atomically)"""
+    directory = multiproc_dir()
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(registry_snapshot(), f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        log.warning(f"Could not write snapshot: {str(e)}")
+
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        write_snapshot()
+
+
+def _start_flusher():
+    global _flusher, _flusher_pid
+    if not multiproc_dir() or (_flusher is not None and _flusher_pid == os.getpid()):
+        return
+    with _registry_lock:
+        if _flusher is not None and _flusher_pid == os.getpid():
+            return
+        interval = max(0.5, env_number('METRICS_FLUSH_INTERVAL', 5))
+        _flusher = threading.Thread(target=_flush_loop, args=(interval,), name='metrics-flush', daemon=True)
+        _flusher_pid = os.getpid()
+        _flusher.start()
+
+
+def _reset_after_fork():
+    # A worker forked from a preloading master gets its own series and flusher
+    global _flusher, _registry_lock
+    _registry_lock = threading.Lock()
+    _flusher = None
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        metric._lock = threading.Lock()
+        metric._series = {}
+    _start_flusher()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(write_snapshot)
+
+
+def _merge(snapshots):
+    """Sum series with equal names and labels across worker snapshots"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, data in snapshot.items():
+            target = merged.setdefault(name, {key: data[key] for key in data if key != 'series'})
+            series = target.setdefault('_series', {})
+            for labels, value in data['series']:
+                key = tuple(labels)
+                if data['type'] == 'histogram':
+                    counts, total = series.get(key, ([0] * len(value[0]), 0.0))
+                    series[key] = ([a + b for a, b in zip(counts, value[0])], total + value[1])
+                else:
+                    series[key] = series.get(key, 0.0) + value
+    return merged
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, but belongs to another user
+    return True
+
+
+def _without_gauges(snapshot):
+    return {name: data for name, data in snapshot.items() if data['type'] != 'gauge'}
+
+
+def collect():
+    """Merged snapshot of every worker (or only this process without a shared directory)"""
+    directory = multiproc_dir()
+    if not directory:
+        return _merge([registry_snapshot()])
+    write_snapshot()
+    snapshots = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        names = []
+    for filename in names:
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue  # Being replaced or from a crashed writer
+        pid = filename[:-len('.json')]
+        if pid.isdigit() and not _pid_alive(int(pid)):
+            snapshot = _without_gauges(snapshot)
+        snapshots.append(snapshot)
+    return _merge(snapshots)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render_text(merged=None):
+    """Prometheus text exposition format (version 0.0.4)"""
+    merged = collect() if merged is None else merged
+    lines = []
+    for name in sorted(merged):
+        data = merged[name]
+        names = data['labelnames']
+        lines.append(f"# HELP {name} {data['help']}")
+        lines.append(f"# TYPE {name} {data['type']}")
+        for key in sorted(data.get('_series', {})):
+            value = data['_series'][key]
+            if data['type'] == 'histogram':
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(list(data['buckets']) + ['+Inf'], counts):
+                    cumulative += count
+                    le = 'le="{}"'.format(bound if bound == '+Inf' else _format_number(bound))
+                    lines.append(f"{name}_bucket{_format_labels(names, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(names, key)} {repr(float(total))}")
+                lines.append(f"{name}_count{_format_labels(names, key)} {cumulative}")
+            else:
+                lines.append(f"{name}{_format_labels(names, key)} {_format_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,219 @@
+"""Opt-in per-request profiling
+
+A request is profiled when it carries "X-Profile: <PROFILE_TOKEN>" or is picked by
+PROFILE_SAMPLE_RATE. It runs either under cProfile (PROFILE_MODE=deterministic,
+stored as .pstats for pstats/snakeviz) or under a sampling profiler that records the
+request thread's stack every PROFILE_INTERVAL_MS (PROFILE_MODE=sample, stored as
+.collapsed stacks for flamegraph.pl or speedscope). Only the request thread is
+profiled; hedge worker threads show up as time spent waiting.
+
+Profiles are written to PROFILE_DIR, which keeps the newest PROFILE_MAX_FILES, and
+can be listed and downloaded from /api/admin/profiles with the same token.
+
+When neither PROFILE_TOKEN nor PROFILE_SAMPLE_RATE is set at startup, the app does
+not install the request hooks at all, so profiling costs nothing.
+
+Configuration (environment variables, all optional):
+    PROFILE_TOKEN           enables the X-Profile header and the admin endpoints
+    PROFILE_SAMPLE_RATE     share of requests profiled without the header (default 0)
+    PROFILE_MODE            deterministic or sample (default sample); X-Profile-Mode overrides it per request
+    PROFILE_INTERVAL_MS     sampling interval of the sampling profiler (default 5)
+    PROFILE_DIR             where profiles are stored (default <tmp>/milkyai-profiles)
+    PROFILE_MAX_FILES       profiles kept before the oldest are deleted (default 50)
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+try:
+    from .app_log import get_logger
+    from .env import env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_number
+
+log = get_logger('profiler')
+
+MODES = ('deterministic', 'sample')
+EXTENSIONS = {'deterministic': '.pstats', 'sample': '.collapsed'}
+_PROFILE_NAME = re.compile(r'^[A-Za-z0-9_.-]+\.(pstats|collapsed)$')
+
+_prune_lock = threading.Lock()
+
+
+def profile_token():
+    return os.environ.get('PROFILE_TOKEN') or None
+
+
+def sample_rate():
+    return min(1.0, max(0.0, env_number('PROFILE_SAMPLE_RATE', 0)))
+
+
+def profiling_configured():
+    """Whether the request hooks are needed at all"""
+    return bool(profile_token()) or sample_rate() > 0
+
+
+def profile_dir():
+    return os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'milkyai-profiles')
+
+
+def token_matches(value):
+    token = profile_token()
+    return bool(token and value) and hmac.compare_digest(value, token)
+
+
+def should_profile(headers):
+    """Return the profiling mode for a request, or None to run it unprofiled"""
+    requested = headers.get('X-Profile')
+    if requested:
+        if not token_matches(requested):
+            return None
+    elif random.random() >= sample_rate():
+        return None
+    mode = (headers.get('X-Profile-Mode') or os.environ.get('PROFILE_MODE') or 'sample').strip().lower()
+    return mode if mode in MODES else 'sample'
+
+
+class SamplingProfiler:
+    """Records one thread's stack every `interval` seconds as collapsed stacks"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+    """One profiled request: start() before handling it, finish() once the response exists"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = None
+        self._profiler = None
+
+    def start(self):
+        if self.mode == 'deterministic':
+            try:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one active cProfile per process; sample this request instead
+                self.mode = 'sample'
+        if self.mode == 'sample':
+            interval = max(0.001, env_number('PROFILE_INTERVAL_MS', 5) / 1000)
+            self._profiler = SamplingProfiler(threading.get_ident(), interval)
+            self._profiler.start()
+        self.started = time.perf_counter()
+
+    def _stop(self):
+        if self.mode == 'deterministic':
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+
+    def cancel(self):
+        """Stop profiling without storing anything (the request failed before finish())"""
+        self._stop()
+
+    def finish(self, method, path, status):
+        """Stop profiling and store the profile; returns its file name (None if it could not be written)"""
+        self._stop()
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_')[:60] or 'root'
+        now = time.time()
+        name = (f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}-{os.getpid()}-{method.lower()}-{slug}"
+                f"-{status}-{duration_ms:.0f}ms{EXTENSIONS[self.mode]}")
+        directory = profile_dir()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            target = os.path.join(directory, name)
+            if self.mode == 'deterministic':
+                self._profiler.dump_stats(target)
+            else:
+                self._profiler.dump(target)
+        except OSError as e:
+            log.warning(f"Could not store profile {name}: {str(e)}")
+            return None
+        prune_profiles()
+        return name
+
+
+def list_profiles():
+    """Stored profiles, newest first"""
+    directory = profile_dir()
+    try:
+        names = [name for name in os.listdir(directory) if _PROFILE_NAME.match(name)]
+    except OSError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue  # Pruned meanwhile
+        profiles.append({
+            'name': name,
+            'format': 'pstats' if name.endswith('.pstats') else 'collapsed',
+            'bytes': stat.st_size,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(stat.st_mtime)),
+            '_mtime': stat.st_mtime
+        })
+    profiles.sort(key=lambda profile: profile['_mtime'], reverse=True)
+    for profile in profiles:
+        del profile['_mtime']
+    return profiles
+
+
+def prune_profiles():
+    """Delete the oldest profiles beyond PROFILE_MAX_FILES"""
+    keep = max(1, env_number('PROFILE_MAX_FILES', 50, int))
+    with _prune_lock:
+        for profile in list_profiles()[keep:]:
+            try:
+                os.remove(os.path.join(profile_dir(), profile['name']))
+            except OSError:
+                pass
+
+
+def profile_path(name):
+    """Absolute path of a stored profile, or None for unknown or unsafe names"""
+    if not _PROFILE_NAME.match(name or ''):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,143 @@
+"""Exact-match response cache for /api/chat
+
+Replies are keyed on a SHA-256 hash of the model key, the deep-thinking flag, the
+system prompt and the normalized message list, so a repeated prompt ("hi", an
+onboarding question, a retry after a network blip) is answered without going
+upstream. Entries are evicted least-recently-used once the cache is full and expire
+after a fixed TTL.
+
+Configuration (environment variables, per-model overrides live in MODEL_OPTIONS):
+    CHAT_CACHE              enable the response cache (default false)
+    CHAT_CACHE_MAX_ENTRIES  maximum number of cached replies (default 1000)
+    CHAT_CACHE_TTL          seconds a cached reply stays valid (default 3600)
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from .env import env_flag, env_number
+except ImportError:
+    from services.env import env_flag, env_number
+
+
+def cache_enabled(model_info=None):
+    """Caching is on when CHAT_CACHE is set, unless the model overrides it with 'cache'"""
+    if model_info and 'cache' in model_info:
+        return bool(model_info['cache'])
+    return env_flag('CHAT_CACHE')
+
+
+def semantic_cache_enabled(model_info=None):
+    """The semantic tier is on when CHAT_SEMANTIC_CACHE is set, unless the model overrides it with 'semantic_cache'"""
+    if model_info and 'semantic_cache' in model_info:
+        return bool(model_info['semantic_cache'])
+    return env_flag('CHAT_SEMANTIC_CACHE')
+
+
+def normalize_text(text):
+    """Collapse runs of whitespace so trivially different prompts share an entry"""
+    return ' '.join(str(text).split())
+
+
+def normalize_messages(chat_history, user_input):
+    """Reduce the chat history to the (role, content) pairs the providers actually see
+
+    System messages are dropped because every provider builder replaces them with the
+    server-side system prompt, which is part of the key on its own.
+    """
+    messages = []
+    for msg in chat_history or []:
+        if not isinstance(msg, dict) or not msg.get('content'):
+            continue
+        role = str(msg.get('role', 'user')).strip().lower()
+        if role == 'system':
+            continue
+        if role not in ('user', 'assistant'):
+            role = 'user'
+        messages.append([role, normalize_text(msg['content'])])
+    if not messages or messages[-1][0] != 'user':
+        messages.append(['user', normalize_text(user_input)])
+    return messages
+
+
+def make_cache_key(model_key, deep_thinking_mode, system_prompt, chat_history, user_input):
+    """Canonical hash of everything that determines the reply"""
+    canonical = json.dumps({
+        'model': model_key,
+        'deep_thinking': bool(deep_thinking_mode),
+        'system': system_prompt,
+        'messages': normalize_messages(chat_history, user_input)
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max(1, max_entries or env_number('CHAT_CACHE_MAX_ENTRIES', 1000, int))
+        self.ttl = ttl or env_number('CHAT_CACHE_TTL', 3600)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss or expired entry"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries if the cache is full"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Hit/miss counters and size for the health endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': cache_enabled(),
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Return the process-wide response cache, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
@@ -0,0 +1,171 @@
+"""Deadline-aware retry policy for upstream provider calls
+
+Each chat request gets one Deadline: an end-to-end time budget shared by every
+retry and every fallback model. Attempt timeouts are clipped to what is left of it,
+backoff between retries is exponential with full jitter, and rate-limit responses
+are retried no sooner than the provider asks for (Retry-After / X-RateLimit-Reset).
+Once the remaining budget cannot fit the wait plus a useful attempt, retrying stops
+and the last error is raised.
+
+Configuration (environment variables, all optional):
+    RETRY_DEADLINE          end-to-end budget per chat request in seconds (default 90)
+    RETRY_MAX_ATTEMPTS      attempts per model, including the first (default 2)
+    RETRY_BASE_DELAY        backoff base in seconds (default 0.5)
+    RETRY_MAX_DELAY         backoff ceiling in seconds (default 8)
+    RETRY_ATTEMPT_TIMEOUT   timeout of a single attempt in seconds (default 60; Groq 30, Together and Cohere 20)
+    RETRY_MIN_ATTEMPT_TIME  smallest budget worth starting an attempt with (default 3)
+
+Every setting can be overridden per provider with a suffix,
+e.g. RETRY_MAX_ATTEMPTS_GROQ=1 or RETRY_ATTEMPT_TIMEOUT_OPENROUTER=45.
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+try:
+    from .app_log import get_logger
+    from .env import provider_env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import provider_env_number
+
+log = get_logger('retry')
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Built-in per-provider defaults, used when no environment override is set
+PROVIDER_DEFAULTS = {
+    'groq': {'attempt_timeout': 30.0},
+    'together': {'attempt_timeout': 20.0},
+    'cohere': {'attempt_timeout': 20.0},
+}
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request budget runs out before another attempt can be made"""
+
+
+class Deadline:
+    """End-to-end time budget for one request"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def clip(self, timeout):
+        """Clip an attempt timeout to the remaining budget"""
+        return min(timeout, self.remaining())
+
+
+def retry_after_seconds(headers, now=None):
+    """Seconds the provider asked us to wait, from Retry-After or X-RateLimit-Reset (None if absent)"""
+    if not headers:
+        return None
+    now = time.time() if now is None else now
+
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - now)
+            except (TypeError, ValueError):
+                pass
+
+    reset = headers.get('X-RateLimit-Reset') or headers.get('x-ratelimit-reset-requests')
+    if reset:
+        try:
+            value = float(reset)
+        except ValueError:
+            # Groq sends durations like "2m59.56s" / "7.66s"
+            return _parse_duration(reset)
+        if value > 1e12:  # epoch milliseconds (OpenRouter)
+            return max(0.0, value / 1000 - now)
+        if value > 1e9:  # epoch seconds
+            return max(0.0, value - now)
+        return max(0.0, value)  # already a delay
+    return None
+
+
+def _parse_duration(text):
+    total = 0.0
+    number = ''
+    for char in text.strip():
+        if char.isdigit() or char == '.':
+            number += char
+        elif number:
+            if char == 'h':
+                total += float(number) * 3600
+            elif char == 'm':
+                total += float(number) * 60
+            elif char == 's':
+                total += float(number)
+            number = ''
+    return total if total else None
+
+
+class RetryPolicy:
+    """Retry settings for one provider"""
+
+    def __init__(self, provider='default', deadline=None, max_attempts=None, base_delay=None,
+                 max_delay=None, attempt_timeout=None, min_attempt_time=None):
+        self.provider = provider
+        defaults = PROVIDER_DEFAULTS.get(provider, {})
+        self.deadline = deadline or provider_env_number('RETRY_DEADLINE', provider, defaults.get('deadline', 90.0))
+        self.max_attempts = max(1, int(max_attempts or provider_env_number('RETRY_MAX_ATTEMPTS', provider, defaults.get('max_attempts', 2))))
+        self.base_delay = base_delay or provider_env_number('RETRY_BASE_DELAY', provider, defaults.get('base_delay', 0.5))
+        self.max_delay = max_delay or provider_env_number('RETRY_MAX_DELAY', provider, defaults.get('max_delay', 8.0))
+        self.attempt_timeout = attempt_timeout or provider_env_number('RETRY_ATTEMPT_TIMEOUT', provider, defaults.get('attempt_timeout', 60.0))
+        self.min_attempt_time = min_attempt_time or provider_env_number('RETRY_MIN_ATTEMPT_TIME', provider, defaults.get('min_attempt_time', 3.0))
+
+    def new_deadline(self):
+        return Deadline(self.deadline)
+
+    def backoff(self, attempt):
+        """Exponential backoff with full jitter for the given (0-based) attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def retry_delay(self, attempt, headers=None):
+        """Delay before the next attempt, never shorter than what the provider asked for"""
+        delay = self.backoff(attempt)
+        requested = retry_after_seconds(headers)
+        if requested is not None:
+            delay = max(delay, requested)
+        return delay
+
+    def can_retry(self, attempt, delay, deadline, max_attempts=None):
+        """True if another attempt fits both the attempt limit and the remaining budget
+
+        `max_attempts` overrides the policy's limit for one call (e.g. max_retries of request_with_retries).
+        """
+        if attempt + 1 >= (max_attempts or self.max_attempts):
+            return False
+        return deadline.remaining() >= delay + self.min_attempt_time
+
+    def attempt_timeout_for(self, deadline, base_timeout=None):
+        """Timeout for the next attempt, or raise DeadlineExceeded if too little budget is left"""
+        timeout = deadline.clip(base_timeout or self.attempt_timeout)
+        if timeout < self.min_attempt_time:
+            raise DeadlineExceeded(f"Request deadline of {deadline.seconds:.0f}s exceeded")
+        return timeout
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+
+def get_retry_policy(provider='default'):
+    """Return the retry policy for a provider, reading its settings on first use"""
+    policy = _policies.get(provider)
+    if policy is None:
+        with _policies_lock:
+            policy = _policies.setdefault(provider, RetryPolicy(provider))
+    return policy
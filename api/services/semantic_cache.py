@@ -0,0 +1,259 @@
+"""Semantic response cache for /api/chat
+
+Near-duplicate prompts ("what is python", "What's Python?") miss the exact-match cache
+but usually deserve the same answer. This tier embeds the last user turn with a cheap
+local hashing vectorizer (word and character-trigram features hashed into a fixed
+number of signed buckets, then L2-normalized) and answers top-1 cosine lookups with
+a matrix-vector product over the candidate entries.
+
+Entries only match when everything before the last user turn is identical (deep
+thinking flag, system prompt and earlier messages), so a follow-up like "and in
+Java?" is never answered from a different conversation. The content words of the
+last turn, in order, are part of that key too. One changed word barely moves the
+embedding of a long prompt, yet "a palindrome check in Python" and "... in
+JavaScript", "the capital of Australia" and "... of Austria", "is 7 a prime number"
+and "is 9 ...", or "is it safe" and "is it not safe" must never share an answer.
+What is left to the similarity are stopwords, contractions, case and punctuation
+("What's Python?" and "what is python"). Since the key narrows a lookup to a handful
+of rows, its cost does not grow with the number of entries.
+
+Configuration (environment variables, per-model overrides live in MODEL_OPTIONS):
+    CHAT_SEMANTIC_CACHE             enable the semantic cache tier (default false)
+    CHAT_SEMANTIC_CACHE_THRESHOLD   minimum cosine similarity for a hit (default 0.95)
+    CHAT_SEMANTIC_CACHE_CAPACITY    maximum entries per model (default 10000)
+    CHAT_SEMANTIC_CACHE_DIM         embedding dimensions (default 256)
+    CHAT_SEMANTIC_CACHE_TTL         seconds an entry stays valid (default 3600)
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    from .response_cache import normalize_messages, semantic_cache_enabled
+    from .env import env_number
+except ImportError:
+    from services.response_cache import normalize_messages, semantic_cache_enabled
+    from services.env import env_number
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+# Expand common English contractions so "what's" and "what is" embed the same way
+_CONTRACTIONS = [
+    (re.compile(r"n['’]t\b"), " not"),
+    (re.compile(r"['’]s\b"), " is"),
+    (re.compile(r"['’]re\b"), " are"),
+    (re.compile(r"['’]m\b"), " am"),
+    (re.compile(r"['’]ll\b"), " will"),
+    (re.compile(r"['’]ve\b"), " have"),
+    (re.compile(r"['’]d\b"), " would"),
+]
+# Function words that may differ between two phrasings of the same prompt. Every other
+# word, including negations, question words, pronouns and numbers, must match exactly
+STOPWORDS = frozenset((
+    'a', 'an', 'the', 'is', 'are', 'am', 'was', 'were', 'be', 'been', 'being', 'do', 'does', 'did',
+    'to', 'of', 'it', 'this', 'that', 'i', 'me', 'please', 'just', 'some', 'tell', 'can', 'could', 'would'
+))
+
+
+def tokenize(text):
+    """Lowercased word tokens with contractions expanded"""
+    text = str(text).lower()
+    for pattern, replacement in _CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    return _WORD_RE.findall(text)
+
+
+def guard_tokens(text):
+    """Content words of a prompt, in order; prompts only match when these are equal"""
+    return [token for token in tokenize(text) if token not in STOPWORDS]
+
+
+class HashingEmbedder:
+    """Stateless hashing vectorizer: words and character trigrams into signed buckets"""
+
+    def __init__(self, dim=None):
+        self.dim = max(8, dim or env_number('CHAT_SEMANTIC_CACHE_DIM', 256, int))
+
+    def features(self, text):
+        words = tokenize(text)
+        features = list(words)
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, text):
+        """Return an L2-normalized float32 vector (all zeros for empty text)"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in self.features(text):
+            # crc32 is stable across processes, unlike hash()
+            h = zlib.crc32(feature.encode('utf-8'))
+            vector[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+def make_context_key(deep_thinking_mode, system_prompt, chat_history, user_input):
+    """Return (context_hash, last_user_text) for a chat request
+
+    The context hash covers everything except the last user turn, which is what
+    gets embedded, plus the content words of that turn.
+    """
+    messages = normalize_messages(chat_history, user_input)
+    canonical = json.dumps({
+        'deep_thinking': bool(deep_thinking_mode),
+        'system': system_prompt,
+        'messages': messages[:-1],
+        'guards': guard_tokens(messages[-1][1])
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    digest = hashlib.sha256(canonical.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little', signed=True), messages[-1][1]
+
+
+class _ModelIndex:
+    """Embeddings and replies for one model, stored in preallocated arrays"""
+
+    def __init__(self, dim, capacity):
+        self.capacity = capacity
+        self.size = 0
+        # Grown by doubling up to capacity so idle models stay small
+        initial = min(capacity, 256)
+        self.vectors = np.zeros((initial, dim), dtype=np.float32)
+        self.contexts = np.zeros(initial, dtype=np.int64)
+        self.expires = np.zeros(initial, dtype=np.float64)
+        self.last_used = np.zeros(initial, dtype=np.float64)
+        self.replies = [None] * initial
+        self.rows_by_context = {}  # context -> rows holding an entry for it
+
+    def _grow(self):
+        rows = min(self.capacity, len(self.replies) * 2)
+        extra = rows - len(self.replies)
+        self.vectors = np.vstack([self.vectors, np.zeros((extra, self.vectors.shape[1]), dtype=np.float32)])
+        self.contexts = np.concatenate([self.contexts, np.zeros(extra, dtype=np.int64)])
+        self.expires = np.concatenate([self.expires, np.zeros(extra, dtype=np.float64)])
+        self.last_used = np.concatenate([self.last_used, np.zeros(extra, dtype=np.float64)])
+        self.replies.extend([None] * extra)
+
+    def free_slot(self, now):
+        """Pick a row for a new entry; evicts an expired or the least recently used entry when full"""
+        if self.size < self.capacity:
+            if self.size == len(self.replies):
+                self._grow()
+            slot = self.size
+            self.size += 1
+            return slot, False
+        expired = np.flatnonzero(self.expires[:self.size] <= now)
+        if expired.size:
+            return int(expired[0]), False
+        return int(np.argmin(self.last_used[:self.size])), True
+
+    def store(self, row, vector, context, expires, now, reply):
+        if self.replies[row] is not None:
+            # Reused row: drop it from its previous context
+            rows = self.rows_by_context[int(self.contexts[row])]
+            rows.remove(row)
+            if not rows:
+                del self.rows_by_context[int(self.contexts[row])]
+        self.vectors[row] = vector
+        self.contexts[row] = context
+        self.expires[row] = expires
+        self.last_used[row] = now
+        self.replies[row] = reply
+        self.rows_by_context.setdefault(context, []).append(row)
+
+    def search(self, vector, context, now):
+        """Return (row, similarity) of the best live entry with the same context, or (None, 0.0)"""
+        rows = self.rows_by_context.get(context)
+        if not rows:
+            return None, 0.0
+        rows = np.array(rows)
+        scores = self.vectors[rows] @ vector
+        scores[self.expires[rows] <= now] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < 0:
+            return None, 0.0
+        return int(rows[best]), float(scores[best])
+
+
+class SemanticCache:
+    """Per-model semantic caches with a shared embedder"""
+
+    def __init__(self, threshold=None, capacity=None, dim=None, ttl=None):
+        self.threshold = threshold or env_number('CHAT_SEMANTIC_CACHE_THRESHOLD', 0.95)
+        self.capacity = max(1, capacity or env_number('CHAT_SEMANTIC_CACHE_CAPACITY', 10000, int))
+        self.ttl = ttl or env_number('CHAT_SEMANTIC_CACHE_TTL', 3600)
+        self.embedder = HashingEmbedder(dim)
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, model_key, context, text):
+        """Return (reply, similarity) for the closest cached prompt above the threshold, or None"""
+        vector = self.embedder.embed(text)
+        now = time.monotonic()
+        with self._lock:
+            index = self._indexes.get(model_key)
+            row, similarity = index.search(vector, context, now) if index else (None, 0.0)
+            if row is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+            index.last_used[row] = now
+            self.hits += 1
+            return index.replies[row], similarity
+
+    def add(self, model_key, context, text, reply):
+        """Cache a reply for the given prompt"""
+        vector = self.embedder.embed(text)
+        if not vector.any():
+            return
+        now = time.monotonic()
+        with self._lock:
+            index = self._indexes.get(model_key)
+            if index is None:
+                index = self._indexes[model_key] = _ModelIndex(self.embedder.dim, self.capacity)
+            row, evicted = index.free_slot(now)
+            if evicted:
+                self.evictions += 1
+            index.store(row, vector, context, now + self.ttl, now, reply)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self):
+        """Hit/miss counters and per-model sizes for the health endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': semantic_cache_enabled(),
+                'threshold': self.threshold,
+                'dimensions': self.embedder.dim,
+                'capacity_per_model': self.capacity,
+                'entries': {model_key: index.size for model_key, index in self._indexes.items()},
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """Return the process-wide semantic cache, creating it on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticCache()
+    return _cache
@@ -0,0 +1,375 @@
+"""Flask sessions that survive worker and instance hops
+
+A random per-process secret key makes a session cookie written by one gunicorn
+worker (or Vercel instance) unreadable on every other one, so `verified_user_id`
+was lost and each request fell back to full token verification. This module keeps
+the signing key stable and optionally moves the session data server-side.
+
+Secret keys, in order of preference:
+    SESSION_SECRET_KEY              the signing key, shared by every worker and instance;
+                                    required when VERCEL_ENV is production
+    SESSION_SECRET_FILE             otherwise a key file created once and shared by the
+                                    workers on one host (default <tmpdir>/milkyai-<uid>/session.key);
+                                    only used if it belongs to this user and has mode 0600
+    SESSION_SECRET_KEY_FALLBACKS    comma-separated previous keys, still accepted while
+                                    rotating to a new SESSION_SECRET_KEY
+
+Backends (SESSION_BACKEND):
+    cookie   signed cookie holding the data, Flask's default behaviour (default)
+    memory   per-process store, only useful with a single worker
+    sqlite   file store shared by the workers on one host (SESSION_SQLITE_PATH,
+             default <tmpdir>/milkyai-<uid>/sessions.db)
+    redis    any Redis-compatible server (SESSION_REDIS_URL, default redis://localhost:6379/0);
+             needs the optional `redis` package
+
+Other settings:
+    SESSION_TTL             seconds a server-side session is kept (default 86400)
+    SESSION_MEMORY_MAX      sessions kept by the memory backend (default 10000)
+"""
+import hashlib
+import os
+import secrets
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer, URLSafeTimedSerializer
+from werkzeug.datastructures import CallbackDict
+
+try:
+    from .app_log import get_logger
+    from .env import env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_number
+
+BACKENDS = ('cookie', 'memory', 'sqlite', 'redis')
+
+log = get_logger('sessions')
+
+
+def private_dir():
+    """Return <tmpdir>/milkyai-<uid>, a directory only this user can access, creating it if needed
+
+    Raises OSError if the path exists but is a symlink, belongs to another user or is
+    accessible to other users, since anyone on the host can create it first.
+    """
+    path = os.path.join(tempfile.gettempdir(), f'milkyai-{os.getuid()}')
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+        raise OSError(f"{path} is not a private directory of uid {os.getuid()}")
+    return path
+
+
+def _check_key_file(fd, path):
+    """Refuse a key file that another user owns or could have read or written"""
+    info = os.fstat(fd)
+    if info.st_uid != os.getuid():
+        raise OSError(f"{path} is owned by uid {info.st_uid}, not {os.getuid()}")
+    if stat.S_IMODE(info.st_mode) != 0o600:
+        raise OSError(f"{path} has mode {stat.S_IMODE(info.st_mode):o}, expected 600")
+
+
+def _read_key_file(path):
+    fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    with os.fdopen(fd) as f:
+        _check_key_file(fd, path)
+        return f.read().strip()
+
+
+def _read_or_create_key_file(path):
+    """Return the key stored at path, creating it atomically if it does not exist yet
+
+    An existing file is only used if it belongs to this user and has mode 0600.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+    except FileExistsError:
+        key = _read_key_file(path)
+        if key:
+            return key
+        # Another worker created the file but has not written it yet
+        time.sleep(0.1)
+        return _read_key_file(path) or None
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    log.info(f"Created session secret key file at {path}")
+    return key
+
+
+def load_secret_keys():
+    """Return the signing keys, newest first: the current key followed by the rotation fallbacks"""
+    key = os.environ.get('SESSION_SECRET_KEY', '').strip()
+    if not key and os.environ.get('VERCEL_ENV') == 'production':
+        log.error("SESSION_SECRET_KEY is required in production; sessions will not survive instance hops")
+    elif not key:
+        try:
+            key = _read_or_create_key_file(os.environ.get('SESSION_SECRET_FILE') or os.path.join(private_dir(), 'session.key'))
+        except OSError as e:
+            log.error(f"Could not use the session key file: {str(e)}")
+    if not key:
+        log.warning("No stable session secret; sessions will not survive worker restarts. Set SESSION_SECRET_KEY.")
+        key = secrets.token_hex(32)
+    fallbacks = [k.strip() for k in os.environ.get('SESSION_SECRET_KEY_FALLBACKS', '').split(',') if k.strip()]
+    return [key] + fallbacks
+
+
+class RotatingCookieSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed-cookie sessions, also accepting cookies signed with an older key"""
+
+    def __init__(self, secret_keys):
+        self.secret_keys = secret_keys
+
+    def get_signing_serializer(self, app):
+        # itsdangerous signs with the last key and accepts all of them
+        return URLSafeTimedSerializer(
+            list(reversed(self.secret_keys)),
+            salt=self.salt,
+            serializer=self.serializer,
+            signer_kwargs={'key_derivation': self.key_derivation, 'digest_method': self.digest_method}
+        )
+
+    def stats(self):
+        return {'backend': 'cookie', 'secret_keys': len(self.secret_keys)}
+
+
+class MemoryBackend:
+    """Per-process LRU of serialized sessions"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max(1, max_entries or env_number('SESSION_MEMORY_MAX', 10000, int))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # session id -> (expires_at, payload)
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[sid]
+                return None
+            self._entries.move_to_end(sid)
+            return entry[1]
+
+    def set(self, sid, payload, ttl):
+        with self._lock:
+            self._entries[sid] = (time.time() + ttl, payload)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._entries), 'max_sessions': self.max_entries}
+
+
+class SQLiteBackend:
+    """Sessions in a local SQLite file, shared by every worker on the host
+
+    `table` lets other shared state (e.g. the conversation store) use the same file.
+    """
+
+    name = 'sqlite'
+    # Expired rows are purged on roughly one write in this many
+    PURGE_EVERY = 200
+
+    def __init__(self, path=None, table='sessions'):
+        self.path = path or os.environ.get('SESSION_SQLITE_PATH') or os.path.join(private_dir(), 'sessions.db')
+        self.table = table
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                           '(id TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL)')
+        self._writes = 0
+
+    def get(self, sid):
+        with self._lock:
+            row = self._conn.execute(f'SELECT payload FROM {self.table} WHERE id = ? AND expires_at > ?',
+                                     (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, payload, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(f'INSERT OR REPLACE INTO {self.table} (id, payload, expires_at) VALUES (?, ?, ?)',
+                               (sid, payload, now + ttl))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._conn.execute(f'DELETE FROM {self.table} WHERE expires_at <= ?', (now,))
+
+    def delete(self, sid):
+        with self._lock:
+            self._conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (sid,))
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute(f'SELECT COUNT(*) FROM {self.table} WHERE expires_at > ?', (time.time(),)).fetchone()[0]
+        return {self.table: count, 'path': self.path}
+
+
+class RedisBackend:
+    """Sessions in a Redis-compatible server, shared by every worker and instance"""
+
+    name = 'redis'
+    PREFIX = 'milkyai:session:'
+
+    def __init__(self, url=None, prefix=None):
+        import redis  # Optional dependency, only needed for this backend
+        self.url = url or os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+        self.prefix = prefix or self.PREFIX
+        self._client = redis.Redis.from_url(self.url, socket_timeout=2, socket_connect_timeout=2)
+
+    def get(self, sid):
+        payload = self._client.get(self.prefix + sid)
+        return payload.decode('utf-8') if payload is not None else None
+
+    def set(self, sid, payload, ttl):
+        self._client.setex(self.prefix + sid, max(1, int(ttl)), payload)
+
+    def delete(self, sid):
+        self._client.delete(self.prefix + sid)
+
+    def stats(self):
+        return {'url': self.url.split('@')[-1]}  # Never report credentials
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session dict whose data lives in a backend; the cookie only carries the signed id"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Stores session data in a backend and keeps a signed session id in the cookie"""
+
+    serializer = TaggedJSONSerializer()
+    salt = 'milkyai-session-id'
+
+    def __init__(self, backend, secret_keys, ttl=None):
+        self.backend = backend
+        self.secret_keys = secret_keys
+        self.ttl = ttl or env_number('SESSION_TTL', 86400)
+        self.signer = Signer(list(reversed(secret_keys)), salt=self.salt, digest_method=hashlib.sha256)
+        self.errors = 0
+
+    def _new_session(self):
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return self._new_session()
+        try:
+            sid = self.signer.unsign(cookie).decode('utf-8')
+        except BadSignature:
+            return self._new_session()
+        try:
+            payload = self.backend.get(sid)
+        except Exception as e:
+            # A store outage degrades to token verification on every request, not a 500
+            self.errors += 1
+            log.error(f"Error reading session from {self.backend.name}: {str(e)}")
+            payload = None
+        if payload is None:
+            return self._new_session()
+        try:
+            return ServerSideSession(self.serializer.loads(payload), sid=sid)
+        except ValueError:
+            return self._new_session()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self._safe_call(self.backend.delete, session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not self.should_set_cookie(app, session) and not session.new:
+            return
+
+        if not self._safe_call(self.backend.set, session.sid, self.serializer.dumps(dict(session)), self.ttl):
+            return
+        response.set_cookie(
+            name,
+            self.signer.sign(session.sid).decode('utf-8'),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+        response.vary.add('Cookie')
+
+    def _safe_call(self, method, *args):
+        try:
+            method(*args)
+            return True
+        except Exception as e:
+            self.errors += 1
+            log.error(f"Error writing session to {self.backend.name}: {str(e)}")
+            return False
+
+    def stats(self):
+        try:
+            backend_stats = self.backend.stats()
+        except Exception as e:
+            backend_stats = {'error': str(e)}
+        return dict(backend_stats, backend=self.backend.name, ttl_seconds=self.ttl,
+                    secret_keys=len(self.secret_keys), errors=self.errors)
+
+
+def create_session_interface(secret_keys, backend=None):
+    """Build the session interface selected by SESSION_BACKEND"""
+    backend = (backend or os.environ.get('SESSION_BACKEND', 'cookie')).strip().lower()
+    if backend not in BACKENDS:
+        log.warning(f"Unknown SESSION_BACKEND {backend!r}, using cookie sessions")
+        backend = 'cookie'
+    try:
+        if backend == 'memory':
+            return ServerSideSessionInterface(MemoryBackend(), secret_keys)
+        if backend == 'sqlite':
+            return ServerSideSessionInterface(SQLiteBackend(), secret_keys)
+        if backend == 'redis':
+            return ServerSideSessionInterface(RedisBackend(), secret_keys)
+    except Exception as e:
+        log.error(f"Could not set up the {backend} session backend, using cookie sessions: {str(e)}")
+    return RotatingCookieSessionInterface(secret_keys)
+
+
+def init_sessions(app):
+    """Give the Flask app a stable secret key and the configured session interface"""
+    secret_keys = load_secret_keys()
+    app.secret_key = secret_keys[0]
+    app.session_interface = create_session_interface(secret_keys)
+    log.info(f"Using {app.session_interface.stats()['backend']} sessions")
+    return app.session_interface
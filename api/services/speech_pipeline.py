@@ -0,0 +1,217 @@
+"""Sentence-parallel speech synthesis for long texts
+
+One edge-tts call synthesizes its text at roughly real-time speed, so a long assistant
+message used to take as long to synthesize as it was long. Texts longer than
+TTS_PIPELINE_MIN_CHARS are split into segments of whole sentences (long sentences at
+clause boundaries), which are synthesized concurrently, at most
+TTS_PIPELINE_CONCURRENCY at a time, and emitted strictly in order. The first segment
+is kept short and its chunks are relayed as they arrive, so audio starts almost at once;
+later segments are buffered until their turn.
+
+Segmentation follows the markdown structure: headings, list items, quotes and
+paragraphs always end a sentence, fenced code blocks are only split between lines, and
+inline code, list numbers and common abbreviations ("e.g.", "Dr.") never end one.
+
+Configuration (environment variables, all optional):
+    TTS_PIPELINE_CONCURRENCY    segments synthesized at once (default 4, 1 to disable the pipeline)
+    TTS_PIPELINE_MIN_CHARS      shorter texts are synthesized in one call (default 300)
+    TTS_PIPELINE_SEGMENT_CHARS  target maximum length of a segment (default 400)
+"""
+import asyncio
+import re
+
+try:
+    from . import metrics
+    from .env import env_number
+except ImportError:
+    from services import metrics
+    from services.env import env_number
+
+# The first segment is kept short so that its audio arrives quickly
+FIRST_SEGMENT_CHARS = 120
+
+# Words ending in a period that do not end a sentence
+ABBREVIATIONS = frozenset((
+    'e.g', 'i.e', 'etc', 'vs', 'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st',
+    'no', 'fig', 'approx', 'inc', 'ltd', 'co', 'u.s', 'u.k', 'a.m', 'p.m'
+))
+
+SEGMENTS = metrics.counter('milkyai_tts_pipeline_segments_total', 'Text segments synthesized by the sentence-parallel TTS pipeline', ['outcome'])
+
+_FENCE = re.compile(r'^\s*(```|~~~)')
+_BLOCK_START = re.compile(r'^\s*(#{1,6}\s|[-*+]\s|\d+[.)]\s|>|\|)')
+_HEADING = re.compile(r'^\s*#{1,6}\s')
+# Sentence punctuation, optional closing quotes/brackets/emphasis, then whitespace
+_SENTENCE_END = re.compile(r'[.!?…]+["\'”’)\]*_]*\s+')
+_CLAUSE_END = re.compile(r'(?:[,;:]|\s[–—-])\s+')
+_INLINE_CODE = re.compile(r'`[^`]*`')
+_WORD = re.compile(r'\w')
+
+_END = object()
+
+
+class _Failure:
+    __slots__ = ('error',)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def pipeline_concurrency():
+    return max(1, env_number('TTS_PIPELINE_CONCURRENCY', 4, int))
+
+
+def _blocks(text):
+    """Split markdown into ('prose', text) and ('code', lines) blocks"""
+    blocks, prose, code, fence = [], [], None, None
+
+    def flush_prose():
+        if prose:
+            blocks.append(('prose', ' '.join(line.strip() for line in prose)))
+            prose.clear()
+
+    for line in text.splitlines():
+        if code is not None:
+            code.append(line)
+            if line.strip().startswith(fence):
+                blocks.append(('code', code))
+                code, fence = None, None
+            continue
+        match = _FENCE.match(line)
+        if match:
+            flush_prose()
+            code, fence = [line], match.group(1)
+        elif not line.strip():
+            flush_prose()
+        else:
+            if _BLOCK_START.match(line):
+                flush_prose()
+            prose.append(line)
+            if _HEADING.match(line):
+                flush_prose()  # A heading is one line; the text below it starts a new sentence
+    if code is not None:
+        blocks.append(('code', code))  # Unclosed fence
+    flush_prose()
+    return blocks
+
+
+def _ends_sentence(prose, match):
+    """Whether the punctuation at `match` ends a sentence"""
+    word = prose[:match.start()].rsplit(None, 1)[-1] if prose[:match.start()].strip() else ''
+    word = word.lstrip('(["\'*_').lower()
+    if prose[match.start()] != '.':
+        return True
+    if word in ABBREVIATIONS or word.isdigit() or len(word) == 1:
+        return False  # "e.g.", "1. First", "J. Smith"
+    return True
+
+
+def _sentences(prose):
+    masked = _INLINE_CODE.sub(lambda m: 'x' * len(m.group()), prose)
+    sentences, start = [], 0
+    for match in _SENTENCE_END.finditer(masked):
+        if _ends_sentence(masked, match):
+            sentences.append(prose[start:match.end()].strip())
+            start = match.end()
+    sentences.append(prose[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+
+def _split_long(piece, limit):
+    """Split a sentence longer than `limit` at clause boundaries, then at spaces"""
+    if len(piece) <= limit:
+        return [piece]
+    parts, start = [], 0
+    for match in _CLAUSE_END.finditer(piece):
+        parts.append(piece[start:match.end()].strip())
+        start = match.end()
+    parts.append(piece[start:].strip())
+    pieces = []
+    for part in filter(None, parts):
+        while len(part) > limit:
+            cut = part.rfind(' ', 0, limit)
+            cut = cut if cut > 0 else limit
+            pieces.append((part[:cut].strip(), ' '))
+            part = part[cut:].strip()
+        if part:
+            pieces.append((part, ' '))
+    return _pack(pieces, limit)
+
+
+def _pack(pieces, limit, first_limit=None):
+    """Join consecutive (text, separator) pieces into segments of at most `limit` characters"""
+    segments, current = [], ''
+    for piece, separator in pieces:
+        budget = first_limit if first_limit and not segments else limit
+        if current and len(current) + len(separator) + len(piece) > budget:
+            segments.append(current)
+            current = piece
+        else:
+            current = f"{current}{separator}{piece}" if current else piece
+    if current:
+        segments.append(current)
+    return segments
+
+
+def split_speech_segments(text, max_chars=None):
+    """Split text into segments for concurrent synthesis, each at most about `max_chars` long
+
+    Segments contain whole sentences where possible; the first one is kept short.
+    Segments without any words (e.g. a lone "---") are dropped.
+    """
+    limit = max(FIRST_SEGMENT_CHARS, max_chars or env_number('TTS_PIPELINE_SEGMENT_CHARS', 400, int))
+    units = []  # (text, separator before it): a line break between blocks, a space within one
+    for kind, block in _blocks(text):
+        if kind == 'code':
+            pieces = _pack([(line, '\n') for line in block if line.strip()], limit)
+        else:
+            pieces = [piece for sentence in _sentences(block) for piece in _split_long(sentence, limit)]
+        units.extend((piece, '\n' if i == 0 else ' ') for i, piece in enumerate(pieces))
+    segments = _pack(units, limit, first_limit=FIRST_SEGMENT_CHARS)
+    return [segment for segment in segments if _WORD.search(segment)]
+
+
+def plan_segments(text):
+    """The segments to synthesize; [text] when the text is short or the pipeline is disabled"""
+    if pipeline_concurrency() < 2 or len(text) < env_number('TTS_PIPELINE_MIN_CHARS', 300, int):
+        return [text]
+    return split_speech_segments(text) or [text]
+
+
+async def pipelined_chunks(segments, synthesize, concurrency=None):
+    """Yield the audio chunks of every segment, in order, while several are synthesized at once
+
+    `synthesize(segment)` returns an async iterator of audio chunks. The segment being
+    played is relayed chunk by chunk; later ones are buffered until their turn. The first
+    failure cancels the remaining segments and is raised.
+    """
+    semaphore = asyncio.Semaphore(concurrency or pipeline_concurrency())
+    outputs = [asyncio.Queue() for _ in segments]
+
+    async def run(segment, output):
+        async with semaphore:
+            try:
+                async for chunk in synthesize(segment):
+                    output.put_nowait(chunk)
+            except Exception as e:
+                SEGMENTS.labels('error').inc()
+                output.put_nowait(_Failure(e))
+                return
+        SEGMENTS.labels('success').inc()
+        output.put_nowait(_END)
+
+    # Semaphore waiters are woken in order, so segments start in text order
+    tasks = [asyncio.ensure_future(run(segment, output)) for segment, output in zip(segments, outputs)]
+    try:
+        for output in outputs:
+            while True:
+                item = await output.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.error
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
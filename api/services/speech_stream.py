@@ -0,0 +1,91 @@
+"""Streamed edge-tts synthesis for chunked audio/mpeg responses
+
+The JSON TTS endpoints wait for the whole MP3, then send it base64-encoded, which is a
+third larger and cannot start playing before synthesis has finished. In streaming mode
+the MP3 chunks from edge-tts are relayed as they arrive, so the browser can start
+playback (an <audio> element, or MediaSource for POST requests) on the first chunk.
+
+edge-tts is asyncio-based while the Flask views are synchronous: the async generator
+runs on the worker's background event loop (services/background_loop.py), one chunk
+ahead of the client. If the client disconnects, the generator is closed and synthesis stops.
+"""
+try:
+    from .speech_pipeline import plan_segments, pipelined_chunks
+    from .background_loop import get_background_loop
+except ImportError:
+    from services.speech_pipeline import plan_segments, pipelined_chunks
+    from services.background_loop import get_background_loop
+
+# Slice size when a cached MP3 is sent as a stream
+CACHED_CHUNK_BYTES = 16 * 1024
+
+
+def wants_audio_stream(request_obj, payload):
+    """Return True when the client asked for a chunked audio response via the body flag or the Accept header"""
+    if payload and payload.get('stream') is True:
+        return True
+    accept = request_obj.headers.get('Accept', '') if request_obj else ''
+    return 'audio/mpeg' in accept
+
+
+async def speech_chunks(text, voice, options=None):
+    """Yield the MP3 chunks for `text` as they arrive
+
+    Long texts are split into segments that are synthesized concurrently (see
+    services/speech_pipeline.py); the chunks still arrive in text order.
+    """
+    segments = plan_segments(text)
+    if len(segments) == 1:
+        async for chunk in edge_tts_chunks(segments[0], voice, options):
+            yield chunk
+        return
+    async for chunk in pipelined_chunks(segments, lambda segment: edge_tts_chunks(segment, voice, options)):
+        yield chunk
+
+
+async def edge_tts_chunks(text, voice, options=None):
+    """Yield the MP3 chunks of one edge-tts synthesis as they arrive"""
+    import edge_tts
+    communicate = edge_tts.Communicate(text, voice, **(options or {}))
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            yield chunk["data"]
+
+
+def open_speech_stream(text, voice, options=None, on_complete=None, on_error=None):
+    """Start synthesis and wait for the first chunk, so failures can still be answered with an error status
+
+    Returns an iterator over every MP3 chunk. `on_complete(audio)` is called with the full
+    MP3 once the stream has been relayed to the end; `on_error(error)` if it fails midway.
+    Raises if synthesis fails before producing any audio.
+    """
+    chunks = get_background_loop().iterate(lambda: speech_chunks(text, voice, options))
+    try:
+        first = next(chunks)
+    except StopIteration:
+        raise RuntimeError(f"No audio was received from edge-tts for voice {voice}")
+
+    def relay():
+        received = [first]
+        try:
+            yield first
+            for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            chunks.close()  # Client disconnected
+            raise
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            raise
+        if on_complete:
+            on_complete(b''.join(received))
+
+    return relay()
+
+
+def iter_cached_audio(audio):
+    """Send a cached MP3 in slices, like a live stream"""
+    return (audio[i:i + CACHED_CHUNK_BYTES] for i in range(0, len(audio), CACHED_CHUNK_BYTES))
+
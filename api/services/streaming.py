@@ -0,0 +1,178 @@
+"""Server-sent event helpers for relaying provider token streams to the browser"""
+import asyncio
+import json
+
+try:
+    from .json_codec import dumps, loads
+    from .app_log import get_logger
+except ImportError:
+    from services.json_codec import dumps, loads
+    from services.app_log import get_logger
+
+log = get_logger('chat')
+
+
+def wants_stream(request_obj, payload):
+    """Return True when the client opted into streaming via the body flag or the Accept header"""
+    if payload and payload.get('stream') is True:
+        return True
+    accept = request_obj.headers.get('Accept', '') if request_obj else ''
+    return 'text/event-stream' in accept
+
+
+def format_sse(data, event=None):
+    """Format a single server-sent event"""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    payload = data if isinstance(data, str) else dumps(data)
+    for line in payload.split('\n'):
+        lines.append(f"data: {line}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def parse_openai_stream_line(line):
+    """Parse one line of an OpenAI-compatible SSE stream into (events, done)
+
+    Used for OpenRouter, Groq and Together, which all speak the same chunk format.
+    Events are ('delta', text) and ('usage', dict) tuples.
+    """
+    if not line or line.startswith(':') or not line.startswith('data:'):
+        # Blank separators and keep-alive comments (e.g. ": OPENROUTER PROCESSING")
+        return [], False
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return [], True
+    try:
+        chunk = loads(data)
+    except json.JSONDecodeError:
+        return [], False
+
+    if 'error' in chunk:
+        error = chunk['error']
+        message = error.get('message', str(error)) if isinstance(error, dict) else str(error)
+        raise RuntimeError(f"Upstream stream error: {message}")
+
+    events = []
+    # Groq reports usage under x_groq on the final chunk, others under usage
+    usage = chunk.get('usage') or (chunk.get('x_groq') or {}).get('usage')
+    if usage:
+        events.append(('usage', usage))
+
+    for choice in chunk.get('choices') or []:
+        content = (choice.get('delta') or {}).get('content')
+        if content:
+            events.append(('delta', content))
+    return events, False
+
+
+def parse_cohere_stream_line(line):
+    """Parse one line of a Cohere v1 chat stream into (events, done)
+
+    Cohere streams newline-delimited JSON events rather than SSE.
+    """
+    if not line:
+        return [], False
+    try:
+        event = loads(line)
+    except json.JSONDecodeError:
+        return [], False
+
+    event_type = event.get('event_type')
+    if event_type == 'text-generation':
+        text = event.get('text')
+        return ([('delta', text)] if text else []), False
+    if event_type == 'stream-end':
+        if event.get('finish_reason') == 'ERROR':
+            raise RuntimeError("Upstream stream error: Cohere stream ended with an error")
+        meta = (event.get('response') or {}).get('meta') or {}
+        usage = meta.get('billed_units') or meta.get('tokens')
+        return ([('usage', usage)] if usage else []), True
+    return [], False
+
+
+def iter_stream_events(response, parse_line):
+    """Yield events from a requests response using one of the line parsers above"""
+    for raw_line in response.iter_lines(decode_unicode=True):
+        events, done = parse_line(raw_line)
+        yield from events
+        if done:
+            break
+
+
+def iter_openai_stream(response):
+    """Yield ('delta', text) and ('usage', dict) tuples from an OpenAI-compatible stream"""
+    return iter_stream_events(response, parse_openai_stream_line)
+
+
+def iter_cohere_stream(response):
+    """Yield ('delta', text) and ('usage', dict) tuples from a Cohere v1 chat stream"""
+    return iter_stream_events(response, parse_cohere_stream_line)
+
+
+def relay_chat_stream(events, metadata, upstream=None, on_complete=None):
+    """Turn provider events into SSE text: one `delta` event per chunk and a final `done` event
+
+    `events` is an iterator from iter_openai_stream / iter_cohere_stream (possibly with
+    already-consumed items chained back in front). `metadata` is merged into the final
+    event together with the usage reported by the provider. `on_complete`, if given, is
+    called with the full text once the stream finishes without errors.
+    """
+    usage = None
+    chunks = []
+    try:
+        for kind, value in events:
+            if kind == 'delta':
+                chunks.append(value)
+                yield format_sse({'delta': value})
+            elif kind == 'usage':
+                usage = value
+        done = dict(metadata)
+        done['usage'] = usage
+        yield format_sse(done, event='done')
+        if on_complete is not None:
+            on_complete(''.join(chunks))
+    except Exception as e:
+        log.error(f"Error while relaying stream: {str(e)}")
+        yield format_sse({'error': str(e)}, event='error')
+    finally:
+        if upstream is not None:
+            upstream.close()
+
+
+async def iter_stream_events_async(response, parse_line):
+    """Async counterpart of iter_stream_events for aiohttp responses"""
+    async for raw_line in response.content:
+        events, done = parse_line(raw_line.decode('utf-8').rstrip('\r\n'))
+        for event in events:
+            yield event
+        if done:
+            break
+
+
+async def relay_chat_stream_async(events, metadata, upstream=None, on_complete=None):
+    """Async counterpart of relay_chat_stream for the ASGI serving mode
+
+    `on_complete` usually writes to the conversation store and the response caches, so
+    it runs in a worker thread instead of on the event loop.
+    """
+    usage = None
+    chunks = []
+    try:
+        async for kind, value in events:
+            if kind == 'delta':
+                chunks.append(value)
+                yield format_sse({'delta': value})
+            elif kind == 'usage':
+                usage = value
+        done = dict(metadata)
+        done['usage'] = usage
+        yield format_sse(done, event='done')
+        if on_complete is not None:
+            await asyncio.to_thread(on_complete, ''.join(chunks))
+    except Exception as e:
+        log.error(f"Error while relaying stream: {str(e)}")
+        yield format_sse({'error': str(e)}, event='error')
+    finally:
+        if upstream is not None:
+            upstream.release()
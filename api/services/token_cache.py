@@ -0,0 +1,265 @@
+"""Verified Firebase ID token cache and background signing-certificate prefetch
+
+The browser sends the same ID token on every request until it is refreshed (about
+once an hour), so a decoded token is kept in a bounded in-process LRU keyed by a
+SHA-256 hash of the token and served until the token's own `exp` claim. Raw tokens
+are never stored.
+
+Cache misses are verified against Google's securetoken signing certificates, which a
+daemon thread downloads on startup and re-downloads shortly before their
+Cache-Control max-age runs out. Verification therefore never waits on a certificate
+download; if no usable certificate is available (prefetch disabled, first download
+still pending, unknown key id after a rotation) the caller falls back to
+firebase_admin's own verification.
+
+Configuration (environment variables, all optional):
+    AUTH_TOKEN_CACHE                enable the verified-token cache (default true)
+    AUTH_TOKEN_CACHE_MAX            maximum tokens kept in memory (default 10000)
+    FIREBASE_CERT_PREFETCH          fetch the signing certificates on a background thread (default true)
+    FIREBASE_CERT_REFRESH_MARGIN    seconds before max-age expiry to refresh the certificates (default 300)
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+try:
+    from .http_pool import get_session
+    from .lazy_init import LazySubsystem
+    from .app_log import get_logger
+    from .env import env_flag, env_number
+except ImportError:
+    from services.http_pool import get_session
+    from services.lazy_init import LazySubsystem
+    from services.app_log import get_logger
+    from services.env import env_flag, env_number
+
+log = get_logger('auth')
+
+
+def _import_google_auth():
+    # google.auth.jwt pulls in the crypto backends, so it is imported on first use
+    from google.auth import exceptions, jwt
+    return exceptions, jwt
+
+
+google_auth = LazySubsystem('google_auth', _import_google_auth)
+
+CERT_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+ISSUER_PREFIX = 'https://securetoken.google.com/'
+# Used when Google's response has no usable max-age
+DEFAULT_CERT_MAX_AGE = 3600
+# Wait between download attempts while the certificates cannot be fetched
+CERT_RETRY_DELAY = 30
+
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+def token_cache_enabled():
+    return env_flag('AUTH_TOKEN_CACHE', True)
+
+
+class InvalidTokenError(Exception):
+    """Raised when a token fails local verification"""
+
+
+class TokenCache:
+    """Thread-safe LRU of decoded tokens, each expiring at its own `exp` claim"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max(1, max_entries or env_number('AUTH_TOKEN_CACHE_MAX', 10000, int))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # sha256(token) -> (expires_at, decoded_token)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        """Return a copy of the decoded token, or None if it is not cached or has expired"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, token, decoded_token):
+        """Cache a decoded token until its `exp` claim; tokens without one are not cached"""
+        try:
+            expires_at = float(decoded_token.get('exp'))
+        except (TypeError, ValueError):
+            return
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[self._key(token)] = (expires_at, dict(decoded_token))
+            self._entries.move_to_end(self._key(token))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Cache size and hit/miss counters for the health endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': token_cache_enabled(),
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+class CertificatePrefetcher:
+    """Keeps Google's token signing certificates fresh on a daemon thread"""
+
+    def __init__(self, url=CERT_URL, refresh_margin=None):
+        self.url = url
+        self.refresh_margin = refresh_margin or env_number('FIREBASE_CERT_REFRESH_MARGIN', 300)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._certs = None
+        self._expires_at = 0.0
+        self.fetches = 0
+        self.failures = 0
+        self.local_verifications = 0
+        self.fallbacks = 0
+
+    def start(self):
+        """Start the refresh thread once; returns the thread or None when disabled"""
+        if not env_flag('FIREBASE_CERT_PREFETCH', True) or google_auth.get() is None:
+            return None
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='firebase-cert-prefetch', daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def refresh(self):
+        """Download the certificates now; returns seconds until they should be refreshed again"""
+        try:
+            response = get_session('google').get(self.url, timeout=10)
+            response.raise_for_status()
+            certs = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.failures += 1
+            log.warning(f"Could not fetch Firebase signing certificates: {str(e)}")
+            return CERT_RETRY_DELAY
+        match = _MAX_AGE_RE.search(response.headers.get('Cache-Control', ''))
+        max_age = int(match.group(1)) if match else DEFAULT_CERT_MAX_AGE
+        with self._lock:
+            self._certs = certs
+            self._expires_at = time.monotonic() + max_age
+        self.fetches += 1
+        log.info(f"Fetched {len(certs)} Firebase signing certificates (max-age {max_age}s)")
+        return max(CERT_RETRY_DELAY, max_age - self.refresh_margin)
+
+    def _run(self):
+        while True:
+            delay = self.refresh()
+            # A verification that hits an unknown key id wakes the thread up early
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+
+    def certificates(self):
+        """Current certificates, or None if none were fetched or they are past their max-age"""
+        with self._lock:
+            if self._certs is None or self._expires_at <= time.monotonic():
+                return None
+            return self._certs
+
+    def verify(self, token, project_id):
+        """Verify a Firebase ID token with the prefetched certificates
+
+        Returns the decoded claims (with 'uid' set like firebase_admin does), None when
+        the token cannot be checked locally and the caller should fall back, and raises
+        InvalidTokenError for tokens that are definitely invalid.
+        """
+        modules = google_auth.get()
+        certs = self.certificates() if project_id and modules is not None else None
+        if certs is None:
+            self.fallbacks += 1
+            return None
+        google_auth_exceptions, google_jwt = modules
+        try:
+            header = google_jwt.decode_header(token)
+        except (ValueError, google_auth_exceptions.GoogleAuthError) as e:
+            raise InvalidTokenError(f"Malformed ID token: {str(e)}")
+        if header.get('alg') != 'RS256':
+            raise InvalidTokenError(f"ID token has unexpected algorithm {header.get('alg')!r}")
+        if header.get('kid') not in certs:
+            # Probably a key rotation since the last download
+            self._wakeup.set()
+            self.fallbacks += 1
+            return None
+        try:
+            claims = google_jwt.decode(token, certs=certs, audience=project_id)
+        except (ValueError, google_auth_exceptions.GoogleAuthError) as e:
+            raise InvalidTokenError(f"ID token failed verification: {str(e)}")
+        if claims.get('iss') != ISSUER_PREFIX + project_id:
+            raise InvalidTokenError("ID token has an incorrect issuer")
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise InvalidTokenError("ID token has an invalid subject")
+        claims['uid'] = subject
+        self.local_verifications += 1
+        return claims
+
+    def stats(self):
+        with self._lock:
+            remaining = self._expires_at - time.monotonic() if self._certs is not None else 0
+            return {
+                'prefetch_running': self._thread is not None and self._thread.is_alive(),
+                'certificates': len(self._certs or {}),
+                'expires_in_seconds': max(0, int(remaining)),
+                'fetches': self.fetches,
+                'failures': self.failures,
+                'local_verifications': self.local_verifications,
+                'fallbacks': self.fallbacks
+            }
+
+
+_token_cache = None
+_prefetcher = None
+_singletons_lock = threading.Lock()
+
+
+def get_token_cache():
+    """Return the process-wide verified-token cache, creating it on first use"""
+    global _token_cache
+    if _token_cache is None:
+        with _singletons_lock:
+            if _token_cache is None:
+                _token_cache = TokenCache()
+    return _token_cache
+
+
+def get_cert_prefetcher():
+    """Return the process-wide certificate prefetcher, creating it on first use"""
+    global _prefetcher
+    if _prefetcher is None:
+        with _singletons_lock:
+            if _prefetcher is None:
+                _prefetcher = CertificatePrefetcher()
+    return _prefetcher
@@ -0,0 +1,178 @@
+"""Per-request phase tracing, reported in the Server-Timing header
+
+A RequestTrace collects named spans (auth, history, upstream connect and generation,
+fallback hops, serialization, ...) while a request is handled. The spans are sent to
+the browser as a Server-Timing header, where they show up in the network panel of
+the developer tools, and requests slower than TRACE_SLOW_MS are also logged as one
+structured JSON record under the 'trace' logger.
+
+The active trace lives in a context variable, so helpers deep in the call stack can
+add spans without it being passed around. When tracing is disabled, current_trace()
+returns a shared no-op trace whose span() hands back one reusable context manager,
+so instrumented code costs a function call per phase.
+
+Configuration (environment variables, all optional):
+    TRACE_ENABLED     record spans and send Server-Timing headers (default true)
+    TRACE_SLOW_MS     log a trace record for requests slower than this (default 10000, 0 to disable)
+"""
+import contextvars
+import json
+import time
+
+try:
+    from .app_log import get_logger
+    from .env import env_flag, env_number
+except ImportError:
+    from services.app_log import get_logger
+    from services.env import env_flag, env_number
+
+log = get_logger('trace')
+
+
+def tracing_enabled():
+    return env_flag('TRACE_ENABLED', True)
+
+
+def _quote(desc):
+    return '"' + str(desc).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'desc', 'started')
+
+    def __init__(self, trace, name, desc):
+        self.trace = trace
+        self.name = name
+        self.desc = desc
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace.add(self.name, time.perf_counter() - self.started, self.desc, started=self.started)
+        return False
+
+
+class RequestTrace:
+    """Spans of one request: (name, offset from the request start, duration, description)"""
+
+    __slots__ = ('started', 'spans')
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def span(self, name, desc=None):
+        """Context manager timing one phase"""
+        return _Span(self, name, desc)
+
+    def add(self, name, seconds, desc=None, started=None):
+        """Record a phase measured elsewhere; list.append keeps this safe from hedge worker threads"""
+        offset = (started if started is not None else time.perf_counter() - seconds) - self.started
+        self.spans.append((name, offset, seconds, desc))
+
+    def mark(self, name, started, desc=None):
+        """Record a phase that began at perf_counter() value `started` and ends now"""
+        self.spans.append((name, started - self.started, time.perf_counter() - started, desc))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """The Server-Timing header value, ending with the total time"""
+        parts = []
+        for name, _, seconds, desc in self.spans:
+            part = f"{name};dur={seconds * 1000:.1f}"
+            if desc:
+                part += f";desc={_quote(desc)}"
+            parts.append(part)
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ', '.join(parts)
+
+    def record(self, **fields):
+        """A JSON-serializable record of the trace for the slow request log"""
+        return dict(fields, total_ms=round(self.elapsed() * 1000, 1), spans=[
+            {'name': name, 'start_ms': round(offset * 1000, 1), 'duration_ms': round(seconds * 1000, 1), 'desc': desc}
+            for name, offset, seconds, desc in self.spans
+        ])
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _NullTrace:
+    """Stands in for RequestTrace when tracing is disabled or outside a traced request"""
+
+    __slots__ = ()
+
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name, desc=None):
+        return self._span
+
+    def add(self, name, seconds, desc=None, started=None):
+        pass
+
+    def mark(self, name, started, desc=None):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+_current = contextvars.ContextVar('request_trace', default=NULL_TRACE)
+
+
+def start_trace():
+    """Begin tracing the current request; returns (trace, token for end_trace)"""
+    trace = RequestTrace() if tracing_enabled() else NULL_TRACE
+    return trace, _current.set(trace)
+
+
+def end_trace(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Torn down in another context (a streamed response finished by the server's thread)
+        _current.set(NULL_TRACE)
+
+
+def current_trace():
+    return _current.get()
+
+
+class bind:
+    """Make `trace` current in another thread, e.g. a hedge worker running one attempt"""
+
+    __slots__ = ('trace', 'token')
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        return False
+
+
+def log_if_slow(trace, **fields):
+    """Log the trace as one JSON record if the request took longer than TRACE_SLOW_MS"""
+    threshold = env_number('TRACE_SLOW_MS', 10000)
+    if not trace.enabled or threshold <= 0 or trace.elapsed() * 1000 < threshold:
+        return
+    log.warning(json.dumps(trace.record(**fields)))
@@ -0,0 +1,246 @@
+"""Cached edge-tts voice catalog with lookups by ShortName and by (locale, gender)
+
+Fetching the voice list is a network round trip to Microsoft, and it used to happen
+on every TTS request. The catalog loads it once per process and indexes it, so
+checking a voice and picking a same-language, same-gender replacement are dict
+lookups. Once the list is older than VOICE_CATALOG_TTL, requests keep using it while
+one background thread fetches a new one. Every successful fetch is also written to
+VOICE_CATALOG_PATH, and a cold start reads that snapshot first, so only a process
+without any snapshot waits for the network. If a fetch fails, the previous list
+stays in use.
+
+Configuration (environment variables, all optional):
+    VOICE_CATALOG_TTL       seconds before the voice list is refreshed (default 86400)
+    VOICE_CATALOG_PATH      snapshot file (default <tmp>/milkyai-voices.json, empty to disable)
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    from .background_loop import get_background_loop
+    from .app_log import get_logger
+    from .env import env_number
+except ImportError:
+    from services.background_loop import get_background_loop
+    from services.app_log import get_logger
+    from services.env import env_number
+
+log = get_logger('tts')
+
+DEFAULT_VOICE = 'en-US-AvaNeural'
+
+# Used to guess the gender of a voice that is not in the catalog
+FEMALE_NAME_HINTS = ('Ava', 'Michelle', 'Jenny', 'Sara', 'Female')
+MALE_NAME_HINTS = ('Andrew', 'Roger', 'Steffan', 'Male')
+
+# Seconds before a failed first fetch is retried, so an outage does not cost every request a fetch
+RETRY_AFTER_FAILURE = 60
+
+# Only these fields are kept and written to the snapshot
+VOICE_FIELDS = ('ShortName', 'Locale', 'Gender', 'FriendlyName')
+
+
+def snapshot_path():
+    path = os.environ.get('VOICE_CATALOG_PATH')
+    if path is None:
+        return os.path.join(tempfile.gettempdir(), 'milkyai-voices.json')
+    return path or None
+
+
+def fetch_edge_tts_voices():
+    """Download the voice list from the edge-tts service"""
+    import edge_tts
+    return get_background_loop().run(edge_tts.list_voices(), timeout=30)
+
+
+def voice_locale(short_name):
+    """'en-US-AvaNeural' -> 'en-US'"""
+    parts = short_name.split('-')
+    return '-'.join(parts[:2]) if len(parts) >= 2 else short_name
+
+
+def guess_gender(short_name):
+    if any(hint in short_name for hint in FEMALE_NAME_HINTS):
+        return 'female'
+    if any(hint in short_name for hint in MALE_NAME_HINTS):
+        return 'male'
+    return None
+
+
+class VoiceCatalog:
+    """Indexed edge-tts voices, loaded once and refreshed in the background"""
+
+    def __init__(self, fetch=fetch_edge_tts_voices, ttl=None, path=None):
+        self.fetch = fetch
+        self.ttl = ttl if ttl is not None else max(60.0, env_number('VOICE_CATALOG_TTL', 86400))
+        self.path = path if path is not None else snapshot_path()
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # (by ShortName, by locale, by (locale, gender)), replaced as a whole on refresh
+        self._index = ({}, {}, {})
+        self.fetched_at = None
+        self.source = None
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+        self._failed_at = None
+
+    # Loading
+
+    def _install(self, voices, fetched_at, source):
+        by_name, by_locale, by_locale_gender = {}, {}, {}
+        for voice in voices:
+            name = voice.get('ShortName')
+            if not name:
+                continue
+            entry = {field: voice.get(field) for field in VOICE_FIELDS}
+            entry['Locale'] = entry['Locale'] or voice_locale(name)
+            by_name[name] = entry
+            locale = entry['Locale'].lower()
+            by_locale.setdefault(locale, []).append(name)
+            by_locale_gender.setdefault((locale, (entry['Gender'] or '').lower()), []).append(name)
+        # One assignment, so readers never mix an old and a new index
+        self._index = (by_name, by_locale, by_locale_gender)
+        self.fetched_at = fetched_at
+        self.source = source
+
+    def _load_snapshot(self):
+        if not self.path:
+            return False
+        try:
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            voices, fetched_at = snapshot['voices'], float(snapshot['fetched_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        if not voices:
+            return False
+        self._install(voices, fetched_at, 'snapshot')
+        log.info(f"Loaded {len(self._index[0])} voices from {self.path}")
+        return True
+
+    def _save_snapshot(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({'fetched_at': self.fetched_at, 'voices': list(self._index[0].values())}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            log.warning(f"Could not write snapshot: {str(e)}")
+
+    def refresh(self):
+        """Fetch the voice list now; keeps the current one if the fetch fails"""
+        started = time.perf_counter()
+        try:
+            voices = self.fetch()
+            if not voices:
+                raise ValueError("empty voice list")
+        except Exception as e:
+            self.failures += 1
+            self._failed_at = time.monotonic()
+            self.last_error = f"{type(e).__name__}: {str(e)}"
+            log.warning(f"Could not fetch the voice list: {self.last_error}")
+            return False
+        self._install(voices, time.time(), 'network')
+        self.refreshes += 1
+        log.info(f"Fetched {len(self._index[0])} voices in {time.perf_counter() - started:.2f}s")
+        self._save_snapshot()
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            self._refreshing = False
+
+    def ensure_loaded(self):
+        """Load on first use (snapshot, else network) and start a background refresh once stale"""
+        if self.fetched_at is None:
+            if self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_AFTER_FAILURE:
+                return
+            with self._lock:
+                if self.fetched_at is None and not self._load_snapshot():
+                    self.refresh()
+        if self.fetched_at is not None and time.time() - self.fetched_at > self.ttl and not self._refreshing:
+            with self._lock:
+                if self._refreshing:
+                    return
+                self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, name='voice-catalog-refresh', daemon=True).start()
+
+    # Lookups
+
+    def get(self, short_name):
+        """The voice's ShortName, Locale, Gender and FriendlyName, or None"""
+        self.ensure_loaded()
+        return self._index[0].get(short_name)
+
+    def find(self, locale, gender=None):
+        """ShortNames for a locale (e.g. 'en-US'), optionally only one gender"""
+        self.ensure_loaded()
+        _, by_locale, by_locale_gender = self._index
+        if gender:
+            return list(by_locale_gender.get((locale.lower(), gender.lower()), ()))
+        return list(by_locale.get(locale.lower(), ()))
+
+    def voices(self, locale=None):
+        self.ensure_loaded()
+        by_name, by_locale, _ = self._index
+        if locale:
+            return [by_name[name] for name in by_locale.get(locale.lower(), ())]
+        return list(by_name.values())
+
+    def resolve(self, requested):
+        """The requested voice if it exists, else a voice of the same locale and gender, else of the same locale
+
+        Falls back to DEFAULT_VOICE when the locale has no voices. Without a catalog (the
+        list could not be fetched) the requested voice is returned unchanged.
+        """
+        self.ensure_loaded()
+        by_name = self._index[0]
+        if not by_name or requested in by_name:
+            return requested
+        log.info(f"Requested voice {requested} not found in available voices")
+        locale = voice_locale(requested)
+        gender = guess_gender(requested)
+        candidates = (self.find(locale, gender) if gender else []) or self.find(locale)
+        if candidates:
+            log.info(f"Using alternative voice: {candidates[0]}")
+            return candidates[0]
+        log.warning(f"No alternative voice found for language {locale}, using default")
+        return DEFAULT_VOICE
+
+    def stats(self):
+        return {
+            'voices': len(self._index[0]),
+            'locales': len(self._index[1]),
+            'source': self.source,
+            'age_seconds': int(time.time() - self.fetched_at) if self.fetched_at else None,
+            'ttl_seconds': self.ttl,
+            'refreshing': self._refreshing,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'last_error': self.last_error
+        }
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_voice_catalog():
+    """Return the process-wide voice catalog, creating it on first use"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = VoiceCatalog()
+    return _catalog
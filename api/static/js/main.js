@@ -37,6 +37,15 @@ let controller = null;
 let currentChatId = null;
 let currentUser = null;
 
+// Server-side conversation state: once the server has the conversation, only new messages are sent
+let serverConversationId = null;
+let serverConversationLength = 0;
+
+function resetServerConversation() {
+    serverConversationId = null;
+    serverConversationLength = 0;
+}
+
 // Deep thinking mode state
 let deepThinkingMode = false;
 let currentModel = 'deepseek/deepseek-chat-v3-0324:free'; // Default model with full ID
@@ -1516,33 +1525,34 @@ async function sendMessage(message) {
             }
         }
 
-        // Process chat history to handle large content before sending to API
-        // Process chat history to handle large content before sending to API
-        const MAX_CONTENT_LENGTH = 1000; // Maximum length for message content
-        const processedChatHistory = chatHistory.map(msg => {
-            if (msg.content && typeof msg.content === 'string' && msg.content.length > MAX_CONTENT_LENGTH) {
-                // Create a copy of the message to avoid modifying the original
-                const processedMsg = {...msg};
-                // Extract title from large content (first few words)
-                const words = msg.content.split(' ');
-                const title = words.slice(0, 5).join(' ') + (words.length > 5 ? '...' : '');
-                // Replace large content with title
-                processedMsg.content = `${title}`;
-                return processedMsg;
-            }
-            return msg;
-        });
-        const response = await fetch('/api/chat', {
+        // Send only the new message when the server already has this conversation,
+        // and the full history when it asks for it (409 after the server-side entry expired)
+        const postChat = (includeHistory) => fetch('/api/chat', {
             method: 'POST',
             headers,
-            body: JSON.stringify({
+            body: JSON.stringify(includeHistory || !serverConversationId ? {
                 message,
                 model: currentModel,
-                chatHistory: processedChatHistory,
-                deepThinkingMode: deepThinkingMode
+                chatHistory,
+                deepThinkingMode: deepThinkingMode,
+                conversationId: serverConversationId
+            } : {
+                message,
+                model: currentModel,
+                deepThinkingMode: deepThinkingMode,
+                conversationId: serverConversationId,
+                historyLength: serverConversationLength
             }),
             signal
         });
+        let response = await postChat(false);
+        if (response.status === 409) {
+            response = await postChat(true);
+        }
+        if (response.ok && response.headers.get('X-Conversation-Id')) {
+            serverConversationId = response.headers.get('X-Conversation-Id');
+            serverConversationLength = parseInt(response.headers.get('X-Conversation-Length'), 10) || 0;
+        }
 
         removeLoadingIndicator(loadingIndicator);
 
@@ -2582,6 +2592,7 @@ async function initializeChats() {
             // Clear any existing chat data when not authenticated
             currentChatId = null;
             chatHistory = [];
+            resetServerConversation();
             clearChatSidebar();
         }
     });
@@ -2882,6 +2893,7 @@ async function createNewChatSession() {
             
             // Set up the new chat state FIRST
             currentChatId = chatId;
+            resetServerConversation();
             localStorage.setItem('currentChatId', chatId);
 
             // Update URL with the new chat ID
@@ -2999,6 +3011,7 @@ async function loadChat(chatId) {
       
         // Set current chat ID
         currentChatId = chatId;
+        resetServerConversation();
         
         // Store current chat ID in localStorage for persistence between page reloads
         localStorage.setItem('currentChatId', chatId);
@@ -0,0 +1,339 @@
+"""Offline load test of /api/chat against a local fake provider
+
+Starts a stand-in for the OpenRouter, Groq, Together (OpenAI-compatible) and Cohere
+chat endpoints in a separate process and points the app at it through the
+*_API_BASE variables, so nothing leaves the machine. The fake provider answers after
+a log-normally distributed latency, can inject 500s and 429s (with Retry-After) at
+given rates, always fail selected models, and stream its replies token by token.
+
+The Flask app is then driven through its test client at each concurrency level.
+Reported per level: throughput, p50/p95/p99 latency, failed requests, and the
+fallbacks, retries and failed model attempts recorded by the app's metrics.
+--max-p95-ms and --min-rps turn the run into a regression gate: the script exits
+with status 1 if any level misses them.
+
+Usage:
+    python benchmarks/chat_load_bench.py [--concurrency 1 4 16] [--requests 200]
+        [--model deepseek/deepseek-r1:free] [--stream] [--latency-ms 50] [--latency-sigma 0.5]
+        [--error-rate 0.02] [--rate-limit-rate 0.02] [--fail-model agentica-org/deepcoder-14b-preview:free]
+        [--tokens 20] [--token-interval-ms 2] [--json results.json] [--max-p95-ms 500] [--min-rps 20]
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+PROVIDERS = ('openrouter', 'groq', 'together', 'cohere')
+
+
+# Fake provider
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """Serves /<provider>/chat/completions (OpenAI format) and /cohere/chat"""
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real providers
+    disable_nagle_algorithm = True  # Headers and body are separate writes; avoid delayed-ACK stalls
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/_stats':
+            with self.server.stats_lock:
+                stats = {f"{provider} {status}": count for (provider, status), count in self.server.stats.items()}
+            self._send_json(200, stats)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        provider = self.path.strip('/').split('/')[0]
+        if provider not in PROVIDERS:
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': 'invalid JSON'})
+            return
+
+        config = self.server.config
+        with self.server.stats_lock:
+            latency, error_draw, rate_limit_draw = self._latency(), self.server.rng.random(), self.server.rng.random()
+        time.sleep(latency)
+        if payload.get('model') in config['fail_models'] or error_draw < config['error_rate']:
+            self._count(provider, 500)
+            self._send_json(500, {'error': {'message': 'Injected server error', 'code': 500}})
+            return
+        if rate_limit_draw < config['rate_limit_rate']:
+            self._count(provider, 429)
+            self._send_json(429, {'error': {'message': 'Injected rate limit', 'code': 429}},
+                            {'Retry-After': str(config['retry_after'])})
+            return
+
+        self._count(provider, 200)
+        tokens = [f"tok{i} " for i in range(config['tokens'])]
+        if provider == 'cohere':
+            if payload.get('stream'):
+                events = [{'event_type': 'stream-start'}]
+                events += [{'event_type': 'text-generation', 'text': token} for token in tokens]
+                events.append({'event_type': 'stream-end', 'finish_reason': 'COMPLETE',
+                               'response': {'meta': {'billed_units': {'output_tokens': len(tokens)}}}})
+                self._send_stream('application/stream+json', [json.dumps(event) + '\n' for event in events])
+            else:
+                self._send_json(200, {'text': ''.join(tokens), 'meta': {'billed_units': {'output_tokens': len(tokens)}}})
+        elif payload.get('stream'):
+            chunks = [{'choices': [{'delta': {'content': token}}]} for token in tokens]
+            chunks.append({'choices': [{'delta': {}, 'finish_reason': 'stop'}],
+                           'usage': {'completion_tokens': len(tokens)}})
+            self._send_stream('text/event-stream', [f"data: {json.dumps(chunk)}\n\n" for chunk in chunks] + ['data: [DONE]\n\n'])
+        else:
+            self._send_json(200, {
+                'model': payload.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, 'finish_reason': 'stop'}],
+                'usage': {'completion_tokens': len(tokens)}
+            })
+
+    def _latency(self):
+        config = self.server.config
+        if config['latency_ms'] <= 0:
+            return 0
+        return self.server.rng.lognormvariate(math.log(config['latency_ms'] / 1000), config['latency_sigma'])
+
+    def _count(self, provider, status):
+        with self.server.stats_lock:
+            self.server.stats[(provider, status)] += 1
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, content_type, pieces):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        interval = self.server.config['token_interval_ms'] / 1000
+        for piece in pieces:
+            data = piece.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+            if interval:
+                time.sleep(interval)
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve_fake_provider(config, port_pipe):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeProviderHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.stats = Counter()
+    server.stats_lock = threading.Lock()  # Also guards rng
+    server.rng = random.Random(config['seed'])
+    port_pipe.send(server.server_address[1])
+    server.serve_forever()
+
+
+def start_fake_provider(config):
+    """Run the fake provider in its own process, so it does not compete with the app for the GIL"""
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve_fake_provider, args=(config, child), daemon=True)
+    process.start()
+    return process, parent.recv()
+
+
+# Load driver
+
+def metric_total(snapshot, name, include=lambda labels: True):
+    data = snapshot.get(name)
+    if not data:
+        return 0
+    return int(sum(value for labels, value in data['series'] if include(dict(zip(data['labelnames'], labels)))))
+
+
+def app_counters(metrics):
+    snapshot = metrics.registry_snapshot()
+    return {
+        'fallbacks': metric_total(snapshot, 'milkyai_chat_fallbacks_total'),
+        'retries': metric_total(snapshot, 'milkyai_upstream_retries_total'),
+        'failed_model_attempts': metric_total(snapshot, 'milkyai_model_attempts_total',
+                                              lambda labels: labels['outcome'] != 'success'),
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_level(app, metrics, concurrency, total, args):
+    """Send `total` chat requests from `concurrency` threads and summarize them"""
+    latencies = []
+    statuses = Counter()
+    results_lock = threading.Lock()
+    next_index = iter(range(total))
+    index_lock = threading.Lock()
+    history = [{'role': 'user', 'content': 'Earlier question about Python lists.'},
+               {'role': 'assistant', 'content': 'Lists are mutable sequences. ' * 20}]
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            payload = {
+                # Unique per request, so response caches (if enabled) never answer
+                'message': f"Benchmark question {concurrency}-{i}: how do tuples differ from lists?",
+                'model': args.model,
+                'chatHistory': history,
+                'stream': args.stream,
+            }
+            started = time.perf_counter()
+            response = client.post('/api/chat', json=payload)
+            response.get_data()  # Drains streamed responses
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] += 1
+
+    before = app_counters(metrics)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    after = app_counters(metrics)
+
+    latencies.sort()
+    result = {
+        'concurrency': concurrency,
+        'requests': total,
+        'seconds': round(wall, 3),
+        'rps': round(total / wall, 1) if wall else 0.0,
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'failed': sum(count for status, count in statuses.items() if status != 200),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+    }
+    result.update({key: after[key] - before[key] for key in after})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=200, help='requests per concurrency level')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--model', default='deepseek/deepseek-r1:free', help='model key sent as "model"')
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('--latency-ms', type=float, default=50, help='median fake provider latency')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='log-normal spread of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of upstream calls answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of upstream calls answered with 429')
+    parser.add_argument('--retry-after', type=float, default=0.05, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--fail-model', action='append', default=[], help='model id that always fails (repeatable)')
+    parser.add_argument('--tokens', type=int, default=20, help='tokens per completion')
+    parser.add_argument('--token-interval-ms', type=float, default=2, help='delay between streamed tokens')
+    parser.add_argument('--seed', type=int, default=1234, help='seed of the fake provider\'s latency and error draws')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--max-p95-ms', type=float, help='fail if any level has a higher p95 latency')
+    parser.add_argument('--min-rps', type=float, help='fail if any level has a lower throughput')
+    args = parser.parse_args()
+
+    config = {
+        'latency_ms': args.latency_ms,
+        'latency_sigma': args.latency_sigma,
+        'error_rate': args.error_rate,
+        'rate_limit_rate': args.rate_limit_rate,
+        'retry_after': args.retry_after,
+        'fail_models': set(args.fail_model),
+        'tokens': args.tokens,
+        'token_interval_ms': args.token_interval_ms,
+        'seed': args.seed,
+    }
+    process, port = start_fake_provider(config)
+    base = f"http://127.0.0.1:{port}"
+
+    # Point every provider at the fake one; short backoff keeps injected errors from dominating the run
+    for provider in PROVIDERS:
+        os.environ[f"{provider.upper()}_API_BASE"] = f"{base}/{provider}"
+        os.environ.setdefault(f"{provider.upper()}_API_KEY", 'benchmark-key')
+    os.environ.setdefault('RETRY_BASE_DELAY', '0.05')
+    os.environ.setdefault('RETRY_MAX_DELAY', '0.5')
+    os.environ.setdefault('LOG_LEVEL', 'error')
+    os.environ.setdefault('HTTP_POOL_WARMUP', 'false')
+    for name in ('CHAT_CACHE', 'CHAT_SEMANTIC_CACHE'):
+        os.environ.pop(name, None)
+
+    import app as app_module  # noqa: E402  (configured by the environment above)
+    from services import metrics  # noqa: E402
+
+    app = app_module.app
+    if args.model not in app_module.MODEL_OPTIONS:
+        parser.error(f"unknown model key {args.model}")
+    provider = app_module.MODEL_OPTIONS[args.model].get('provider', 'openrouter')
+    print(f"Fake provider on {base}; model {args.model} ({provider}), {'streamed' if args.stream else 'non-streamed'}, "
+          f"latency {args.latency_ms:g} ms (sigma {args.latency_sigma:g}), "
+          f"errors {args.error_rate:.0%}, 429s {args.rate_limit_rate:.0%}")
+
+    try:
+        if args.warmup:
+            run_level(app, metrics, 1, args.warmup, args)
+        results = [run_level(app, metrics, concurrency, args.requests, args) for concurrency in args.concurrency]
+        with urllib.request.urlopen(f"{base}/_stats") as response:
+            upstream = json.load(response)
+    finally:
+        process.terminate()
+
+    print()
+    print(f"{'conc':>5} {'req/s':>8} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'failed':>7} {'fallbk':>7} {'retries':>8} {'bad att':>8}")
+    for r in results:
+        print(f"{r['concurrency']:>5} {r['rps']:>8.1f} {r['mean_ms']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['failed']:>7} {r['fallbacks']:>7} {r['retries']:>8} {r['failed_model_attempts']:>8}")
+    print("(latencies in ms; 'bad att' counts failed, empty, rate limited and circuit-open model attempts)")
+    print(f"Fake provider responses, including warmup: {upstream}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'config': dict(config, fail_models=sorted(config['fail_models']), model=args.model,
+                                      stream=args.stream), 'results': results,
+                       'upstream_responses': upstream}, f, indent=2)
+
+    failures = []
+    for r in results:
+        if args.max_p95_ms is not None and r['p95_ms'] > args.max_p95_ms:
+            failures.append(f"concurrency {r['concurrency']}: p95 {r['p95_ms']} ms > {args.max_p95_ms:g} ms")
+        if args.min_rps is not None and r['rps'] < args.min_rps:
+            failures.append(f"concurrency {r['concurrency']}: {r['rps']} req/s < {args.min_rps:g} req/s")
+    if failures:
+        print("\nFAILED: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark cold starts of the Vercel entry point
+
+Each run starts a fresh interpreter, imports api.index and serves one request through
+Flask's test client, the way a serverless instance handles its first request. Reported
+per path: interpreter-to-import time, import time of api.index, time of the first
+request and the total time to first response, as medians over all runs.
+
+Usage:
+    python benchmarks/cold_start_bench.py [--runs 5] [--path /api/health --path /login]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from api.index import app
+imported = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+responded = time.perf_counter()
+print(json.dumps({'status': response.status_code, 'import': imported - started, 'request': responded - imported}))
+"""
+
+
+def cold_start(path):
+    """Run one cold start and return its timings in seconds"""
+    spawned = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CHILD, path], cwd=ROOT, capture_output=True, text=True)
+    total = time.perf_counter() - spawned
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start for {path} failed:\n{result.stderr}")
+    # The app prints diagnostics; the timings are on the last line
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['total'] = total
+    timings['interpreter'] = total - timings['import'] - timings['request']
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', action='append', help='path to request (repeatable, default /api/health and /login)')
+    args = parser.parse_args()
+
+    for path in args.path or ['/api/health', '/login']:
+        runs = [cold_start(path) for _ in range(args.runs)]
+        median = {key: statistics.median(run[key] for run in runs) * 1000
+                  for key in ('interpreter', 'import', 'request', 'total')}
+        print(f"{path:<16} status {runs[-1]['status']}  interpreter {median['interpreter']:7.1f} ms  "
+              f"import {median['import']:7.1f} ms  first request {median['request']:7.1f} ms  "
+              f"time to first response {median['total']:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark token estimation and context assembly on long chat histories
+
+Builds synthetic histories (default 500 messages of mixed length, including some
+non-ASCII text) and times estimate_tokens over the whole history plus fit_messages
+against an 8k and a 128k context window.
+
+Usage:
+    python benchmarks/context_budget_bench.py [--messages 500] [--runs 200]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from services.context_budget import estimate_tokens, fit_messages  # noqa: E402
+
+SNIPPETS = [
+    "How do I read a JSON file in Python and handle missing keys?",
+    "Here is an example using json.load and dict.get with a default value. ",
+    "def parse(path):\n    with open(path) as f:\n        return json.load(f)\n",
+    "Explique-moi la différence entre une liste et un tuple, s'il te plaît.",
+    "日本語の文章を要約してください。できるだけ短くお願いします。",
+    "Sure! 🚀 Let's break this down step by step. ",
+]
+
+
+def make_history(count, rng):
+    history = [{'role': 'system', 'content': "You are NumAI, a helpful assistant. " * 40}]
+    for i in range(count):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        repeats = rng.choice((1, 2, 5, 20, 60))
+        history.append({'role': role, 'content': ''.join(rng.choice(SNIPPETS) for _ in range(repeats))})
+    return history
+
+
+def timed(fn, runs):
+    fn()
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - started) * 1000 / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    history = make_history(args.messages, random.Random(args.seed))
+    chars = sum(len(msg['content']) for msg in history)
+    tokens = sum(estimate_tokens(msg['content']) for msg in history)
+    print(f"history: {len(history)} messages, {chars} characters, ~{tokens} estimated tokens")
+
+    estimate_ms = timed(lambda: [estimate_tokens(msg['content']) for msg in history], args.runs)
+    print(f"estimate_tokens over all messages: {estimate_ms:.3f} ms")
+
+    for window in (8192, 131072):
+        fit_ms = timed(lambda: fit_messages(history, window), args.runs)
+        kept = len(fit_messages(history, window))
+        print(f"fit_messages to {window:>6} tokens: {fit_ms:.3f} ms, kept {kept}/{len(history)} messages")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Benchmark the JSON work of one non-streamed chat turn
+
+Simulates a long deep-thinking conversation and times the three passes of a turn:
+encoding the provider payload, reading the completion and encoding the reply for the
+browser. Compares the standard library, the fast codec (orjson, if installed) and the
+fast codec with passthrough, where the completion content is sliced out of the body.
+
+Usage:
+    python benchmarks/json_codec_bench.py [--messages 200] [--reply-chars 20000] [--rounds 200]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from services import json_codec  # noqa: E402
+
+WORDS = "the model thinks about data code error reasoning step answer because therefore 数据 模型 😀".split()
+
+
+def text(rng, chars):
+    words = []
+    while sum(len(w) + 1 for w in words) < chars:
+        words.append(rng.choice(WORDS))
+    return ' '.join(words)
+
+
+def completion_body(rng, reply_chars):
+    """An OpenRouter-style completion with a long reasoning trace, as raw bytes"""
+    return json.dumps({
+        'id': 'gen-123', 'provider': 'bench', 'model': 'deepseek/deepseek-r1:free', 'object': 'chat.completion',
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {
+            'role': 'assistant', 'content': text(rng, reply_chars), 'refusal': None,
+            'reasoning': text(rng, reply_chars * 2)}}],
+        'usage': {'prompt_tokens': 5000, 'completion_tokens': 3000, 'total_tokens': 8000}
+    }).encode('utf-8')
+
+
+def turn_stdlib(payload, body, metadata):
+    data = json.dumps(payload)
+    message = json.loads(body)['choices'][0]['message']['content']
+    return data, json.dumps(dict(metadata, response=message))
+
+
+def turn_fast(payload, body, metadata):
+    data = json_codec.dumps_bytes(payload)
+    message = json_codec.loads(body)['choices'][0]['message']['content']
+    return data, json_codec.dumps_bytes(dict(metadata, response=message))
+
+
+def turn_passthrough(payload, body, metadata):
+    data = json_codec.dumps_bytes(payload)
+    message = json_codec.extract_completion_content(body)
+    return data, json_codec.splice_json({'response': message}, metadata)
+
+
+def timed(func, args, rounds):
+    func(*args)  # warm-up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func(*args)
+    return (time.perf_counter() - started) * 1000 / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--reply-chars', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    payload = {'model': 'deepseek/deepseek-r1:free', 'max_tokens': 2000, 'messages': [
+        {'role': 'user' if i % 2 else 'assistant', 'content': text(rng, 1500)} for i in range(args.messages)]}
+    body = completion_body(rng, args.reply_chars)
+    metadata = {'model_used': 'deepseek/deepseek-r1:free', 'model_key': 'deepseek/deepseek-r1:free',
+                'model_display_name': 'Mind Zephyr'}
+    turn_args = (payload, body, metadata)
+
+    print(f"payload {len(json_codec.dumps_bytes(payload)) / 1e3:.0f} KB, completion {len(body) / 1e3:.0f} KB, codec {json_codec.CODEC}")
+    baseline = timed(turn_stdlib, turn_args, args.rounds)
+    print(f"  stdlib json          {baseline:8.3f} ms/turn")
+    for name, func in (('fast codec', turn_fast), ('fast + passthrough', turn_passthrough)):
+        elapsed = timed(func, turn_args, args.rounds)
+        print(f"  {name:<20} {elapsed:8.3f} ms/turn  ({baseline / elapsed:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
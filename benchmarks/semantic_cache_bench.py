@@ -0,0 +1,97 @@
+"""Benchmark semantic cache lookups against a large per-model index
+
+Fills one model's index with synthetic prompts, a few per context key as with
+rephrased prompts, and times top-1 lookups (embedding plus the similarity search over
+the rows of the key) for several index sizes.
+
+Usage:
+    python benchmarks/semantic_cache_bench.py [--entries 100000] [--dim 256] [--lookups 500]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+from services.semantic_cache import SemanticCache  # noqa: E402
+
+# Entries sharing one context key
+ROWS_PER_CONTEXT = 4
+
+WORDS = ("python java rust code error install explain write function class list dict "
+         "api model data train deploy server cloud file read parse json http request "
+         "what how why when which best fast slow make use learn fix debug test").split()
+
+
+def random_prompt(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+
+
+def fill(cache, entries, rng):
+    """Bulk-load an index directly, bypassing add() so large sizes load quickly"""
+    cache.add('bench', 0, random_prompt(rng), {'response': 'seed'})
+    index = cache._indexes['bench']
+    while len(index.replies) < entries:
+        index._grow()
+    now = time.monotonic()
+    vectors = np.stack([cache.embedder.embed(random_prompt(rng)) for _ in range(min(entries, 5000))])
+    for start in range(0, entries, len(vectors)):
+        rows = min(len(vectors), entries - start)
+        index.vectors[start:start + rows] = vectors[:rows]
+    index.contexts[:entries] = np.arange(entries) // ROWS_PER_CONTEXT
+    index.expires[:entries] = now + cache.ttl
+    index.last_used[:entries] = now
+    index.replies[:entries] = [{'response': str(i)} for i in range(entries)]
+    index.rows_by_context = {}
+    for row in range(entries):
+        index.rows_by_context.setdefault(row // ROWS_PER_CONTEXT, []).append(row)
+    index.size = entries
+
+
+def bench(entries, dim, lookups, rng):
+    cache = SemanticCache(capacity=entries, dim=dim)
+    fill(cache, entries, rng)
+    queries = [random_prompt(rng) for _ in range(lookups)]
+    contexts = [rng.randrange(entries // ROWS_PER_CONTEXT or 1) for _ in range(lookups)]
+
+    vectors = [cache.embedder.embed(q) for q in queries]
+    index = cache._indexes['bench']
+    for vector, context in list(zip(vectors, contexts))[:20]:
+        index.search(vector, context, time.monotonic())  # warm-up
+
+    started = time.perf_counter()
+    for vector, context in zip(vectors, contexts):
+        index.search(vector, context, time.monotonic())
+    search_ms = (time.perf_counter() - started) * 1000 / lookups
+
+    started = time.perf_counter()
+    for query, context in zip(queries, contexts):
+        cache.lookup('bench', context, query)
+    lookup_ms = (time.perf_counter() - started) * 1000 / lookups
+
+    matrix_mb = index.vectors[:entries].nbytes / 1e6
+    print(f"{entries:>8} entries  dim {dim:>4}  matrix {matrix_mb:7.1f} MB  "
+          f"search {search_ms:7.3f} ms  lookup (embed + search) {lookup_ms:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=None, help='embedding dimensions (default: CHAT_SEMANTIC_CACHE_DIM or 256)')
+    parser.add_argument('--lookups', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    dim = args.dim or SemanticCache().embedder.dim
+    sizes = sorted({size for size in (1000, 10000, args.entries) if size <= args.entries})
+    for entries in sizes:
+        bench(entries, dim, args.lookups, rng)
+
+
+if __name__ == '__main__':
+    main()
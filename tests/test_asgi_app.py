@@ -0,0 +1,39 @@
+import asyncio
+
+from api import asgi
+
+
+def run(handler, monkeypatch):
+    monkeypatch.setitem(asgi.ASYNC_ROUTES, ('POST', '/api/test'), handler)
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.app({'type': 'http', 'method': 'POST', 'path': '/api/test', 'headers': []}, receive, send))
+    return messages
+
+
+def test_error_before_the_response_starts_is_a_500(monkeypatch):
+    async def handler(request_obj, receive, send):
+        raise RuntimeError('boom')
+
+    messages = run(handler, monkeypatch)
+    assert [m['type'] for m in messages] == ['http.response.start', 'http.response.body']
+    assert messages[0]['status'] == 500
+
+
+def test_error_after_the_response_started_only_ends_the_body(monkeypatch):
+    async def handler(request_obj, receive, send):
+        async def chunks():
+            yield 'data: {"delta":"Hel"}\n\n'
+            raise RuntimeError('boom')
+        await asgi.send_event_stream(send, request_obj, chunks())
+
+    messages = run(handler, monkeypatch)
+    starts = [m for m in messages if m['type'] == 'http.response.start']
+    assert len(starts) == 1 and starts[0]['status'] == 200
+    assert messages[-1] == {'type': 'http.response.body', 'body': b''}
@@ -0,0 +1,96 @@
+import asyncio
+import base64
+import json
+
+import pytest
+
+from api import asgi
+from api.services.audio_cache import AudioCache
+from api.services.voice_catalog import VoiceCatalog
+
+VOICES = [
+    {'ShortName': 'en-US-AvaNeural', 'Locale': 'en-US', 'Gender': 'Female', 'FriendlyName': 'Ava'},
+    {'ShortName': 'en-GB-SoniaNeural', 'Locale': 'en-GB', 'Gender': 'Female', 'FriendlyName': 'Sonia'},
+]
+
+
+def asgi_request(path, payload):
+    """POST a JSON body to the ASGI app; returns (response start message, body bytes)"""
+    messages = []
+    body = json.dumps(payload).encode()
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'headers': [(b'content-type', b'application/json')]}
+    asyncio.run(asgi.app(scope, receive, send))
+    starts = [m for m in messages if m['type'] == 'http.response.start']
+    assert len(starts) == 1
+    return starts[0], b''.join(m.get('body', b'') for m in messages if m['type'] == 'http.response.body')
+
+
+def call_asgi(path, payload):
+    """POST a JSON body to the ASGI app; returns (status, decoded JSON body)"""
+    start, body = asgi_request(path, payload)
+    return start['status'], json.loads(body)
+
+
+@pytest.fixture
+def tts(monkeypatch, tmp_path):
+    calls = []
+
+    async def fake_synthesize(text, voice, options=None):
+        calls.append((text, voice, options))
+        return f'{voice}:{text}'.encode()
+
+    monkeypatch.setattr(asgi.flask_module, 'edge_tts_available', lambda: True)
+    monkeypatch.setattr(asgi.flask_module, 'synthesize_speech', fake_synthesize)
+    catalog = VoiceCatalog(fetch=lambda: VOICES, path='')
+    cache = AudioCache(memory_bytes=1024 * 1024, disk_bytes=1024 * 1024, directory=str(tmp_path))
+    monkeypatch.setattr(asgi, 'get_voice_catalog', lambda: catalog)
+    monkeypatch.setattr(asgi, 'get_audio_cache', lambda: cache)
+    return calls
+
+
+def test_edge_tts_synthesizes_and_caches(tts):
+    status, body = call_asgi('/api/edge-tts', {'text': 'hello', 'voice': 'en-US-AvaNeural', 'rate': '+10%'})
+    assert status == 200
+    assert base64.b64decode(body['audio']) == b'en-US-AvaNeural:hello'
+    assert body['voice_used'] == 'en-US-AvaNeural'
+    assert tts == [('hello', 'en-US-AvaNeural', {'rate': '+10%'})]
+
+    status, body = call_asgi('/api/edge-tts', {'text': 'hello', 'voice': 'en-US-AvaNeural', 'rate': '+10%'})
+    assert status == 200
+    assert base64.b64decode(body['audio']) == b'en-US-AvaNeural:hello'
+    assert len(tts) == 1  # Served from the audio cache
+
+
+def test_edge_tts_resolves_unknown_voice(tts):
+    status, body = call_asgi('/api/edge-tts', {'text': 'hi', 'voice': 'en-GB-MichelleNeural'})
+    assert status == 200
+    assert body['voice_used'] == 'en-GB-SoniaNeural'
+    assert body['requested_voice'] == 'en-GB-MichelleNeural'
+    assert tts[0][1] == 'en-GB-SoniaNeural'
+
+
+def test_edge_tts_requires_text_and_voice(tts):
+    status, body = call_asgi('/api/edge-tts', {'text': 'hi'})
+    assert status == 400
+    assert tts == []
+
+
+def test_edge_tts_is_counted_and_traced(tts):
+    requests = asgi.flask_module.REQUESTS
+    synthesized = requests.labels('tts', 'edge-tts', '200').value
+    cached = requests.labels('tts', 'cache', '200').value
+
+    start, _ = asgi_request('/api/edge-tts', {'text': 'traced', 'voice': 'en-US-AvaNeural'})
+    server_timing = dict(start['headers'])[b'server-timing'].decode()
+    assert 'voices;dur=' in server_timing and 'synthesis;dur=' in server_timing and 'total;dur=' in server_timing
+    assert requests.labels('tts', 'edge-tts', '200').value == synthesized + 1
+
+    asgi_request('/api/edge-tts', {'text': 'traced', 'voice': 'en-US-AvaNeural'})
+    assert requests.labels('tts', 'cache', '200').value == cached + 1
@@ -0,0 +1,42 @@
+import os
+import stat
+import tempfile
+
+import pytest
+
+from api.services.audio_cache import AudioCache
+
+KEY = 'a' * 64
+
+
+@pytest.fixture
+def tmpdir_root(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.delenv('TTS_CACHE_DIR', raising=False)
+    return tmp_path
+
+
+def test_default_directory_is_private(tmpdir_root):
+    cache = AudioCache(memory_bytes=0, disk_bytes=1024)
+    assert cache.directory == str(tmpdir_root / f'milkyai-{os.getuid()}' / 'tts-cache')
+    assert stat.S_IMODE(os.stat(os.path.dirname(cache.directory)).st_mode) == 0o700
+    cache.put(KEY, b'audio')
+    assert os.listdir(cache.directory) == [f'{KEY}.mp3']
+    assert AudioCache(memory_bytes=0, disk_bytes=1024).get(KEY) == b'audio'
+
+
+def test_shared_parent_disables_the_disk_tier(tmpdir_root):
+    shared = tmpdir_root / f'milkyai-{os.getuid()}'
+    shared.mkdir()
+    shared.chmod(0o777)
+    cache = AudioCache(memory_bytes=0, disk_bytes=1024)
+    assert cache.disk_limit == 0
+    cache.put(KEY, b'audio')
+    assert not (shared / 'tts-cache').exists()
+
+
+def test_planted_symlinks_are_not_served(tmp_path):
+    target = tmp_path / 'secret'
+    target.write_bytes(b'not audio')
+    (tmp_path / f'{KEY}.mp3').symlink_to(target)
+    assert AudioCache(memory_bytes=0, disk_bytes=1024, directory=str(tmp_path)).get(KEY) is None
@@ -0,0 +1,25 @@
+from api.services.conversation_store import ConversationStore, SharedConversationStore, create_conversation_store
+from api.services.session_store import SQLiteBackend
+
+MESSAGES = [{'role': 'user', 'content': 'Hi'}, {'role': 'assistant', 'content': 'Hello!'}]
+
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    worker_a = SharedConversationStore(SQLiteBackend(path, table='conversations'))
+    worker_b = SharedConversationStore(SQLiteBackend(path, table='conversations'))
+
+    worker_a.put('c1', 'user-1', MESSAGES)
+    assert worker_b.get('c1', 'user-1', expected_length=2) == (MESSAGES, 2)
+    assert worker_b.get('c1', 'user-2') is None
+    assert worker_b.get('c1', 'user-1', expected_length=4) is None
+    assert worker_b.stats()['conversations'] == 1
+
+
+def test_backend_follows_shared_session_backend(monkeypatch, tmp_path):
+    monkeypatch.delenv('CHAT_CONVERSATION_BACKEND', raising=False)
+    monkeypatch.setenv('SESSION_SQLITE_PATH', str(tmp_path / 'sessions.db'))
+    monkeypatch.setenv('SESSION_BACKEND', 'sqlite')
+    assert create_conversation_store().name == 'sqlite'
+    monkeypatch.setenv('SESSION_BACKEND', 'cookie')
+    assert isinstance(create_conversation_store(), ConversationStore)
@@ -0,0 +1,28 @@
+from api.services.env import env_flag, env_number, provider_env_number
+
+
+def test_numbers_fall_back_to_the_default(monkeypatch):
+    monkeypatch.setenv('TEST_NUMBER', '2.5')
+    assert env_number('TEST_NUMBER', 1) == 2.5
+    monkeypatch.setenv('TEST_NUMBER', 'lots')
+    assert env_number('TEST_NUMBER', 1, int) == 1
+    monkeypatch.setenv('TEST_NUMBER', '')
+    assert env_number('TEST_NUMBER', 3, int) == 3
+    monkeypatch.delenv('TEST_NUMBER')
+    assert env_number('TEST_NUMBER', 4, int) == 4
+
+
+def test_provider_setting_takes_precedence(monkeypatch):
+    monkeypatch.setenv('TEST_LIMIT', '5')
+    assert provider_env_number('TEST_LIMIT', 'groq', 1, int) == 5
+    monkeypatch.setenv('TEST_LIMIT_GROQ', '7')
+    assert provider_env_number('TEST_LIMIT', 'groq', 1, int) == 7
+    assert provider_env_number('TEST_LIMIT', 'cohere', 1, int) == 5
+
+
+def test_flags(monkeypatch):
+    assert env_flag('TEST_FLAG') is False
+    assert env_flag('TEST_FLAG', True) is True
+    for value, expected in (('1', True), (' Yes ', True), ('ON', True), ('false', False), ('', False)):
+        monkeypatch.setenv('TEST_FLAG', value)
+        assert env_flag('TEST_FLAG', True) is expected
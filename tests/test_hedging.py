@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from api.services import hedging
+
+
+@pytest.fixture
+def fresh_executor(monkeypatch):
+    monkeypatch.setattr(hedging, '_executor', None)
+    yield
+    if hedging._executor is not None:
+        hedging._executor.shutdown(wait=False)
+
+
+def test_pool_covers_the_fanout_of_every_concurrent_request(fresh_executor, monkeypatch):
+    monkeypatch.setenv('CHAT_HEDGE_FANOUT', '3')
+    monkeypatch.setenv('CHAT_HEDGE_CONCURRENCY', '4')
+    monkeypatch.delenv('CHAT_HEDGE_WORKERS', raising=False)
+    assert hedging._get_executor()._max_workers == 12
+
+
+def test_cancelled_attempt_frees_its_slot(fresh_executor, monkeypatch):
+    monkeypatch.setenv('CHAT_HEDGE_WORKERS', '2')
+    loser_done = threading.Event()
+
+    def attempt(candidate, cancel_event):
+        if candidate == 'slow':
+            # Stands in for a retry backoff, which ends as soon as the attempt is cancelled
+            cancelled = cancel_event.wait(30)
+            loser_done.set()
+            raise RuntimeError('cancelled' if cancelled else 'timed out')
+        return 'answer'
+
+    assert hedging.run_hedged(['slow', 'fast'], attempt, lambda candidate: 0, 2) == ('fast', 'answer')
+    assert loser_done.wait(5)
+
+    # Both pool threads are free again: two tasks that wait for each other both finish
+    barrier = threading.Barrier(2, timeout=5)
+    executor = hedging._get_executor()
+    futures = [executor.submit(barrier.wait) for _ in range(2)]
+    assert sorted(future.result(timeout=5) for future in futures) == [0, 1]
@@ -0,0 +1,36 @@
+import json
+import subprocess
+import sys
+
+from api import app as flask_app
+from api.services import metrics
+
+
+def test_gauges_of_exited_workers_are_not_merged(monkeypatch, tmp_path):
+    monkeypatch.setenv('METRICS_MULTIPROC_DIR', str(tmp_path))
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    snapshot = {
+        'milkyai_test_pending': {'type': 'gauge', 'help': 'Pending', 'labelnames': [], 'series': [[[], 7.0]]},
+        'milkyai_test_total': {'type': 'counter', 'help': 'Total', 'labelnames': [], 'series': [[[], 3.0]]},
+    }
+    (tmp_path / f'{exited.pid}.json').write_text(json.dumps(snapshot))
+
+    merged = metrics.collect()
+    assert merged['milkyai_test_total']['_series'][()] == 3.0
+    assert 'milkyai_test_pending' not in merged
+
+
+def test_metrics_endpoint_is_closed_by_default(monkeypatch):
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    monkeypatch.delenv('METRICS_PUBLIC', raising=False)
+    client = flask_app.app.test_client()
+    assert client.get('/metrics').status_code == 404
+
+    monkeypatch.setenv('METRICS_TOKEN', 'scrape-secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'}).status_code == 200
+
+    monkeypatch.delenv('METRICS_TOKEN')
+    monkeypatch.setenv('METRICS_PUBLIC', 'true')
+    assert client.get('/metrics').status_code == 200
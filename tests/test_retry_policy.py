@@ -0,0 +1,39 @@
+import pytest
+import requests
+
+from api import app as flask_app
+from api.services.retry_policy import RetryPolicy
+
+
+class FakeResponse:
+    status_code = 503
+    headers = {}
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.calls = 0
+
+    def post(self, **kwargs):
+        self.calls += 1
+        return FakeResponse()
+
+
+def test_can_retry_honours_a_larger_override():
+    policy = RetryPolicy('test', deadline=60, max_attempts=2, min_attempt_time=0.1)
+    deadline = policy.new_deadline()
+    assert not policy.can_retry(1, 0, deadline)
+    assert policy.can_retry(1, 0, deadline, max_attempts=4)
+    assert not policy.can_retry(3, 0, deadline, max_attempts=4)
+
+
+def test_max_retries_above_the_policy_limit_is_used(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(flask_app, 'get_session', lambda provider: session)
+    monkeypatch.setattr(flask_app.time, 'sleep', lambda seconds: None)
+    with pytest.raises(requests.exceptions.HTTPError):
+        flask_app.request_with_retries('groq', 'http://upstream.invalid', {}, '{}', max_retries=4)
+    assert session.calls == 4
@@ -0,0 +1,42 @@
+import pytest
+
+from api.services.semantic_cache import SemanticCache, make_context_key
+
+
+def cached_reply(cache, stored, asked):
+    context, text = make_context_key(False, 'system', [], stored)
+    cache.add('model', context, text, {'response': stored})
+    context, text = make_context_key(False, 'system', [], asked)
+    return cache.lookup('model', context, text)
+
+
+@pytest.mark.parametrize('stored, asked', [
+    ("Write a Python function that checks whether a given string is a palindrome, ignoring case and punctuation.",
+     "Write a JavaScript function that checks whether a given string is a palindrome, ignoring case and punctuation."),
+    ("What is the capital city of Australia and what is its population?",
+     "What is the capital city of Austria and what is its population?"),
+    ("Is 7 a prime number?", "Is 9 a prime number?"),
+    ("Is it safe to eat raw eggs?", "Is it not safe to eat raw eggs?"),
+    ("Where was Albert Einstein born?", "When was Albert Einstein born?"),
+])
+def test_prompts_that_differ_in_a_content_word_never_match(stored, asked):
+    assert cached_reply(SemanticCache(), stored, asked) is None
+
+
+@pytest.mark.parametrize('stored, asked', [
+    ("what is python", "What's Python?"),
+    ("What is the capital of France?", "what's the capital of france"),
+])
+def test_rephrased_prompts_match(stored, asked):
+    reply, similarity = cached_reply(SemanticCache(), stored, asked)
+    assert reply == {'response': stored}
+    assert similarity >= 0.95
+
+
+def test_evicted_rows_leave_their_context():
+    cache = SemanticCache(capacity=1)
+    assert cached_reply(cache, "what is python", "what is python")
+    assert cached_reply(cache, "what is rust", "what is rust")
+    context, text = make_context_key(False, 'system', [], "what is python")
+    assert cache.lookup('model', context, text) is None
+    assert cache.evictions == 1
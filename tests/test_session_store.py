@@ -0,0 +1,48 @@
+import os
+import stat
+import tempfile
+
+import pytest
+
+from api.services import session_store
+
+
+@pytest.fixture
+def tmpdir_root(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.delenv('SESSION_SECRET_KEY', raising=False)
+    monkeypatch.delenv('SESSION_SECRET_FILE', raising=False)
+    monkeypatch.delenv('VERCEL_ENV', raising=False)
+    return tmp_path
+
+
+def test_default_key_file_is_private_and_reused(tmpdir_root):
+    key = session_store.load_secret_keys()[0]
+    directory = tmpdir_root / f'milkyai-{os.getuid()}'
+    assert stat.S_IMODE(directory.stat().st_mode) == 0o700
+    assert stat.S_IMODE((directory / 'session.key').stat().st_mode) == 0o600
+    assert session_store.load_secret_keys()[0] == key
+
+
+def test_key_file_readable_by_others_is_rejected(tmpdir_root, monkeypatch):
+    path = tmpdir_root / 'planted.key'
+    path.write_text('attacker-known-key')
+    path.chmod(0o644)
+    monkeypatch.setenv('SESSION_SECRET_FILE', str(path))
+    assert session_store.load_secret_keys()[0] != 'attacker-known-key'
+
+
+def test_shared_private_dir_is_rejected(tmpdir_root):
+    directory = tmpdir_root / f'milkyai-{os.getuid()}'
+    directory.mkdir(mode=0o777)
+    directory.chmod(0o777)
+    with pytest.raises(OSError):
+        session_store.private_dir()
+    session_store.load_secret_keys()
+    assert not (directory / 'session.key').exists()
+
+
+def test_production_requires_secret_key(tmpdir_root, monkeypatch):
+    monkeypatch.setenv('VERCEL_ENV', 'production')
+    session_store.load_secret_keys()
+    assert not (tmpdir_root / f'milkyai-{os.getuid()}').exists()
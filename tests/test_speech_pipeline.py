@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from api.services.speech_pipeline import (FIRST_SEGMENT_CHARS, _blocks, _sentences, pipelined_chunks,
+                                          split_speech_segments)
+
+
+def test_abbreviations_and_initials_do_not_end_a_sentence():
+    assert _sentences("Use a runner, e.g. pytest. Ask Dr. Smith or J. Doe first! Then go.") == [
+        "Use a runner, e.g. pytest.", "Ask Dr. Smith or J. Doe first!", "Then go."
+    ]
+
+
+def test_list_numbers_do_not_end_a_sentence_but_items_are_blocks():
+    assert _sentences("1. Install the package") == ["1. Install the package"]
+    assert _blocks("Steps:\n1. Install it\n2. Run it") == [
+        ('prose', 'Steps:'), ('prose', '1. Install it'), ('prose', '2. Run it')
+    ]
+
+
+def test_heading_ends_before_the_text_below_it():
+    assert _blocks("Intro\n## Setup\nInstall it") == [
+        ('prose', 'Intro'), ('prose', '## Setup'), ('prose', 'Install it')
+    ]
+
+
+def test_code_fences_are_kept_whole_and_split_only_between_lines():
+    text = "Run this:\n```python\nx = 1. + 2\n\nprint(x)\n```\nDone."
+    assert _blocks(text) == [
+        ('prose', 'Run this:'), ('code', ['```python', 'x = 1. + 2', '', 'print(x)', '```']), ('prose', 'Done.')
+    ]
+    code_line = 'value = compute(' + ', '.join(f'arg{i}' for i in range(40)) + ')'
+    segments = split_speech_segments("```\n" + "\n".join([code_line] * 3) + "\n```", max_chars=400)
+    assert all(line == code_line or line == '```' for segment in segments for line in segment.split('\n'))
+
+
+def test_first_segment_is_short_and_no_text_is_lost():
+    text = " ".join(f"This is sentence number {i} of a long answer." for i in range(40))
+    segments = split_speech_segments(text, max_chars=300)
+    assert len(segments[0]) <= FIRST_SEGMENT_CHARS
+    assert all(len(segment) <= 300 for segment in segments)
+    assert " ".join(segments) == text
+
+
+def collect(segments, synthesize, concurrency):
+    async def run():
+        return [chunk async for chunk in pipelined_chunks(segments, synthesize, concurrency)]
+    return asyncio.run(run())
+
+
+def test_chunks_come_out_in_segment_order():
+    running = {'now': 0, 'peak': 0}
+
+    async def synthesize(segment):
+        running['now'] += 1
+        running['peak'] = max(running['peak'], running['now'])
+        # Later segments finish first
+        await asyncio.sleep(0.01 * (5 - int(segment)))
+        for part in 'ab':
+            yield f"{segment}{part}"
+        running['now'] -= 1
+
+    assert collect(list('01234'), synthesize, 3) == [f"{i}{part}" for i in range(5) for part in 'ab']
+    assert running['peak'] == 3
+
+
+def test_failure_is_raised_and_cancels_the_remaining_segments():
+    cancelled = []
+
+    async def synthesize(segment):
+        if segment == 'bad':
+            raise RuntimeError('synthesis failed')
+        try:
+            await asyncio.sleep(0 if segment == 'first' else 10)
+        except asyncio.CancelledError:
+            cancelled.append(segment)
+            raise
+        yield segment
+
+    with pytest.raises(RuntimeError, match='synthesis failed'):
+        collect(['first', 'bad', 'slow'], synthesize, 3)
+    assert cancelled == ['slow']
@@ -0,0 +1,23 @@
+import asyncio
+
+from api.routes import tts
+
+
+def test_concurrent_identical_requests_never_expose_a_partial_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(tts, 'speech_file_path', lambda cache_key: str(tmp_path / f'speech_{cache_key}.mp3'))
+
+    async def fake_chunks(text, voice, options=None):
+        for i in range(5):
+            await asyncio.sleep(0)
+            yield f'{text}-{i};'.encode()
+
+    monkeypatch.setattr(tts, 'speech_chunks', fake_chunks)
+
+    async def both():
+        return await asyncio.gather(*(tts.generate_speech('hello', 'en-US-AvaNeural', cache_key='k') for _ in range(2)))
+
+    results = asyncio.run(both())
+    expected = b''.join(f'hello-{i};'.encode() for i in range(5))
+    assert [audio for _, audio in results] == [expected, expected]
+    assert (tmp_path / 'speech_k.mp3').read_bytes() == expected
+    assert [path.name for path in tmp_path.iterdir()] == ['speech_k.mp3']